@@ -0,0 +1,69 @@
+"""Incident fingerprint
+
+Revision ID: a3f1c2d4e5b6
+Revises: 7bcf9c57e725
+Create Date: 2026-10-17 10:12:41.204518
+
+"""
+import hashlib
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f1c2d4e5b6'
+down_revision = '7bcf9c57e725'
+branch_labels = None
+depends_on = None
+
+
+def _fingerprint(kind, *parts):
+    # mesma regra de api.rules.incident_fingerprint
+    key = "|".join([kind, *("" if p is None else str(p) for p in parts)])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def upgrade():
+    with op.batch_alter_table('incidents', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fingerprint', sa.String(), nullable=True))
+
+    # Backfill: incidentes antigos eram um por (tenant, kind); o contexto guardado define o fingerprint
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("SELECT id, kind, context_json FROM incidents")).fetchall()
+    for id_, kind, ctx in rows:
+        if isinstance(ctx, str):
+            try:
+                ctx = json.loads(ctx)
+            except ValueError:
+                ctx = None
+        ctx = ctx or {}
+        if kind == 'brute_force':
+            fp = _fingerprint(kind, ctx.get('src_ip'), ctx.get('username'))
+        elif kind == 'critical_change':
+            fp = _fingerprint(kind, ctx.get('host'), ctx.get('event_type'))
+        else:
+            fp = _fingerprint(kind)
+        conn.execute(sa.text("UPDATE incidents SET fingerprint = :fp WHERE id = :id"), {"fp": fp, "id": id_})
+
+    # Incidentes que caem no mesmo fingerprint viram um só antes do índice único: fica a linha
+    # mais recente (contexto, severidade e status atuais) com a soma das contagens e o período todo
+    conn.execute(sa.text(
+        "UPDATE incidents SET "
+        "count = (SELECT SUM(d.count) FROM incidents d WHERE d.tenant_id = incidents.tenant_id AND d.fingerprint = incidents.fingerprint), "
+        "first_seen = (SELECT MIN(d.first_seen) FROM incidents d WHERE d.tenant_id = incidents.tenant_id AND d.fingerprint = incidents.fingerprint), "
+        "last_seen = (SELECT MAX(d.last_seen) FROM incidents d WHERE d.tenant_id = incidents.tenant_id AND d.fingerprint = incidents.fingerprint) "
+        "WHERE id IN (SELECT MAX(id) FROM incidents GROUP BY tenant_id, fingerprint HAVING COUNT(*) > 1)"
+    ))
+    conn.execute(sa.text(
+        "DELETE FROM incidents WHERE id NOT IN (SELECT MAX(id) FROM incidents GROUP BY tenant_id, fingerprint)"
+    ))
+
+    op.create_index('uq_incident_fingerprint', 'incidents', ['tenant_id', 'fingerprint'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_incident_fingerprint', table_name='incidents')
+    with op.batch_alter_table('incidents', schema=None) as batch_op:
+        batch_op.drop_column('fingerprint')
@@ -0,0 +1,38 @@
+"""Hot path indexes
+
+Revision ID: c4d8e1f2a9b0
+Revises: b7e2d9a1c3f4
+Create Date: 2026-10-17 12:40:18.552907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8e1f2a9b0'
+down_revision = 'b7e2d9a1c3f4'
+branch_labels = None
+depends_on = None
+
+
+# (nome, tabela, colunas) — mesmos índices de api/models.py
+INDEXES = [
+    ('ix_events_tenant_ts', 'events', ['tenant_id', 'ts']),
+    ('ix_incidents_tenant_last_seen', 'incidents', ['tenant_id', 'last_seen']),
+    ('ix_incidents_tenant_status', 'incidents', ['tenant_id', 'status']),
+]
+
+
+def upgrade():
+    # No Postgres, CONCURRENTLY não bloqueia escrita em events/incidents, mas não
+    # pode rodar dentro de transação; nos outros bancos o índice é criado normalmente.
+    with op.get_context().autocommit_block():
+        for name, table, cols in INDEXES:
+            op.create_index(name, table, cols, unique=False, if_not_exists=True, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
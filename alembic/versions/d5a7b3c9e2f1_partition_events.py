@@ -0,0 +1,61 @@
+"""Partition events by ts (Postgres)
+
+Revision ID: d5a7b3c9e2f1
+Revises: c4d8e1f2a9b0
+Create Date: 2026-10-17 13:25:09.731846
+
+"""
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+from api.partitions import EVENTS_PARTITION_PREMAKE, partition_name, partition_start, partition_step
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a7b3c9e2f1'
+down_revision = 'c4d8e1f2a9b0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Só Postgres: no SQLite a tabela continua comum (ver api/partitions.py)
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("ALTER TABLE events RENAME TO events_legacy")
+    op.execute("ALTER TABLE events_legacy RENAME CONSTRAINT events_pkey TO events_legacy_pkey")
+    op.execute("ALTER INDEX ix_events_tenant_ts RENAME TO ix_events_legacy_tenant_ts")
+    # A chave primária de uma tabela particionada precisa incluir a coluna de partição
+    op.execute("CREATE TABLE events (LIKE events_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (ts)")
+    op.execute("ALTER SEQUENCE events_id_seq OWNED BY events.id")
+    op.execute("ALTER TABLE events ADD PRIMARY KEY (id, ts)")
+    op.create_foreign_key(None, 'events', 'tenants', ['tenant_id'], ['id'])
+    op.create_foreign_key(None, 'events', 'agents', ['agent_id'], ['id'])
+    op.create_index('ix_events_tenant_ts', 'events', ['tenant_id', 'ts'])
+    # Histórico numa partição só (descartada quando sair da retenção); as próximas
+    # vêm de api.partitions.ensure_partitions; DEFAULT recebe ts fora das faixas criadas
+    start = partition_start(datetime.now(timezone.utc))
+    op.execute(f"CREATE TABLE events_history PARTITION OF events FOR VALUES FROM (MINVALUE) TO ('{start.isoformat()}')")
+    for i in range(EVENTS_PARTITION_PREMAKE + 1):
+        lo, hi = start + i * partition_step(), start + (i + 1) * partition_step()
+        op.execute(f"CREATE TABLE {partition_name(lo)} PARTITION OF events FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')")
+    op.execute("CREATE TABLE events_default PARTITION OF events DEFAULT")
+    op.execute("INSERT INTO events SELECT * FROM events_legacy")
+    op.execute("DROP TABLE events_legacy")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("ALTER TABLE events RENAME TO events_partitioned")
+    op.execute("ALTER INDEX ix_events_tenant_ts RENAME TO ix_events_partitioned_tenant_ts")
+    op.execute("CREATE TABLE events (LIKE events_partitioned INCLUDING DEFAULTS)")
+    op.execute("ALTER SEQUENCE events_id_seq OWNED BY events.id")
+    op.execute("INSERT INTO events SELECT * FROM events_partitioned")
+    op.execute("DROP TABLE events_partitioned")
+    op.execute("ALTER TABLE events ADD PRIMARY KEY (id)")
+    op.create_foreign_key(None, 'events', 'tenants', ['tenant_id'], ['id'])
+    op.create_foreign_key(None, 'events', 'agents', ['agent_id'], ['id'])
+    op.create_index('ix_events_tenant_ts', 'events', ['tenant_id', 'ts'])
@@ -0,0 +1,58 @@
+"""Hourly event and incident rollups
+
+Revision ID: e6b9c4d2f7a3
+Revises: d5a7b3c9e2f1
+Create Date: 2026-10-17 14:02:47.310592
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b9c4d2f7a3'
+down_revision = 'd5a7b3c9e2f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('event_rollups',
+    sa.Column('tenant_id', sa.String(), nullable=False),
+    sa.Column('hour', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('severity', sa.String(), nullable=False),
+    sa.Column('event_type', sa.String(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('tenant_id', 'hour', 'severity', 'event_type')
+    )
+    op.create_table('incident_rollups',
+    sa.Column('tenant_id', sa.String(), nullable=False),
+    sa.Column('hour', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('severity', sa.String(), nullable=False),
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('tenant_id', 'hour', 'severity', 'kind')
+    )
+
+    # Backfill: eventos pela hora de ts; incidentes antigos com todo o count na hora de last_seen
+    if op.get_bind().dialect.name == 'postgresql':
+        hour_of = lambda col: f"date_trunc('hour', {col} AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"
+    else:
+        hour_of = lambda col: f"strftime('%Y-%m-%d %H:00:00.000000', {col})"
+    op.execute(
+        "INSERT INTO event_rollups (tenant_id, hour, severity, event_type, count) "
+        f"SELECT tenant_id, {hour_of('ts')}, COALESCE(severity, ''), COALESCE(event_type, ''), COUNT(*) "
+        f"FROM events GROUP BY tenant_id, {hour_of('ts')}, COALESCE(severity, ''), COALESCE(event_type, '')"
+    )
+    op.execute(
+        "INSERT INTO incident_rollups (tenant_id, hour, severity, kind, count) "
+        f"SELECT tenant_id, {hour_of('last_seen')}, severity, kind, SUM(count) "
+        f"FROM incidents GROUP BY tenant_id, {hour_of('last_seen')}, severity, kind"
+    )
+
+
+def downgrade():
+    op.drop_table('incident_rollups')
+    op.drop_table('event_rollups')
@@ -0,0 +1,45 @@
+"""Compressed event payload blocks
+
+Revision ID: f7c1a8e3b5d4
+Revises: e6b9c4d2f7a3
+Create Date: 2026-10-17 15:11:36.408215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7c1a8e3b5d4'
+down_revision = 'e6b9c4d2f7a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('event_payload_blocks',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('tenant_id', sa.String(), nullable=False),
+    sa.Column('codec', sa.String(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('raw_bytes', sa.Integer(), nullable=False),
+    sa.Column('stored_bytes', sa.Integer(), nullable=False),
+    sa.Column('ts_min', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('ts_max', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_event_payload_blocks_tenant_ts_max', 'event_payload_blocks', ['tenant_id', 'ts_max'], unique=False)
+    # Eventos já gravados mantêm raw_json inline; só os novos vão para os blocos
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('payload_block_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('payload_idx', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.drop_column('payload_idx')
+        batch_op.drop_column('payload_block_id')
+    op.drop_index('ix_event_payload_blocks_tenant_ts_max', table_name='event_payload_blocks')
+    op.drop_table('event_payload_blocks')
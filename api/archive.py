@@ -0,0 +1,388 @@
+"""Arquivo colunar de eventos históricos.
+
+Eventos com mais de EVENTS_ARCHIVE_AFTER_DAYS dias saem de `events` para
+segmentos imutáveis por tenant e dia em EVENTS_ARCHIVE_DIR/{tenant}/{dia}.seg:
+
+  "EVS1" + 4 bytes nulos | ids (int64) | ts (int64, µs UTC) | uma coluna uint32 por campo de
+  texto (código no dicionário, 0 = nulo) | raw (JSON comprimido com zlib) |
+  rodapé JSON | tamanho do rodapé (uint32) | "EVS1"
+
+O rodapé guarda offsets, dicionários, ts mín./máx. e a contagem de cada valor
+por coluna: contagens sem filtro saem só do rodapé. Consultas abrem os
+segmentos com mmap e filtram as colunas inteiras de uma vez (numpy, se
+instalado; senão arrays do Python).
+
+Uso:
+  python -m api.archive [--after-days 7] [--tenant t1]
+"""
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+import zlib
+from array import array
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from .models import Event, Tenant
+from .payloads import attach_payloads
+from .ruleset import utc_naive
+
+try:
+    import numpy as np
+except ImportError:  # opcional
+    np = None
+
+
+EVENTS_ARCHIVE_DIR = os.getenv("EVENTS_ARCHIVE_DIR", "data/archive")
+EVENTS_ARCHIVE_AFTER_DAYS = int(os.getenv("EVENTS_ARCHIVE_AFTER_DAYS", "0"))  # 0 = desligado
+ARCHIVE_DELETE_CHUNK = 5000
+STRING_COLUMNS = ("host", "app", "event_type", "src_ip", "dst_ip", "username", "severity")
+
+_MAGIC = b"EVS1"
+_HEADER = _MAGIC + b"\0" * 4  # colunas int64 alinhadas em 8 bytes
+_TAIL = struct.Struct("<I4s")
+_EPOCH = datetime(1970, 1, 1)
+_SEG_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})(?:\.(\d+))?\.seg$")
+
+
+def _micros(ts: datetime) -> int:
+    d = utc_naive(ts) - _EPOCH
+    return (d.days * 86400 + d.seconds) * 1_000_000 + d.microseconds
+
+
+def _from_micros(us: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=us)
+
+
+def _tenant_dir(tenant_id: str, base: Optional[str] = None) -> str:
+    # tenant_id vira nome de diretório: nada de separadores
+    return os.path.join(base or EVENTS_ARCHIVE_DIR, tenant_id.replace("/", "_").replace("\\", "_"))
+
+
+def write_segment(path: str, rows: List[dict]) -> dict:
+    """Grava `rows` (ordenadas por ts) num segmento colunar (escrita atômica)."""
+    n = len(rows)
+    ids = array("q", (int(r["id"]) for r in rows))
+    ts = array("q", (_micros(r["ts"]) for r in rows))
+    parts = [ids.tobytes(), ts.tobytes()]
+    columns = {"id": {"type": "q"}, "ts": {"type": "q"}}
+    for name in STRING_COLUMNS:
+        values = [r.get(name) for r in rows]
+        dictionary = sorted({v for v in values if v not in (None, "")})
+        code_of = {v: i + 1 for i, v in enumerate(dictionary)}
+        codes = array("I", (code_of.get(v, 0) for v in values))
+        counts = Counter(v for v in values if v not in (None, ""))
+        parts.append(codes.tobytes())
+        columns[name] = {"type": "I", "dict": dictionary, "counts": [counts[v] for v in dictionary]}
+    raw = zlib.compress(json.dumps([r.get("raw_json") for r in rows], separators=(",", ":"), default=str).encode("utf-8"))
+    parts.append(raw)
+    offset = len(_HEADER)
+    for (name, meta), part in zip(columns.items(), parts):
+        meta.update(offset=offset, length=len(part))
+        offset += len(part)
+    footer = {
+        "version": 1, "rows": n,
+        "ts_min": ts[0] if n else None, "ts_max": ts[-1] if n else None,
+        "id_min": min(ids) if n else None, "id_max": max(ids) if n else None,
+        "columns": columns, "raw": {"offset": offset, "length": len(raw), "codec": "zlib"},
+    }
+    blob = json.dumps(footer, separators=(",", ":")).encode("utf-8")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER)
+        for part in parts:
+            f.write(part)
+        f.write(blob)
+        f.write(_TAIL.pack(len(blob), _MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return {"path": path, "rows": n, "bytes": os.path.getsize(path)}
+
+
+class Segment:
+    """Um segmento aberto com mmap; colunas lidas sem cópia."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._mm)
+        blob_len, magic = _TAIL.unpack_from(self._mm, size - _TAIL.size)
+        if self._mm[:4] != _MAGIC or magic != _MAGIC:
+            raise ValueError(f"invalid archive segment: {path}")
+        self.footer = json.loads(self._mm[size - _TAIL.size - blob_len:size - _TAIL.size].decode("utf-8"))
+        self.rows = self.footer["rows"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def column(self, name: str):
+        meta = self.footer["columns"][name]
+        if np is not None:
+            return np.frombuffer(self._mm, dtype="<i8" if meta["type"] == "q" else "<u4", count=self.rows, offset=meta["offset"])
+        return memoryview(self._mm)[meta["offset"]:meta["offset"] + meta["length"]].cast(meta["type"])
+
+    def dictionary(self, name: str) -> List[str]:
+        return self.footer["columns"][name]["dict"]
+
+    def code(self, name: str, value: str) -> int:
+        # 0 = valor inexistente no segmento (nenhuma linha casa)
+        d = self.dictionary(name)
+        lo, hi = 0, len(d)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if d[mid] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo + 1 if lo < len(d) and d[lo] == value else 0
+
+    def raw(self) -> list:
+        meta = self.footer["raw"]
+        return json.loads(zlib.decompress(self._mm[meta["offset"]:meta["offset"] + meta["length"]]).decode("utf-8"))
+
+    def find(self, event_id: int) -> Optional[int]:
+        """Índice da linha com esse id (ou None). Segmentos novos guardam id mín./máx. no rodapé."""
+        lo, hi = self.footer.get("id_min"), self.footer.get("id_max")
+        if lo is not None and not lo <= event_id <= hi:
+            return None
+        ids = self.column("id")
+        if np is not None:
+            hit = np.nonzero(ids == event_id)[0]
+            return int(hit[0]) if len(hit) else None
+        for i, v in enumerate(ids):
+            if v == event_id:
+                return i
+        return None
+
+    def select(self, since_us: Optional[int], until_us: Optional[int], filters: Dict[str, int]) -> List[int]:
+        """Índices das linhas que passam nos filtros (códigos já traduzidos)."""
+        ts_min, ts_max = self.footer["ts_min"], self.footer["ts_max"]
+        whole = (since_us is None or ts_min >= since_us) and (until_us is None or ts_max < until_us)
+        if np is not None:
+            mask = np.ones(self.rows, dtype=bool)
+            if not whole:
+                ts = self.column("ts")
+                if since_us is not None:
+                    mask &= ts >= since_us
+                if until_us is not None:
+                    mask &= ts < until_us
+            for name, code in filters.items():
+                mask &= self.column(name) == code
+            return np.nonzero(mask)[0].tolist()
+        idx = range(self.rows)
+        if not whole:
+            ts = self.column("ts")
+            lo = since_us if since_us is not None else ts_min
+            hi = until_us if until_us is not None else ts_max + 1
+            idx = [i for i in idx if lo <= ts[i] < hi]
+        for name, code in filters.items():
+            col = self.column(name)
+            idx = [i for i in idx if col[i] == code]
+        return list(idx)
+
+    def count_by(self, name: str, rows: Optional[List[int]] = None) -> Counter:
+        d = self.dictionary(name)
+        if rows is None:
+            return Counter({v: c for v, c in zip(d, self.footer["columns"][name]["counts"])})
+        col = self.column(name)
+        if np is not None:
+            codes = np.bincount(col[np.asarray(rows, dtype=np.int64)], minlength=len(d) + 1).tolist()
+            return Counter({d[i - 1]: c for i, c in enumerate(codes) if i and c})
+        counts = Counter(col[i] for i in rows)
+        return Counter({d[code - 1]: c for code, c in counts.items() if code})
+
+    def decode(self, rows: List[int]) -> List[dict]:
+        ids, ts = self.column("id"), self.column("ts")
+        cols = {name: (self.column(name), self.dictionary(name)) for name in STRING_COLUMNS}
+        out = []
+        for i in rows:
+            ev = {"id": int(ids[i]), "ts": _from_micros(int(ts[i]))}
+            for name, (col, d) in cols.items():
+                code = int(col[i])
+                ev[name] = d[code - 1] if code else None
+            out.append(ev)
+        return out
+
+    def close(self):
+        try:
+            self._mm.close()
+        except BufferError:
+            pass  # ainda há colunas referenciadas; o GC fecha depois
+        self._file.close()
+
+
+def segment_paths(tenant_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  base: Optional[str] = None) -> List[str]:
+    d = _tenant_dir(tenant_id, base)
+    try:
+        names = sorted(os.listdir(d))
+    except OSError:
+        return []
+    first = utc_naive(since).date() if since else None
+    last = utc_naive(until).date() if until else None
+    out = []
+    for name in names:
+        m = _SEG_RE.match(name)
+        if not m:
+            continue
+        day = date.fromisoformat(m.group(1))
+        if (first and day < first) or (last and day > last):
+            continue
+        out.append(os.path.join(d, name))
+    return out
+
+
+def query(tenant_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+          filters: Optional[Dict[str, str]] = None, group_by: Optional[str] = None, limit: int = 200,
+          base: Optional[str] = None) -> dict:
+    """Consulta o arquivo do tenant: {"items": [...]} (mais recentes primeiro) ou {"counts": {...}}."""
+    filters = {k: v for k, v in (filters or {}).items() if v not in (None, "")}
+    for name in list(filters) + ([group_by] if group_by else []):
+        if name not in STRING_COLUMNS:
+            raise ValueError(f"unknown field '{name}'")
+    since_us = _micros(since) if since else None
+    until_us = _micros(until) if until else None
+    counts = Counter()
+    items: List[dict] = []
+    scanned = 0
+    # do dia mais recente para o mais antigo: a listagem para quando atinge o limite
+    for path in reversed(segment_paths(tenant_id, since, until, base)):
+        if not group_by and len(items) >= limit:
+            break
+        with Segment(path) as seg:
+            if (since_us is not None and seg.footer["ts_max"] < since_us) or (until_us is not None and seg.footer["ts_min"] >= until_us):
+                continue
+            codes = {name: seg.code(name, value) for name, value in filters.items()}
+            if any(c == 0 for c in codes.values()):
+                continue
+            scanned += seg.rows
+            whole = not codes and (since_us is None or seg.footer["ts_min"] >= since_us) and (until_us is None or seg.footer["ts_max"] < until_us)
+            if group_by and whole:
+                counts.update(seg.count_by(group_by))
+                continue
+            rows = seg.select(since_us, until_us, codes)
+            if group_by:
+                counts.update(seg.count_by(group_by, rows))
+            else:
+                items.extend(reversed(seg.decode(rows[-(limit - len(items)):] if rows else [])))
+    if group_by:
+        return {"counts": dict(counts.most_common()), "scanned_rows": scanned}
+    return {"items": items[:limit], "scanned_rows": scanned}
+
+
+def find_event(tenant_id: str, event_id: int, base: Optional[str] = None) -> Optional[dict]:
+    """Evento arquivado com o payload original (`raw`), ou None se não está em nenhum segmento."""
+    for path in reversed(segment_paths(tenant_id, base=base)):
+        with Segment(path) as seg:
+            i = seg.find(event_id)
+            if i is not None:
+                ev = seg.decode([i])[0]
+                ev["raw"] = seg.raw()[i]
+                return ev
+    return None
+
+
+def _archived_ids(paths: Iterable[str]) -> set:
+    ids = set()
+    for p in paths:
+        with Segment(p) as seg:
+            ids.update(int(i) for i in seg.column("id"))
+    return ids
+
+
+def archive_day(db: Session, tenant_id: str, day: date, base: Optional[str] = None) -> dict:
+    """Move os eventos do tenant em `day` (UTC) para um segmento novo e os apaga de `events`."""
+    lo = datetime.combine(day, datetime.min.time())
+    hi = lo + timedelta(days=1)
+    if db.get_bind().dialect.name == "postgresql":
+        lo, hi = lo.replace(tzinfo=timezone.utc), hi.replace(tzinfo=timezone.utc)
+    cols = (Event.id, Event.ts, *(getattr(Event, c) for c in STRING_COLUMNS), Event.raw_json, Event.payload_block_id, Event.payload_idx)
+    rows = db.execute(select(*cols).where(Event.tenant_id == tenant_id, Event.ts >= lo, Event.ts < hi).order_by(Event.ts, Event.id)).mappings().all()
+    if not rows:
+        return {"day": day.isoformat(), "rows": 0}
+    existing = segment_paths(tenant_id, lo, lo, base)
+    # segmento gravado antes de uma falha no DELETE: não duplica as linhas
+    done = _archived_ids(existing) if existing else set()
+    rows = attach_payloads(db, [r for r in rows if r["id"] not in done])
+    res = {"day": day.isoformat(), "rows": 0}
+    if rows:
+        seq = len(existing)
+        name = f"{day.isoformat()}.seg" if seq == 0 else f"{day.isoformat()}.{seq}.seg"
+        res = {"day": day.isoformat(), **write_segment(os.path.join(_tenant_dir(tenant_id, base), name), rows)}
+    ids = [r["id"] for r in rows] + list(done)
+    for i in range(0, len(ids), ARCHIVE_DELETE_CHUNK):
+        db.execute(delete(Event).where(Event.tenant_id == tenant_id, Event.id.in_(ids[i:i + ARCHIVE_DELETE_CHUNK])))
+    db.commit()
+    return res
+
+
+def archive_tenant(db: Session, tenant_id: str, before: datetime, base: Optional[str] = None) -> List[dict]:
+    """Arquiva todos os dias completos do tenant anteriores a `before`."""
+    cutoff = datetime.combine(utc_naive(before).date(), datetime.min.time())
+    if db.get_bind().dialect.name == "postgresql":
+        cutoff = cutoff.replace(tzinfo=timezone.utc)
+    out = []
+    while True:
+        # cada dia arquivado sai de `events`: o próximo mínimo já é outro dia
+        oldest = db.execute(select(func.min(Event.ts)).where(Event.tenant_id == tenant_id, Event.ts < cutoff)).scalar()
+        if oldest is None:
+            return out
+        if isinstance(oldest, str):  # SQLite pode devolver texto em agregações
+            oldest = datetime.fromisoformat(oldest)
+        res = archive_day(db, tenant_id, utc_naive(oldest).date(), base)
+        if res["rows"]:
+            out.append(res)
+
+
+def run_archiver(db: Session, after_days: int = EVENTS_ARCHIVE_AFTER_DAYS, now: Optional[datetime] = None,
+                 tenant_ids: Optional[List[str]] = None) -> dict:
+    if after_days <= 0:
+        return {"enabled": False}
+    before = utc_naive(now or datetime.utcnow()) - timedelta(days=after_days)
+    tenant_ids = tenant_ids or list(db.execute(select(Tenant.id)).scalars())
+    segments = []
+    for tid in tenant_ids:
+        segments.extend({"tenant_id": tid, **s} for s in archive_tenant(db, tid, before))
+    return {"enabled": True, "before": before.isoformat(), "segments": len(segments),
+            "rows": sum(s["rows"] for s in segments), "bytes": sum(s.get("bytes", 0) for s in segments)}
+
+
+def prune_segments(tenant_id: str, cutoff: datetime, base: Optional[str] = None) -> int:
+    # Retenção do plano também vale para o arquivo: dias inteiros antes de `cutoff`
+    last = utc_naive(cutoff).date() - timedelta(days=1)
+    removed = 0
+    for path in segment_paths(tenant_id, until=datetime.combine(last, datetime.min.time()), base=base):
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def main(argv=None):
+    from .database import SessionLocal
+    ap = argparse.ArgumentParser(description="Arquiva eventos antigos em segmentos colunares")
+    ap.add_argument("--after-days", type=int, default=EVENTS_ARCHIVE_AFTER_DAYS or 7)
+    ap.add_argument("--tenant", action="append", default=[])
+    args = ap.parse_args(argv)
+    with SessionLocal() as db:
+        print(json.dumps(run_archiver(db, args.after_days, tenant_ids=args.tenant or None), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
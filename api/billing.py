@@ -4,7 +4,7 @@ from sqlalchemy.orm import Session
 import os
 
 from .database import SessionLocal
-from .models import Subscription, Tenant, Plan
+from .models import Subscription, Tenant, Plan, User
 from .auth import require_tenant
 
 router = APIRouter()
@@ -59,6 +59,8 @@ async def create_checkout_session(plan_id: int, tenant: Tenant = Depends(require
     plan = db.query(Plan).filter(Plan.id == plan_id).first()
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
+    # tenant vem desanexado de require_tenant: o e-mail sai da sessão da rota
+    user = db.query(User).filter(User.tenant_id == tenant.id).first()
 
     try:
         checkout_session = stripe.checkout.Session.create(
@@ -71,7 +73,7 @@ async def create_checkout_session(plan_id: int, tenant: Tenant = Depends(require
             mode='subscription',
             success_url="http://localhost:5500/billing?success=true",
             cancel_url="http://localhost:5500/billing?canceled=true",
-            customer_email=tenant.users[0].email,
+            customer_email=user.email if user else None,
             client_reference_id=tenant.id,
         )
         return {"checkout_url": checkout_session.url}
@@ -0,0 +1,117 @@
+import json
+from datetime import datetime
+from typing import Iterable, List, Set, Tuple
+
+from sqlalchemy import delete, insert, select, text
+from sqlalchemy.orm import Session
+
+from .models import Event, EventPayloadBlock
+from .payloads import store_payloads
+from .rollups import record_events
+
+
+DELETE_CHUNK = 5000
+EVENT_COLUMNS = ("tenant_id", "agent_id", "ts", "host", "app", "event_type", "src_ip", "dst_ip", "username", "severity", "raw_json",
+                 "payload_block_id", "payload_idx")
+
+
+def parse_ts(value) -> datetime:
+    if not value:
+        return datetime.utcnow()
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def prepare_event_rows(tenant_id: str, agent_id: str, items: Iterable[dict]) -> Tuple[List[dict], Set[str]]:
+    # Uma única passada: parse de timestamp, montagem das linhas e conjunto de src_ip
+    rows = []
+    ips = set()
+    for e in items:
+        src_ip = e.get("src_ip")
+        rows.append({
+            "tenant_id": tenant_id,
+            "agent_id": agent_id,
+            "ts": parse_ts(e.get("ts")),
+            "host": e.get("host"),
+            "app": e.get("app"),
+            "event_type": e.get("event_type"),
+            "src_ip": src_ip,
+            "dst_ip": e.get("dst_ip"),
+            "username": e.get("username"),
+            "severity": e.get("severity"),
+            "raw_json": e.get("raw"),
+        })
+        if src_ip:
+            ips.add(src_ip)
+    return rows, ips
+
+
+def _use_copy(db: Session) -> bool:
+    dialect = db.get_bind().dialect
+    return dialect.name == "postgresql" and dialect.driver == "psycopg"
+
+
+def _copy_rows(db: Session, rows: List[dict]) -> List[int]:
+    # COPY via psycopg 3 na mesma transação da sessão; ids reservados antes na sequência
+    ids = db.execute(text("SELECT nextval(pg_get_serial_sequence('events', 'id')) FROM generate_series(1, :n)"),
+                     {"n": len(rows)}).scalars().all()
+    columns = ("id",) + EVENT_COLUMNS
+    driver_conn = db.connection().connection.driver_connection
+    stmt = f"COPY {Event.__tablename__} ({', '.join(columns)}) FROM STDIN"
+    with driver_conn.cursor() as cur:
+        with cur.copy(stmt) as cp:
+            for event_id, r in zip(ids, rows):
+                raw = r.get("raw_json")
+                cp.write_row((event_id,) + tuple(json.dumps(raw) if c == "raw_json" and raw is not None else r.get(c) for c in EVENT_COLUMNS))
+    return ids
+
+
+def insert_event_rows(db: Session, rows: List[dict]) -> int:
+    """Insere as linhas de eventos em lote (COPY no Postgres/psycopg, executemany nos demais).
+
+    Não faz commit: o chamador controla a transação (o bloco de payloads em
+    `event_payload_blocks` e os agregados em `event_rollups` entram na mesma).
+    As linhas recebidas mantêm o `raw_json` e ganham o `id` gravado (quando o
+    banco devolve ids em lote), usado pela detecção incremental.
+    """
+    if not rows:
+        return 0
+    stored = store_payloads(db, rows)
+    dialect = db.get_bind().dialect
+    if _use_copy(db):
+        ids = _copy_rows(db, stored)
+    elif dialect.insert_executemany_returning_sort_by_parameter_order:
+        ids = db.execute(insert(Event.__table__).returning(Event.id, sort_by_parameter_order=True), stored).scalars().all()
+    else:
+        db.execute(insert(Event.__table__), stored)
+        ids = []
+    for r, event_id in zip(rows, ids):
+        r["id"] = event_id
+    record_events(db, rows)
+    return len(rows)
+
+
+def bulk_insert_events(db: Session, tenant_id: str, agent_id: str, items: Iterable[dict]) -> Set[str]:
+    rows, ips = prepare_event_rows(tenant_id, agent_id, items)
+    insert_event_rows(db, rows)
+    return ips
+
+
+def delete_event_rows(db: Session, tenant_id: str, ids: Iterable[int]) -> int:
+    """Desfaz `insert_event_rows` já commitado: apaga os eventos, desconta `event_rollups`
+    e remove os blocos de payload deles. Não faz commit."""
+    ids = list(ids)
+    blocks = set()
+    n = 0
+    for i in range(0, len(ids), DELETE_CHUNK):
+        part = ids[i:i + DELETE_CHUNK]
+        rows = db.execute(select(Event.tenant_id, Event.ts, Event.severity, Event.event_type, Event.payload_block_id)
+                          .where(Event.tenant_id == tenant_id, Event.id.in_(part))).mappings().all()
+        record_events(db, rows, sign=-1)
+        blocks.update(r["payload_block_id"] for r in rows if r["payload_block_id"] is not None)
+        db.execute(delete(Event).where(Event.tenant_id == tenant_id, Event.id.in_(part)))
+        n += len(rows)
+    if blocks:
+        db.execute(delete(EventPayloadBlock).where(EventPayloadBlock.tenant_id == tenant_id, EventPayloadBlock.id.in_(blocks)))
+    return n
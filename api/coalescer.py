@@ -0,0 +1,173 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+COALESCE_WINDOW_MS = int(os.getenv("INGEST_COALESCE_MS", "0"))
+COALESCE_MAX_EVENTS = int(os.getenv("INGEST_COALESCE_MAX_EVENTS", "5000"))
+
+# (agent_id, batch_id, items)
+Entry = Tuple[str, str, List[dict]]
+
+log = logging.getLogger("api.coalescer")
+
+
+class _Buffer:
+    __slots__ = ("entries", "events", "started")
+
+    def __init__(self):
+        self.entries: List[Entry] = []
+        self.events = 0
+        self.started = time.monotonic()
+
+
+class IngestCoalescer:
+    """Agrupa lotes aceitos por tenant e grava tudo numa única transação.
+
+    Um lote de um tenant é liberado quando a janela (`window_ms`) expira ou
+    quando o buffer passa de `max_events`. `flush(tenant_id, entries)` roda na
+    thread do coalescer e deve persistir os lotes e rodar as regras uma vez; se
+    levantar exceção, nada deve ter sido gravado. Os lotes de um flush que falhou
+    voltam uma vez para a frente do buffer do tenant; na segunda falha são descartados.
+    """
+
+    def __init__(self, flush: Callable[[str, List[Entry]], None], window_ms: int = COALESCE_WINDOW_MS, max_events: int = COALESCE_MAX_EVENTS):
+        self.window = window_ms / 1000.0
+        self.max_events = max_events
+        self._flush = flush
+        self._cond = threading.Condition()
+        self._buffers: Dict[str, _Buffer] = {}
+        self._pending = set()
+        self._retried = set()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._stats = {"flushes": 0, "flushed_batches": 0, "flushed_events": 0, "max_flush_events": 0, "last_flush_ms": 0.0, "errors": 0,
+                       "retried_batches": 0, "dropped_batches": 0, "dropped_events": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def submit(self, tenant_id: str, agent_id: str, batch_id: str, items: List[dict]) -> bool:
+        """Enfileira um lote; retorna False se o mesmo lote já está pendente."""
+        key = (tenant_id, agent_id, batch_id)
+        with self._cond:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            buf = self._buffers.get(tenant_id)
+            if buf is None:
+                buf = self._buffers[tenant_id] = _Buffer()
+            buf.entries.append((agent_id, batch_id, items))
+            buf.events += len(items)
+            self._ensure_started()
+            self._cond.notify()
+        return True
+
+    def is_pending(self, tenant_id: str, agent_id: str, batch_id: str) -> bool:
+        with self._cond:
+            return (tenant_id, agent_id, batch_id) in self._pending
+
+    def pending_events(self, tenant_id: Optional[str] = None) -> int:
+        with self._cond:
+            if tenant_id is None:
+                return sum(b.events for b in self._buffers.values())
+            buf = self._buffers.get(tenant_id)
+            return buf.events if buf else 0
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="ingest-coalescer", daemon=True)
+            self._thread.start()
+
+    def _take_ready(self) -> List[Tuple[str, _Buffer]]:
+        # chamado com o lock; bloqueia até haver buffer pronto (ou parada)
+        while True:
+            now = time.monotonic()
+            ready = [t for t, b in self._buffers.items() if self._stopping or b.events >= self.max_events or now - b.started >= self.window]
+            if ready or (self._stopping and not self._buffers):
+                return [(t, self._buffers.pop(t)) for t in ready]
+            timeout = None
+            if self._buffers:
+                timeout = max(0.0, min(b.started for b in self._buffers.values()) + self.window - now)
+            self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                ready = self._take_ready()
+                if not ready and self._stopping:
+                    return
+            for tenant_id, buf in ready:
+                self._flush_buffer(tenant_id, buf)
+
+    def _flush_buffer(self, tenant_id: str, buf: _Buffer):
+        t0 = time.perf_counter()
+        try:
+            self._flush(tenant_id, buf.entries)
+            ok = True
+        except Exception:
+            log.exception("coalescer: flush falhou (tenant=%s, lotes=%s)", tenant_id,
+                          [f"{agent_id}/{batch_id}" for agent_id, batch_id, _ in buf.entries])
+            ok = False
+        dt = (time.perf_counter() - t0) * 1000
+        with self._cond:
+            s = self._stats
+            if ok:
+                for agent_id, batch_id, _ in buf.entries:
+                    self._pending.discard((tenant_id, agent_id, batch_id))
+                    self._retried.discard((tenant_id, agent_id, batch_id))
+                s["flushes"] += 1
+                s["flushed_batches"] += len(buf.entries)
+                s["flushed_events"] += buf.events
+                s["max_flush_events"] = max(s["max_flush_events"], buf.events)
+                s["last_flush_ms"] = round(dt, 2)
+                return
+            s["errors"] += 1
+            retry = []
+            for agent_id, batch_id, items in buf.entries:
+                key = (tenant_id, agent_id, batch_id)
+                if key in self._retried:
+                    # Já aceito pelo agente: sem segunda chance, fica no log
+                    log.error("coalescer: lote descartado após retry (tenant=%s agent=%s batch=%s, %d eventos)",
+                              tenant_id, agent_id, batch_id, len(items))
+                    self._retried.discard(key)
+                    self._pending.discard(key)
+                    s["dropped_batches"] += 1
+                    s["dropped_events"] += len(items)
+                else:
+                    self._retried.add(key)
+                    retry.append((agent_id, batch_id, items))
+            if retry:
+                # Volta na frente do buffer do tenant e sai no próximo flush (ordem preservada)
+                cur = self._buffers.get(tenant_id)
+                if cur is None:
+                    cur = self._buffers[tenant_id] = _Buffer()
+                cur.entries[:0] = retry
+                cur.events += sum(len(items) for _, _, items in retry)
+                s["retried_batches"] += len(retry)
+                self._cond.notify()
+
+    def stop(self, timeout: float = 10.0):
+        # Libera tudo que estiver no buffer e encerra a thread
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            s = dict(self._stats)
+            s["enabled"] = self.enabled
+            s["window_ms"] = int(self.window * 1000)
+            s["max_events"] = self.max_events
+            s["queue_batches"] = sum(len(b.entries) for b in self._buffers.values())
+            s["queue_events"] = sum(b.events for b in self._buffers.values())
+            s["queue_by_tenant"] = {t: b.events for t, b in self._buffers.items()}
+            s["avg_flush_events"] = round(s["flushed_events"] / s["flushes"], 1) if s["flushes"] else 0.0
+        return s
@@ -1,21 +1,231 @@
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from pathlib import Path
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/app.db")
+# Réplica de leitura opcional (endpoints só de leitura: incidentes, ativos, relatórios, score, stats)
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", "")
+
+# Pool de conexões (por engine e por processo)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+# Atrás do PgBouncer (pool_mode=transaction): sem pool local e sem prepared statements no servidor
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "0").lower() in ("1", "true", "yes")
+
+# SQLite otimizado (edge/single-node): WAL e pragmas em cada conexão, leituras num pool
+# somente leitura e INSERTs de eventos serializados numa thread (api/writer.py)
+SQLITE_OPTIMIZED = os.getenv("SQLITE_OPTIMIZED", "0").lower() in ("1", "true", "yes")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "4"))
 
 if DATABASE_URL.startswith("sqlite"):
     Path("data").mkdir(parents=True, exist_ok=True)
-    connect_args = {"check_same_thread": False}
-else:
-    connect_args = {}
 
-engine = create_engine(DATABASE_URL, echo=False, future=True, connect_args=connect_args)
+
+class PoolStats:
+    """Contadores de um pool: checkouts, espera por conexão livre, timeouts."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def observe(self, wait: float, timeout: bool = False):
+        with self._lock:
+            if timeout:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def snapshot(self, pool=None) -> dict:
+        with self._lock:
+            out = {
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "timeouts": self.timeouts,
+                "wait_ms_total": round(self.wait_total * 1000, 2),
+                "wait_ms_avg": round(self.wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_ms_max": round(self.wait_max * 1000, 2),
+            }
+        if pool is not None:
+            out["pool"] = type(pool).__mro__[1].__name__
+            if isinstance(pool, QueuePool):
+                out.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow(), idle=pool.checkedin())
+        return out
+
+
+pool_stats = {}
+
+
+def _timed_pool(base, stats: PoolStats):
+    # Subclasse por engine: engine.dispose() recria o pool pela classe e mantém os contadores
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            conn = base._do_get(self)
+        except PoolTimeoutError:
+            stats.observe(time.perf_counter() - t0, timeout=True)
+            raise
+        stats.observe(time.perf_counter() - t0)
+        return conn
+
+    def _create_connection(self):
+        with stats._lock:
+            stats.connects += 1
+        return base._create_connection(self)
+
+    return type(f"Timed{base.__name__}", (base,), {"_do_get": _do_get, "_create_connection": _create_connection})
+
+
+def sqlite_pragmas(dbapi_conn, read_only: bool = False):
+    cur = dbapi_conn.cursor()
+    try:
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cur.execute(f"PRAGMA cache_size={-SQLITE_CACHE_SIZE_KB}")
+        cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        if read_only:
+            cur.execute("PRAGMA query_only=ON")
+    finally:
+        cur.close()
+
+
+def _sqlite_file(url: str) -> bool:
+    return url.startswith("sqlite") and ":memory:" not in url and not url.rstrip("/").endswith(":")
+
+
+def tune_sqlite_engine(sync_engine, read_only: bool = False):
+    """Pragmas em cada conexão; no engine de escrita, transações explícitas.
+
+    O pysqlite só emite BEGIN antes de DML, então com `begin_nested()` como
+    primeiro comando não há transação externa e cada RELEASE SAVEPOINT já
+    confirma. Com isolation_level=None e BEGIN no evento "begin", a transação
+    da sessão vale de verdade (receita da documentação do SQLAlchemy).
+    """
+    def on_connect(conn, _rec):
+        if not read_only:
+            conn.isolation_level = None
+        sqlite_pragmas(conn, read_only)
+
+    event.listen(sync_engine, "connect", on_connect)
+    if not read_only:
+        event.listen(sync_engine, "begin", lambda conn: conn.exec_driver_sql("BEGIN"))
+
+
+def _engine_kwargs(url: str, name: str, is_async: bool = False) -> dict:
+    kwargs = {"echo": False}
+    if url.startswith("sqlite"):
+        if not is_async:
+            kwargs["connect_args"] = {"check_same_thread": False}
+        if not _sqlite_file(url):
+            return kwargs  # SingletonThreadPool/StaticPool do dialeto
+    stats = pool_stats.setdefault(name, PoolStats(name))
+    if DB_PGBOUNCER and not url.startswith("sqlite"):
+        # O PgBouncer já faz o pool; cada checkout abre/fecha um cliente barato contra ele
+        kwargs["poolclass"] = _timed_pool(NullPool, stats)
+        if "+asyncpg" in url:
+            kwargs["connect_args"] = {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+        elif "+psycopg" in url and "+psycopg2" not in url:
+            kwargs["connect_args"] = {"prepare_threshold": None}
+        return kwargs
+    kwargs.update(
+        poolclass=_timed_pool(AsyncAdaptedQueuePool if is_async else QueuePool, stats),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    return kwargs
+
+
+SQLITE_TUNED = SQLITE_OPTIMIZED and _sqlite_file(DATABASE_URL)
+
+engine = create_engine(DATABASE_URL, future=True, **_engine_kwargs(DATABASE_URL, "primary"))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
 Base = declarative_base()
 
+
+def _sqlite_read_engine(url: str, name: str, is_async: bool = False):
+    kwargs = _engine_kwargs(url, name, is_async)
+    kwargs.update(pool_size=SQLITE_READ_POOL_SIZE, max_overflow=0)
+    eng = (create_async_engine if is_async else create_engine)(url, **kwargs)
+    tune_sqlite_engine(eng.sync_engine if is_async else eng, read_only=True)
+    return eng
+
+
+# Sem DATABASE_READ_URL, as sessões de leitura usam o próprio primário (ou, no SQLite
+# otimizado, um pool próprio de conexões query_only, que no WAL não bloqueiam o escritor)
+if DATABASE_READ_URL:
+    read_engine = create_engine(DATABASE_READ_URL, future=True, **_engine_kwargs(DATABASE_READ_URL, "replica"))
+elif SQLITE_TUNED:
+    tune_sqlite_engine(engine)
+    read_engine = _sqlite_read_engine(DATABASE_URL, "sqlite_read")
+else:
+    read_engine = engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine, future=True)
+
+
+def _async_url(url: str) -> str:
+    # Mesmo banco com driver assíncrono: aiosqlite no dev, psycopg 3 (async) no Postgres
+    if url.startswith("sqlite+aiosqlite") or "+asyncpg" in url:
+        return url
+    if url.startswith("sqlite"):
+        return "sqlite+aiosqlite" + url[url.index(":"):]
+    if url.startswith(("postgresql://", "postgres://", "postgresql+psycopg2://")):
+        return "postgresql+psycopg" + url[url.index(":"):]
+    return url
+
+
+# ASYNC_DATABASE_URL permite escolher outro driver (ex.: postgresql+asyncpg://...)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_kwargs(ASYNC_DATABASE_URL, "primary_async", is_async=True))
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+ASYNC_DATABASE_READ_URL = os.getenv("ASYNC_DATABASE_READ_URL") or (_async_url(DATABASE_READ_URL) if DATABASE_READ_URL else "")
+if ASYNC_DATABASE_READ_URL:
+    async_read_engine = create_async_engine(ASYNC_DATABASE_READ_URL, **_engine_kwargs(ASYNC_DATABASE_READ_URL, "replica_async", is_async=True))
+elif SQLITE_TUNED and _sqlite_file(ASYNC_DATABASE_URL):
+    tune_sqlite_engine(async_engine.sync_engine)
+    async_read_engine = _sqlite_read_engine(ASYNC_DATABASE_URL, "sqlite_read_async", is_async=True)
+else:
+    async_read_engine = async_engine
+AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine, autoflush=False, expire_on_commit=False)
+
+
+def pool_metrics() -> dict:
+    read_name = "replica" if DATABASE_READ_URL else "sqlite_read"
+    engines = {"primary": engine, "primary_async": async_engine.sync_engine}
+    if read_engine is not engine:
+        engines[read_name] = read_engine
+    if async_read_engine is not async_engine:
+        engines[read_name + "_async"] = async_read_engine.sync_engine
+    out = {"pgbouncer": DB_PGBOUNCER, "read_replica": bool(DATABASE_READ_URL), "sqlite_optimized": SQLITE_TUNED}
+    for name, eng in engines.items():
+        stats = pool_stats.get(name)
+        out[name] = stats.snapshot(eng.pool) if stats else {"pool": type(eng.pool).__name__}
+    return out
+
 def init_db():
     from . import models  # noqa: F401
     Base.metadata.create_all(bind=engine)
-
@@ -0,0 +1,23 @@
+import json
+import os
+from typing import List, Tuple
+
+from .schemas import IngestBatchIn, ingest_batch_adapter
+
+
+FAST_DECODE = os.getenv("INGEST_FAST_DECODE", "0").lower() in ("1", "true", "yes")
+
+
+def decode_ingest_batch(raw: bytes, fast: bool = FAST_DECODE) -> Tuple[str, str, List[dict]]:
+    """Valida um corpo de /v1/ingest e retorna (agent_id, batch_id, eventos como dicts).
+
+    No modo rápido (INGEST_FAST_DECODE=1) o JSON é validado direto em dicts pelo
+    pydantic-core, sem json.loads nem um EventIn por evento. Os dois modos aceitam
+    e recusam os mesmos payloads (pydantic.ValidationError / ValueError).
+    """
+    if fast:
+        batch = ingest_batch_adapter.validate_json(raw)
+        return batch["agent_id"], batch["batch_id"], batch["events"]
+    data = json.loads(raw.decode("utf-8"))
+    payload = IngestBatchIn(**data)
+    return payload.agent_id, payload.batch_id, [e.model_dump() for e in payload.events]
@@ -0,0 +1,201 @@
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import Event
+from .payloads import attach_payloads
+from .rules import DETECTION_COLUMNS
+from .ruleset import Hit, RuleSet, utc_naive
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _minute(ts: datetime) -> int:
+    return int((ts - _EPOCH).total_seconds() // 60)
+
+
+class _Bucket:
+    __slots__ = ("counts", "hosts", "types")
+
+    def __init__(self):
+        self.counts = Counter()  # (índice da regra, chave do grupo) -> eventos
+        self.hosts = Counter()
+        self.types = Counter()
+
+
+class _TenantWindow:
+    def __init__(self, version: str):
+        self.version = version
+        self.lock = threading.Lock()
+        self.buckets: Dict[int, _Bucket] = {}
+        self.counts = Counter()
+        self.hosts = Counter()
+        self.types = Counter()
+        # ids carregados do banco na carga inicial: lotes já gravados mas ainda não
+        # observados chegam depois e não podem ser contados de novo
+        self.seeded_ids: Set[int] = set()
+        self.seeded_by_minute: Dict[int, List[int]] = {}
+
+    def take_seeded(self, event_id: int) -> bool:
+        if event_id in self.seeded_ids:
+            self.seeded_ids.discard(event_id)
+            return True
+        return False
+
+    def evict(self, oldest_minute: int):
+        for m in [m for m in self.seeded_by_minute if m < oldest_minute]:
+            self.seeded_ids.difference_update(self.seeded_by_minute.pop(m))
+        for m in [m for m in self.buckets if m < oldest_minute]:
+            b = self.buckets.pop(m)
+            self.counts.subtract(b.counts)
+            self.hosts.subtract(b.hosts)
+            self.types.subtract(b.types)
+        # remove chaves zeradas para a memória acompanhar só a janela
+        for c in (self.counts, self.hosts, self.types):
+            for k in [k for k, v in c.items() if v <= 0]:
+                del c[k]
+
+    def count(self, group: tuple, since_minute: int) -> int:
+        return sum(b.counts.get(group, 0) for m, b in self.buckets.items() if m >= since_minute)
+
+
+class SlidingWindowDetector:
+    """Contadores por tenant em janela deslizante (buckets de 1 minuto).
+
+    Cada lote só atualiza os buckets dos próprios eventos; buckets fora da
+    janela são removidos e subtraídos dos totais. Na primeira vez que um
+    tenant aparece neste processo, ou quando as regras dele mudam, a janela
+    é carregada do banco, fora do lock global (só o próprio tenant espera).
+    Linhas que entraram na carga não são somadas de novo quando o lote delas
+    for observado depois (ids de `insert_event_rows`).
+
+    O estado é local ao processo: com vários processos tratando o mesmo
+    tenant (ex.: vários workers RQ) use a varredura completa (RULES_ENGINE=full).
+    """
+
+    def __init__(self):
+        self._tenants: Dict[str, _TenantWindow] = {}
+        self._seed_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def reset(self, tenant_id: Optional[str] = None):
+        with self._lock:
+            if tenant_id is None:
+                self._tenants.clear()
+            else:
+                self._tenants.pop(tenant_id, None)
+
+    def _add(self, w: _TenantWindow, oldest: int, ruleset: RuleSet, ev: dict, ts: datetime) -> list:
+        minute = _minute(ts)
+        if minute < oldest:
+            return []
+        b = w.buckets.get(minute)
+        if b is None:
+            b = w.buckets[minute] = _Bucket()
+        host, et = ev.get("host"), ev.get("event_type")
+        if host:
+            b.hosts[host] += 1
+            w.hosts[host] += 1
+        if et:
+            b.types[et] += 1
+            w.types[et] += 1
+        matches = ruleset.match(ev)
+        for group in matches:
+            b.counts[group] += 1
+            w.counts[group] += 1
+        return matches
+
+    def _seed(self, db: Session, tenant_id: str, since: datetime, ruleset: RuleSet) -> _TenantWindow:
+        w = _TenantWindow(ruleset.version)
+        oldest = _minute(since)
+        rows = db.execute(select(*DETECTION_COLUMNS).where(Event.tenant_id == tenant_id, Event.ts >= since)).mappings()
+        if ruleset.needs_raw:
+            rows = attach_payloads(db, rows)
+        for ev in rows:
+            ts = utc_naive(ev["ts"])
+            self._add(w, oldest, ruleset, ev, ts)
+            w.seeded_ids.add(ev["id"])
+            w.seeded_by_minute.setdefault(_minute(ts), []).append(ev["id"])
+        return w
+
+    def _window(self, db: Session, tenant_id: str, since: datetime, ruleset: RuleSet) -> Tuple[_TenantWindow, bool]:
+        with self._lock:
+            w = self._tenants.get(tenant_id)
+            if w is not None and w.version == ruleset.version:
+                return w, False
+            seed_lock = self._seed_locks.setdefault(tenant_id, threading.Lock())
+        with seed_lock:
+            with self._lock:
+                w = self._tenants.get(tenant_id)
+                if w is not None and w.version == ruleset.version:
+                    return w, False
+            w = self._seed(db, tenant_id, since, ruleset)
+            with self._lock:
+                self._tenants[tenant_id] = w
+            return w, True
+
+    def observe(self, db: Session, tenant_id: str, rows: List[dict], ruleset: RuleSet, now: Optional[datetime] = None) -> List[Hit]:
+        """Atualiza a janela com os eventos novos (já gravados) e retorna as decisões.
+
+        Só grupos tocados por este lote são avaliados; `count` é o total do
+        grupo na janela da regra e `emissions` vale 1 (ou os eventos novos do
+        grupo, em regras `per_event`).
+        """
+        now = utc_naive(now or datetime.utcnow())
+        since = now - timedelta(minutes=ruleset.window_minutes)
+        oldest = _minute(since)
+        rule_oldest = [_minute(now - timedelta(minutes=r.window_minutes)) for r in ruleset.rules]
+        w, seeded = self._window(db, tenant_id, since, ruleset)
+        with w.lock:
+            w.evict(oldest)
+            touched = Counter()
+            for r in rows:
+                ts = utc_naive(r["ts"])
+                # já contada na carga do banco (sem id: vale a carga feita nesta chamada)
+                in_seed = w.take_seeded(r["id"]) if r.get("id") is not None else seeded
+                if in_seed:
+                    matches = ruleset.match(r) if ts >= since else []
+                else:
+                    matches = self._add(w, oldest, ruleset, r, ts)
+                minute = _minute(ts)
+                for group in matches:
+                    if minute >= rule_oldest[group[0]]:
+                        touched[group] += 1
+            hits = []
+            for group, new in touched.items():
+                idx, key = group
+                rule = ruleset.rules[idx]
+                count = w.counts[group] if rule.window_minutes == ruleset.window_minutes else w.count(group, rule_oldest[idx])
+                if count >= rule.threshold:
+                    hits.append(Hit(rule, key, count, new if rule.per_event else 1))
+            empty = not w.buckets
+        if empty:
+            with self._lock:
+                if self._tenants.get(tenant_id) is w:
+                    self._tenants.pop(tenant_id, None)
+        return hits
+
+    def snapshot(self, tenant_id: str, ruleset: Optional[RuleSet] = None) -> dict:
+        with self._lock:
+            w = self._tenants.get(tenant_id)
+        if not w:
+            return {"buckets": 0, "rules": {}, "hosts": {}, "event_types": {}}
+        with w.lock:
+            by_rule: Dict[str, dict] = {}
+            for (idx, key), n in w.counts.items():
+                name = ruleset.rules[idx].id if ruleset and idx < len(ruleset.rules) else str(idx)
+                by_rule.setdefault(name, {})["|".join("" if k is None else str(k) for k in key)] = n
+            return {
+                "buckets": len(w.buckets),
+                "rules": by_rule,
+                "hosts": dict(w.hosts),
+                "event_types": dict(w.types),
+            }
+
+
+detector = SlidingWindowDetector()
@@ -0,0 +1,312 @@
+import json
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+REPUTATION_FEEDS_DIR = os.getenv("REPUTATION_FEEDS_DIR", "")
+REPUTATION_FEEDS_CHECK_SEC = float(os.getenv("REPUTATION_FEEDS_CHECK_SEC", "30"))
+# Tipo do feed pelo prefixo do arquivo: blocklist*.txt, asn*.txt, country*.txt
+FEED_KINDS = ("blocklist", "asn", "country")
+BLOCKLIST_DEFAULT_SCORE = 100
+
+_MAGIC = b"RPX1"
+_HEADER = struct.Struct("<4sIII")  # magic, ranges v4, ranges v6, tamanho do bloco de valores
+_VIDX = struct.Struct("<I")
+
+
+def _parse_cidr(text: str) -> Optional[Tuple[int, bytes, bytes]]:
+    # (largura em bytes, início, fim) em big-endian, comparáveis como bytes
+    addr, _, plen = text.partition("/")
+    family, width = (socket.AF_INET6, 16) if ":" in addr else (socket.AF_INET, 4)
+    try:
+        packed = socket.inet_pton(family, addr)
+    except OSError:
+        return None
+    bits = width * 8
+    prefix = int(plen) if plen else bits
+    if not 0 <= prefix <= bits:
+        return None
+    n = int.from_bytes(packed, "big")
+    host_mask = (1 << (bits - prefix)) - 1
+    start = n & ~host_mask
+    return width, start.to_bytes(width, "big"), (start | host_mask).to_bytes(width, "big")
+
+
+def _parse_value(kind: str, fields: List[str]):
+    if kind == "blocklist":
+        try:
+            return int(fields[0]) if fields else BLOCKLIST_DEFAULT_SCORE
+        except ValueError:
+            return BLOCKLIST_DEFAULT_SCORE
+    if not fields:
+        return None
+    return fields[0].upper()
+
+
+def _flatten(ranges: list) -> list:
+    """Intervalos de CIDRs (sempre aninhados ou disjuntos) -> faixas disjuntas ordenadas.
+
+    O prefixo mais específico vence; para o mesmo CIDR repetido, vale a última linha.
+    """
+    ranges.sort(key=lambda r: (r[0], -int.from_bytes(r[1], "big"), r[3]))
+    out = []
+    stack = []
+    pos = None
+
+    def emit(a: int, b: int, v):
+        if a <= b:
+            if out and out[-1][2] == v and out[-1][1] + 1 == a:
+                out[-1] = (out[-1][0], b, v)
+            else:
+                out.append((a, b, v))
+
+    for s_b, e_b, v, _ in ranges:
+        s, e = int.from_bytes(s_b, "big"), int.from_bytes(e_b, "big")
+        while stack and stack[-1][1] < s:
+            top = stack.pop()
+            emit(pos, top[1], top[2])
+            pos = top[1] + 1
+        if stack:
+            emit(pos, s - 1, stack[-1][2])
+        stack.append((s, e, v))
+        pos = s
+    while stack:
+        top = stack.pop()
+        emit(pos, top[1], top[2])
+        pos = top[1] + 1
+    return out
+
+
+def compile_feed(src: str, dst: str, kind: str) -> dict:
+    """Compila um arquivo de CIDRs no formato binário lido por FeedIndex (escrita atômica)."""
+    by_width: Dict[int, list] = {4: [], 16: []}
+    lines = 0
+    with open(src, encoding="utf-8", errors="replace") as f:
+        for lineno, line in enumerate(f):
+            line = line.split("#", 1)[0].replace(",", " ").strip()
+            if not line:
+                continue
+            parts = line.split()
+            parsed = _parse_cidr(parts[0])
+            if parsed is None:
+                continue
+            value = _parse_value(kind, parts[1:])
+            if value is None:
+                continue
+            width, start, end = parsed
+            by_width[width].append((start, end, value, lineno))
+            lines += 1
+    values: list = []
+    value_idx: dict = {}
+    sections = []
+    for width in (4, 16):
+        flat = _flatten(by_width[width])
+        rec = struct.Struct(f">{width}s{width}s")
+        buf = bytearray()
+        for s, e, v in flat:
+            key = json.dumps(v)
+            idx = value_idx.get(key)
+            if idx is None:
+                idx = value_idx[key] = len(values)
+                values.append(v)
+            buf += rec.pack(s.to_bytes(width, "big"), e.to_bytes(width, "big")) + _VIDX.pack(idx)
+        sections.append((len(flat), bytes(buf)))
+    blob = json.dumps(values).encode("utf-8")
+    tmp = f"{dst}.tmp{os.getpid()}"
+    with open(tmp, "wb") as out:
+        out.write(_HEADER.pack(_MAGIC, sections[0][0], sections[1][0], len(blob)))
+        out.write(sections[0][1])
+        out.write(sections[1][1])
+        out.write(blob)
+    os.replace(tmp, dst)
+    return {"lines": lines, "ranges_v4": sections[0][0], "ranges_v6": sections[1][0]}
+
+
+class FeedIndex:
+    """Um feed compilado, mapeado em memória (mmap) e consultado por busca binária."""
+
+    def __init__(self, name: str, kind: str, path: str):
+        self.name = name
+        self.kind = kind
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n4, n6, blob_len = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"invalid feed index: {path}")
+        self.ranges_v4, self.ranges_v6 = n4, n6
+        off4 = _HEADER.size
+        off6 = off4 + n4 * (4 * 2 + 4)
+        blob_off = off6 + n6 * (16 * 2 + 4)
+        self._sections = {4: (off4, n4), 16: (off6, n6)}
+        self.values = json.loads(self._mm[blob_off:blob_off + blob_len].decode("utf-8"))
+
+    def lookup_packed(self, packed: bytes):
+        width = len(packed)
+        off, n = self._sections[width]
+        size = width * 2 + 4
+        mm = self._mm
+        lo, hi = 0, n
+        # última faixa com início <= ip
+        while lo < hi:
+            mid = (lo + hi) // 2
+            p = off + mid * size
+            if mm[p:p + width] <= packed:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        p = off + (lo - 1) * size
+        if packed <= mm[p + width:p + 2 * width]:
+            return self.values[_VIDX.unpack_from(mm, p + 2 * width)[0]]
+        return None
+
+    def memory_bytes(self) -> int:
+        return len(self._mm)
+
+    def close(self):
+        try:
+            self._mm.close()
+        finally:
+            self._file.close()
+
+
+def _pack_ip(ip: str) -> Optional[bytes]:
+    try:
+        if ":" in ip:
+            return socket.inet_pton(socket.AF_INET6, ip)
+        return socket.inet_pton(socket.AF_INET, ip)
+    except (OSError, TypeError):
+        return None
+
+
+class ReputationFeeds:
+    """Feeds locais de reputação (blocklists, ASN, país) em `feeds_dir`.
+
+    Cada arquivo é compilado em faixas disjuntas ordenadas (IPv4 e IPv6) num
+    índice binário em `feeds_dir/.index`, aberto com mmap. Quando algum arquivo
+    muda (verificado a cada `check_sec`), o conjunto novo é compilado ao lado e
+    trocado de uma vez; consultas em andamento continuam no conjunto antigo.
+    """
+
+    def __init__(self, feeds_dir: str = REPUTATION_FEEDS_DIR, check_sec: float = REPUTATION_FEEDS_CHECK_SEC, index_dir: Optional[str] = None):
+        self.feeds_dir = feeds_dir
+        self.check_sec = check_sec
+        self.index_dir = index_dir or (os.path.join(feeds_dir, ".index") if feeds_dir else "")
+        self._feeds: Dict[str, FeedIndex] = {}
+        self._signature = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"reloads": 0, "reload_errors": 0, "lookups": 0, "blocklist_hits": 0, "last_reload_ms": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.feeds_dir)
+
+    def _scan(self) -> List[Tuple[str, str, str, int, int]]:
+        out = []
+        try:
+            names = sorted(os.listdir(self.feeds_dir))
+        except OSError:
+            return out
+        for fname in names:
+            kind = next((k for k in FEED_KINDS if fname.startswith(k)), None)
+            path = os.path.join(self.feeds_dir, fname)
+            if kind is None or not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            out.append((os.path.splitext(fname)[0], kind, path, st.st_mtime_ns, st.st_size))
+        return out
+
+    def maybe_reload(self, force: bool = False) -> bool:
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_sec:
+            return False
+        with self._lock:
+            if not force and now - self._checked < self.check_sec:
+                return False
+            self._checked = now
+            files = self._scan()
+            signature = [(f[0], f[3], f[4]) for f in files]
+            if signature == self._signature:
+                return False
+            t0 = time.perf_counter()
+            try:
+                os.makedirs(self.index_dir, exist_ok=True)
+                loaded = {}
+                for name, kind, path, mtime_ns, size in files:
+                    dst = os.path.join(self.index_dir, f"{name}-{mtime_ns}-{size}.idx")
+                    if not os.path.exists(dst):
+                        compile_feed(path, dst, kind)
+                    loaded[name] = FeedIndex(name, kind, dst)
+            except Exception:
+                self._stats["reload_errors"] += 1
+                return False
+            old, self._feeds = self._feeds, loaded
+            self._signature = signature
+            self._stats["reloads"] += 1
+            self._stats["last_reload_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        # o mmap antigo é liberado quando a última consulta em andamento soltar a referência
+        keep = {f.path for f in loaded.values()}
+        for f in old.values():
+            if f.path not in keep:
+                try:
+                    os.remove(f.path)
+                except OSError:
+                    pass
+        return True
+
+    def lookup(self, ip: str) -> dict:
+        """{"blocklist": (feed, score), "asn": "AS…", "country": "BR"} — só as chaves encontradas."""
+        self.maybe_reload()
+        feeds = self._feeds
+        if not feeds:
+            return {}
+        packed = _pack_ip(ip)
+        if packed is None:
+            return {}
+        out = {}
+        for f in feeds.values():
+            v = f.lookup_packed(packed)
+            if v is None:
+                continue
+            if f.kind == "blocklist":
+                prev = out.get("blocklist")
+                if prev is None or v > prev[1]:
+                    out["blocklist"] = (f.name, v)
+            else:
+                out.setdefault(f.kind, v)
+        self._stats["lookups"] += 1
+        if "blocklist" in out:
+            self._stats["blocklist_hits"] += 1
+        return out
+
+    def stats(self) -> dict:
+        feeds = self._feeds
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "feeds": {
+                f.name: {"kind": f.kind, "ranges_v4": f.ranges_v4, "ranges_v6": f.ranges_v6, "values": len(f.values), "memory_bytes": f.memory_bytes()}
+                for f in feeds.values()
+            },
+            "memory_bytes": sum(f.memory_bytes() for f in feeds.values()),
+        }
+
+    def close(self):
+        with self._lock:
+            old, self._feeds = self._feeds, {}
+            self._signature = None
+        for f in old.values():
+            f.close()
+
+
+feeds = ReputationFeeds()
@@ -0,0 +1,113 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Tuple
+
+from sqlalchemy import delete, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .models import IngestBatch
+
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("INGEST_IDEMPOTENCY_CACHE_SIZE", "100000"))
+BATCH_RETENTION_DAYS = int(os.getenv("INGEST_BATCH_RETENTION_DAYS", "7"))
+
+BatchKey = Tuple[str, str, str]
+
+
+class RecentBatches:
+    """LRU limitado das chaves (tenant_id, agent_id, batch_id) já vistas neste processo."""
+
+    def __init__(self, capacity: int = IDEMPOTENCY_CACHE_SIZE):
+        self.capacity = capacity
+        self._keys: "OrderedDict[BatchKey, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "db_claims": 0, "db_duplicates": 0, "evictions": 0}
+
+    def __contains__(self, key: BatchKey) -> bool:
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return True
+            return False
+
+    def add(self, key: BatchKey):
+        with self._lock:
+            self._keys[key] = None
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.capacity:
+                self._keys.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def discard(self, key: BatchKey):
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "size": len(self._keys), "capacity": self.capacity}
+
+
+recent_batches = RecentBatches()
+
+
+def _insert_ignore(db: Session, values: dict) -> bool:
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(IngestBatch.__table__).values(**values).on_conflict_do_nothing(
+            index_elements=["tenant_id", "agent_id", "batch_id"]
+        )
+        return db.execute(stmt).rowcount == 1
+    # outros bancos: savepoint + violação da uq_batch
+    try:
+        with db.begin_nested():
+            db.execute(insert(IngestBatch.__table__).values(**values))
+        return True
+    except IntegrityError:
+        return False
+
+
+def claim_batch(db: Session, tenant_id: str, agent_id: str, batch_id: str) -> bool:
+    """Registra o lote; retorna False se ele já foi recebido.
+
+    Duplicatas recentes são recusadas pelo LRU sem tocar o banco; lotes novos
+    custam um único INSERT ... ON CONFLICT DO NOTHING sobre a `uq_batch`.
+    Não faz commit: o chamador controla a transação (use `release_batch` em rollback).
+    """
+    key = (tenant_id, agent_id, batch_id)
+    if key in recent_batches:
+        recent_batches.count("memory_hits")
+        return False
+    claimed = _insert_ignore(db, {"tenant_id": tenant_id, "agent_id": agent_id, "batch_id": batch_id})
+    recent_batches.count("db_claims" if claimed else "db_duplicates")
+    recent_batches.add(key)
+    return claimed
+
+
+def release_batch(tenant_id: str, agent_id: str, batch_id: str):
+    # Após rollback da transação que reivindicou o lote
+    recent_batches.discard((tenant_id, agent_id, batch_id))
+
+
+def unclaim_batch(db: Session, tenant_id: str, agent_id: str, batch_id: str):
+    # Desfaz um claim já commitado (upload abortado depois do commit). Não faz commit.
+    db.execute(delete(IngestBatch).where(IngestBatch.tenant_id == tenant_id, IngestBatch.agent_id == agent_id,
+                                         IngestBatch.batch_id == batch_id))
+    release_batch(tenant_id, agent_id, batch_id)
+
+
+def prune_ingest_batches(db: Session, older_than_days: int = BATCH_RETENTION_DAYS) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    res = db.execute(delete(IngestBatch).where(IngestBatch.created_at < cutoff))
+    db.commit()
+    return res.rowcount or 0
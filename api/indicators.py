@@ -0,0 +1,90 @@
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+
+# Indicadores padrão de execução suspeita (LOLBins); a lista completa pode vir de
+# INDICATORS_FILE (um indicador por linha, '#' para comentários) e de cada tenant
+# em integrations_json["indicators"].
+DEFAULT_INDICATORS = ("powershell", "base64", "certutil", "wmic", "rundll32")
+INDICATORS_FILE = os.getenv("INDICATORS_FILE")
+
+
+def _trie_regex(words: Iterable[str]) -> str:
+    # Alternação em forma de trie: prefixos comuns são testados uma única vez,
+    # então o custo por posição não cresce com o número de indicadores.
+    trie: dict = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = None
+
+    def emit(node: dict) -> str:
+        alts = [re.escape(ch) + emit(child) for ch, child in sorted((k, v) for k, v in node.items() if k)]
+        if not alts:
+            return ""
+        optional = "" in node
+        if len(alts) == 1 and not optional:
+            return alts[0]
+        return "(?:" + "|".join(alts) + ")" + ("?" if optional else "")
+
+    return emit(trie)
+
+
+class IndicatorMatcher:
+    """Casa vários indicadores (substrings, sem diferenciar maiúsculas) com uma única regex compilada."""
+
+    def __init__(self, indicators: Iterable[str]):
+        self.indicators = tuple(sorted({i.strip().lower() for i in indicators if i and i.strip()}))
+        self._regex = re.compile(_trie_regex(self.indicators)) if self.indicators else None
+
+    def search(self, text: str) -> Optional[str]:
+        if self._regex is None or not text:
+            return None
+        m = self._regex.search(text.lower())
+        return m.group(0) if m else None
+
+    def match_event(self, raw, app, event_type) -> Optional[str]:
+        # Mensagem bruta + app + event_type numa só passada; '\n' impede casar entre campos
+        rawmsg = str(raw.get("message", "")) if isinstance(raw, dict) else ""
+        return self.search(f"{rawmsg}\n{app or ''}\n{event_type or ''}")
+
+
+_file_lock = threading.Lock()
+_file_state = {"mtime": None, "indicators": ()}
+
+
+def _file_indicators() -> tuple:
+    if not INDICATORS_FILE:
+        return ()
+    try:
+        mtime = os.stat(INDICATORS_FILE).st_mtime
+    except OSError:
+        return ()
+    with _file_lock:
+        if _file_state["mtime"] != mtime:
+            with open(INDICATORS_FILE, encoding="utf-8") as f:
+                items = [ln.split("#", 1)[0].strip() for ln in f]
+            _file_state.update(mtime=mtime, indicators=tuple(i for i in items if i))
+        return _file_state["indicators"]
+
+
+@lru_cache(maxsize=256)
+def _compiled(indicators: frozenset) -> IndicatorMatcher:
+    return IndicatorMatcher(indicators)
+
+
+def get_matcher(extra: Iterable[str] = ()) -> IndicatorMatcher:
+    return _compiled(frozenset(DEFAULT_INDICATORS) | frozenset(_file_indicators()) | frozenset(i.lower() for i in extra if i))
+
+
+def matcher_for_tenant(db: Session, tenant_id: str) -> IndicatorMatcher:
+    from .models import Tenant
+    tenant = db.get(Tenant, tenant_id)
+    extra = (tenant.integrations_json or {}).get("indicators", []) if tenant else []
+    return get_matcher(extra if isinstance(extra, list) else [])
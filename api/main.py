@@ -1,26 +1,50 @@
+import logging
 import os
+import threading
+from array import array
 from datetime import datetime, timedelta
-from typing import List
+from typing import List, Optional
 
 from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 
-from .database import init_db, SessionLocal
-from .models import Tenant, Agent, Event, Incident, IngestBatch, Subscription, Asset, Notification
-from .schemas import IngestBatchIn, AgentRegisterIn, ScoreOut, EventIn
-from .security import require_tenant, get_db, require_admin
+from .database import init_db, SessionLocal, pool_metrics
+from .models import Tenant, Agent, Event, Incident, Subscription, Asset, Notification
+from .schemas import AgentRegisterIn, ScoreOut, EventIn
+from .security import require_tenant, get_db, get_async_db, get_read_db, get_async_read_db, require_admin
 from .auth import create_user, verify_password, create_jwt
 from .actions import block_ip
 from .reporting import generate_and_send_latest
-from .ratelimit import check_rate
-from .reputation import get_ip_reputation
+from .ratelimit import check_rate, check_admission, is_low_severity_only, add_pending, get_pending, reconcile_pending, redis_client
+from .reputation import resolve_many as resolve_reputation, resolver as reputation_resolver, cache as reputation_cache
+from .feeds import feeds as reputation_feeds
+from .bulk import prepare_event_rows, insert_event_rows, delete_event_rows
+from .streaming import iter_ndjson, StreamError, STREAM_CHUNK_EVENTS
+from .coalescer import IngestCoalescer
+from .decoding import decode_ingest_batch
+from .workers import ingest_pool, IngestWorkerPool, INGEST_WORKERS, INGEST_SUBMIT_WAIT_SEC
+from .writer import event_inserts
+from .idempotency import claim_batch, release_batch, unclaim_batch, recent_batches, prune_ingest_batches
+from .partitions import ensure_partitions, run_maintenance as run_partition_maintenance
+from .payloads import load_payloads, payload_stats
+from .archive import STRING_COLUMNS as ARCHIVE_FIELDS, query as archive_query, find_event as archive_find_event, run_archiver
+from .ruleset import utc_naive, load_rule_specs
+from .rollups import incident_totals_stmt, score_from_totals, hourly_series, breakdown, stats_window
 from .notifications import send_email
 from .dependencies import require_active_subscription
 from . import billing
 
+log = logging.getLogger("api.main")
+
+# Motor de detecção: "incremental" (janela em memória por processo) ou "full" (varre a janela
+# no banco a cada lote). Com RQ, vários processos tratam o mesmo tenant: padrão "full".
+RULES_ENGINE = os.getenv("RULES_ENGINE", "full" if os.getenv("REDIS_URL") else "incremental").lower()
+
 app = FastAPI(title="DigitalSec Platform API", version="0.1.0")
 
 app.include_router(billing.router)
@@ -36,7 +60,8 @@ app.add_middleware(
 
 @app.on_event("startup")
 def on_startup():
-    
+    # RULES_FILE ausente ou com nome errado falha aqui, não no primeiro lote
+    load_rule_specs()
     # Seed a demo tenant if none
     with SessionLocal() as db:
         if not db.query(Tenant).count():
@@ -56,8 +81,15 @@ def on_startup():
             # Bootstrap a default admin only if there are no users yet
             if db.query(User).count() == 0:
                 create_user(db, tenant_id="demo", email="admin@local", password="admin123", role="org_admin")
+        # Partições de events do dia e das próximas (no-op fora do Postgres particionado)
+        try:
+            ensure_partitions(db)
+        except Exception:
+            db.rollback()
     # Prepare static dir for reports
     os.makedirs("data/reports", exist_ok=True)
+    ingest_pool.start()
+    event_inserts.start()
 
 app.mount("/static", StaticFiles(directory="data"), name="static")
 
@@ -85,6 +117,23 @@ if os.getenv("ENABLE_SCHEDULER", "0").lower() in ("1", "true", "yes"):
                         pass
         interval_minutes = int(os.getenv("SCHEDULER_INTERVAL_MINUTES", "1440"))
         scheduler.add_job(daily_reports, 'interval', minutes=interval_minutes, id='daily_reports', replace_existing=True)
+        def prune_batches():
+            # Retenção do registro de idempotência (INGEST_BATCH_RETENTION_DAYS)
+            with SessionLocal() as db:
+                try:
+                    prune_ingest_batches(db)
+                except Exception:
+                    pass
+        scheduler.add_job(prune_batches, 'interval', hours=24, id='prune_ingest_batches', replace_existing=True)
+        def maintain_events():
+            # Arquivo colunar (EVENTS_ARCHIVE_AFTER_DAYS), próximas partições de events e retenção por plano
+            with SessionLocal() as db:
+                try:
+                    run_archiver(db)
+                    run_partition_maintenance(db)
+                except Exception:
+                    pass
+        scheduler.add_job(maintain_events, 'interval', hours=6, id='maintain_events', replace_existing=True)
         scheduler.start()
     except Exception:
         scheduler = None
@@ -132,34 +181,28 @@ def get_config(tenant: Tenant = Depends(require_tenant)):
 
 def _process_events(db: Session, tenant_id: str, agent_id: str, items: List[dict]):
     # Persist events, enrich IP reputation e gerar incidentes
-    from .rules import classify_and_upsert_incidents
-    ips = set()
-    for e in items:
-        ts = datetime.fromisoformat(e.get("ts").replace("Z", "+00:00")) if e.get("ts") else datetime.utcnow()
-        ev = Event(
-            tenant_id=tenant_id,
-            agent_id=agent_id,
-            ts=ts,
-            host=e.get("host"),
-            app=e.get("app"),
-            event_type=e.get("event_type"),
-            src_ip=e.get("src_ip"),
-            dst_ip=e.get("dst_ip"),
-            username=e.get("username"),
-            severity=e.get("severity"),
-            raw_json=e.get("raw")
-        )
-        db.add(ev)
-        if e.get("src_ip"):
-            ips.add(e.get("src_ip"))
+    rows, ips = prepare_event_rows(tenant_id, agent_id, items)
+    insert_event_rows(db, rows)
     db.commit()
-    # Enriquecimento de reputação (cache)
-    for ip in ips:
-        try:
-            get_ip_reputation(db, ip)
-        except Exception:
-            pass
-    new_crit = classify_and_upsert_incidents(db, tenant_id)
+    _post_process(db, tenant_id, ips, rows)
+
+
+def _post_process(db: Session, tenant_id: str, ips: set, rows: Optional[list] = None):
+    # Enriquecimento de reputação, regras e notificações sobre eventos já persistidos.
+    # Com as linhas do lote em mãos, a detecção é incremental; sem elas, varredura da janela.
+    from .rules import classify_and_upsert_incidents, detect_and_upsert_incidents
+    from .detection import detector
+    # Enriquecimento de reputação (cache + provedores em paralelo)
+    try:
+        resolve_reputation(db, ips)
+    except Exception:
+        db.rollback()
+    if rows is not None and RULES_ENGINE == "incremental":
+        new_crit = detect_and_upsert_incidents(db, tenant_id, rows)
+    else:
+        new_crit = classify_and_upsert_incidents(db, tenant_id)
+        # eventos fora do detector incremental: recarrega a janela do banco na próxima vez
+        detector.reset(tenant_id)
     # Notificações por e-mail se configurado
     tenant = db.get(Tenant, tenant_id)
     for inc in new_crit:
@@ -177,50 +220,240 @@ def _process_events(db: Session, tenant_id: str, agent_id: str, items: List[dict
         db.commit()
 
 
+def _pending_ingest(tenant_id: str) -> tuple:
+    # Eventos aceitos e ainda não processados: contadores no Redis (RQ) ou filas locais.
+    # Com Redis faz I/O bloqueante: chamar via run_in_threadpool
+    if os.getenv("REDIS_URL"):
+        try:
+            r = redis_client()
+            reconcile_pending(r)
+            return get_pending(r, tenant_id)
+        except Exception:
+            return 0, 0
+    return (ingest_pool.pending_events(tenant_id) + coalescer.pending_events(tenant_id) + event_inserts.pending_events(tenant_id),
+            ingest_pool.pending_events() + coalescer.pending_events() + event_inserts.pending_events())
+
+
+async def _admit(tenant_id: str, incoming: int, low_only: bool = False):
+    pending_tenant, pending_global = await run_in_threadpool(_pending_ingest, tenant_id)
+    check_admission(tenant_id, pending_tenant, pending_global, incoming=incoming, low_only=low_only)
+
+
 @app.post("/v1/ingest")
-async def ingest(request: Request, background: BackgroundTasks, tenant: Tenant = Depends(require_tenant), db: Session = Depends(get_db)):
+async def ingest(request: Request, background: BackgroundTasks, tenant: Tenant = Depends(require_tenant), db: AsyncSession = Depends(get_async_db)):
     # Per-tenant rate limit
-    check_rate(f"ingest:{tenant.id}")
+    await run_in_threadpool(check_rate, f"ingest:{tenant.id}")
     # Handle optional gzip Content-Encoding
     raw = await request.body()
     if request.headers.get("content-encoding", "").lower() == "gzip":
         import gzip
         raw = gzip.decompress(raw)
-    import json
-    data = json.loads(raw.decode("utf-8"))
     try:
-        payload = IngestBatchIn(**data)
+        agent_id, batch_id, items = decode_ingest_batch(raw)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid payload: {e}")
-    # Idempotency check
-    exists = db.query(IngestBatch).filter_by(tenant_id=tenant.id, agent_id=payload.agent_id, batch_id=payload.batch_id).first()
-    if exists:
-        return {"status": "duplicate", "accepted": 0}
-    rec = IngestBatch(tenant_id=tenant.id, agent_id=payload.agent_id, batch_id=payload.batch_id)
-    db.add(rec)
-    db.commit()
-    # Processamento assíncrono: usa RQ se REDIS_URL estiver configurado; senão BackgroundTasks
+    # Backpressure: recusa (429/503 + Retry-After) quando o trabalho pendente passa dos limites
+    await _admit(tenant.id, len(items), is_low_severity_only(items))
+    # Idempotency check: LRU em memória + INSERT ... ON CONFLICT DO NOTHING na uq_batch
+    # Se o commit falhar, a chave sai do LRU para que o retry do agente não vire "duplicate"
     try:
-        import os
-        if os.getenv("REDIS_URL"):
+        if not await db.run_sync(claim_batch, tenant.id, agent_id, batch_id):
+            return {"status": "duplicate", "accepted": 0}
+        await db.commit()
+    except Exception:
+        release_batch(tenant.id, agent_id, batch_id)
+        await db.rollback()
+        raise
+    # SQLite otimizado: os INSERTs de todos os lotes passam pela mesma thread (api/writer.py)
+    if event_inserts.enabled and not os.getenv("REDIS_URL") and event_inserts.submit(tenant.id, agent_id, items, batch_id=batch_id):
+        return {"status": "accepted", "accepted": len(items)}
+    # Micro-batching entre requests (INGEST_COALESCE_MS > 0, sem Redis): os eventos
+    # são gravados no próximo flush do tenant
+    if coalescer.enabled and not os.getenv("REDIS_URL"):
+        coalescer.submit(tenant.id, agent_id, batch_id, items)
+        return {"status": "accepted", "accepted": len(items)}
+    # Processamento assíncrono: usa RQ se REDIS_URL estiver configurado; senão o pool de
+    # workers de ingest (INGEST_WORKERS) e, por último, BackgroundTasks com sessão própria
+    if os.getenv("REDIS_URL"):
+        try:
             from rq import Queue
-            import redis
-            r = redis.Redis.from_url(os.getenv("REDIS_URL"))
+            r = redis_client()
             q = Queue("ingest", connection=r)
-            q.enqueue("api.tasks.process_events_job", tenant.id, payload.agent_id, [e.dict(by_alias=True) | {"ts": e.ts} for e in payload.events])
-        else:
-            background.add_task(_process_events, db, tenant.id, payload.agent_id, [e.dict(by_alias=True) | {"ts": e.ts} for e in payload.events])
+            await run_in_threadpool(q.enqueue, "api.tasks.process_events_job", tenant.id, agent_id, items)
+        except Exception:
+            background.add_task(_process_events_job, tenant.id, agent_id, items)
+            return {"status": "accepted", "accepted": len(items)}
+        # Job já na fila: falha no contador só afeta o admission control, não pode regravar o lote
+        try:
+            await run_in_threadpool(add_pending, r, tenant.id, len(items))
+        except Exception:
+            log.warning("ingest: contador de pendências não atualizado (tenant=%s, %d eventos)", tenant.id, len(items), exc_info=True)
+        return {"status": "accepted", "accepted": len(items)}
+    try:
+        if not ingest_pool.submit(tenant.id, agent_id, items) and not await run_in_threadpool(
+                ingest_pool.submit, tenant.id, agent_id, items, True, INGEST_SUBMIT_WAIT_SEC):
+            # Última saída: fora da fila do tenant, este lote pode ser gravado fora de ordem
+            background.add_task(_process_events_job, tenant.id, agent_id, items)
+    except Exception:
+        background.add_task(_process_events_job, tenant.id, agent_id, items)
+    return {"status": "accepted", "accepted": len(items)}
+
+
+def _process_events_job(tenant_id: str, agent_id: str, items: List[dict]):
+    with SessionLocal() as db:
+        _process_events(db, tenant_id, agent_id, items)
+
+
+def _post_process_job(tenant_id: str, ips: set):
+    with SessionLocal() as db:
+        _post_process(db, tenant_id, ips)
+
+
+def _flush_coalesced(tenant_id: str, entries: list):
+    # Um flush do coalescer: eventos de todos os lotes do tenant numa transação e regras uma vez
+    with SessionLocal() as db:
+        ips = set()
+        all_rows = []
+        for agent_id, batch_id, items in entries:
+            rows, batch_ips = prepare_event_rows(tenant_id, agent_id, items)
+            insert_event_rows(db, rows)
+            all_rows.extend(rows)
+            ips |= batch_ips
+        db.commit()
+        # Eventos já gravados: falha nas regras não pode fazer o coalescer regravar o flush
+        try:
+            _post_process(db, tenant_id, ips, all_rows)
+        except Exception:
+            log.exception("coalescer: regras falharam após gravar %d eventos (tenant=%s)", len(all_rows), tenant_id)
+
+
+coalescer = IngestCoalescer(_flush_coalesced)
+
+
+def _write_batch(db: Session, jobs: list) -> list:
+    # Uma transação do event_inserts: só os INSERTs dos eventos (e rollups), cada lote num
+    # savepoint. Regras, reputação e e-mail vão para o rules_pool, que grava em transações próprias.
+    failed = []
+    by_tenant = {}
+    for job in jobs:
+        try:
+            with db.begin_nested():
+                rows, ips = prepare_event_rows(job.tenant_id, job.agent_id, job.items)
+                insert_event_rows(db, rows)
+        except Exception:
+            log.exception("event inserts: lote descartado (tenant=%s agent=%s batch=%s, %d eventos)",
+                          job.tenant_id, job.agent_id, job.batch_id, len(job.items))
+            failed.append(job)
+            continue
+        by_tenant.setdefault(job.tenant_id, []).extend(rows)
+    db.commit()
+    for tenant_id, rows in by_tenant.items():
+        _schedule_post_process(tenant_id, rows)
+    return failed
+
+
+def _post_process_rows(db: Session, tenant_id: str, agent_id: str, rows: list):
+    # Job do rules_pool: linhas já gravadas pelo event_inserts
+    _post_process(db, tenant_id, {r["src_ip"] for r in rows if r.get("src_ip")}, rows)
+
+
+# Pós-processamento do SQLite otimizado; mesma fila por tenant, então a ordem dos lotes se mantém
+rules_pool = IngestWorkerPool(_post_process_rows, workers=INGEST_WORKERS if event_inserts.enabled else 0)
+
+
+def _schedule_post_process(tenant_id: str, rows: list):
+    if rules_pool.submit(tenant_id, "", rows):
+        return
+    # Fila cheia (ou pool desligado): varredura da janela numa thread à parte, sem travar a thread de INSERTs
+    ips = {r["src_ip"] for r in rows if r.get("src_ip")}
+    threading.Thread(target=_post_process_job, args=(tenant_id, ips), daemon=True).start()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    event_inserts.stop()
+    rules_pool.stop()
+    coalescer.stop()
+    ingest_pool.stop()
+    reputation_resolver.close()
+
+
+def _abort_stream(db: Session, tenant_id: str, agent_id: str, batch_id: str, ids):
+    # Upload recusado no meio: apaga os blocos já commitados e o claim, para o retry do agente
+    # entrar inteiro (e não como "duplicate" com metade dos eventos)
+    db.rollback()
+    try:
+        delete_event_rows(db, tenant_id, ids)
+        unclaim_batch(db, tenant_id, agent_id, batch_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        release_batch(tenant_id, agent_id, batch_id)
+        log.exception("ingest stream: falha ao desfazer %d eventos do lote (tenant=%s agent=%s batch=%s)",
+                      len(ids), tenant_id, agent_id, batch_id)
+
+
+@app.post("/v1/ingest/stream")
+async def ingest_stream(request: Request, background: BackgroundTasks, agent_id: str, batch_id: str, tenant: Tenant = Depends(require_tenant), db: Session = Depends(get_db)):
+    # Ingest NDJSON (um evento por linha, gzip opcional) com memória limitada:
+    # descompressão, validação e gravação acontecem em blocos de tamanho fixo.
+    await run_in_threadpool(check_rate, f"ingest:{tenant.id}")
+    await _admit(tenant.id, 0)
+    # Claim do lote na sua própria transação; depois cada bloco de eventos tem o seu commit,
+    # para não segurar a transação de escrita (e o lock do SQLite) durante o upload inteiro
+    try:
+        if not await run_in_threadpool(claim_batch, db, tenant.id, agent_id, batch_id):
+            return {"status": "duplicate", "accepted": 0}
+        await run_in_threadpool(db.commit)
+    except Exception:
+        release_batch(tenant.id, agent_id, batch_id)
+        await run_in_threadpool(db.rollback)
+        raise
+    gzipped = request.headers.get("content-encoding", "").lower() == "gzip"
+    accepted = 0
+    ips = set()
+    chunk = []
+    ids = array("q")  # ids já commitados, para desfazer o upload se ele falhar no meio
+
+    def flush(items):
+        rows, batch_ips = prepare_event_rows(tenant.id, agent_id, items)
+        insert_event_rows(db, rows)
+        db.commit()
+        ids.extend(r["id"] for r in rows if r.get("id") is not None)
+        ips.update(batch_ips)
+
+    try:
+        async for lineno, obj in iter_ndjson(request.stream(), gzipped):
+            try:
+                e = EventIn(**obj)
+            except Exception as exc:
+                raise StreamError(f"line {lineno}: {exc}")
+            chunk.append(e.model_dump())
+            if len(chunk) >= STREAM_CHUNK_EVENTS:
+                await run_in_threadpool(flush, chunk)
+                accepted += len(chunk)
+                chunk = []
+        if chunk:
+            await run_in_threadpool(flush, chunk)
+            accepted += len(chunk)
+    except StreamError as exc:
+        await run_in_threadpool(_abort_stream, db, tenant.id, agent_id, batch_id, ids)
+        raise HTTPException(status_code=exc.status_code, detail=f"Invalid payload: {exc}")
     except Exception:
-        background.add_task(_process_events, db, tenant.id, payload.agent_id, [e.dict(by_alias=True) | {"ts": e.ts} for e in payload.events])
-    return {"status": "accepted", "accepted": len(payload.events)}
+        await run_in_threadpool(_abort_stream, db, tenant.id, agent_id, batch_id, ids)
+        raise
+    # Regras e reputação na fila do tenant no pool de ingest (limitada, mesma ordem dos lotes);
+    # BackgroundTasks só com a fila cheia ou o pool desligado
+    if not ingest_pool.submit(tenant.id, agent_id, [], handler=lambda db, tenant_id, _agent, _items: _post_process(db, tenant_id, ips)):
+        background.add_task(_post_process_job, tenant.id, ips)
+    return {"status": "accepted", "accepted": accepted}
 
 
 @app.get("/v1/incidents")
-def list_incidents(tenant: Tenant = Depends(require_tenant), db: Session = Depends(get_db)):
-    from fastapi import Query
+async def list_incidents(tenant: Tenant = Depends(require_tenant), db: AsyncSession = Depends(get_async_read_db)):
     # Read filters via request query manual; list recentes, filtros em /v1/incidents/search.
     # We'll just list recent 200 for now, advanced filters exposed in separate endpoint.
-    q = db.execute(select(Incident).where(Incident.tenant_id == tenant.id).order_by(Incident.last_seen.desc()).limit(200))
+    q = await db.execute(select(Incident).where(Incident.tenant_id == tenant.id).order_by(Incident.last_seen.desc()).limit(200))
     items = []
     for (inc,) in q:
         items.append({
@@ -271,7 +504,7 @@ async def login(payload: dict, db: Session = Depends(get_db)):
 def search_incidents(
     request: Request,
     tenant: Tenant = Depends(require_tenant),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     params = request.query_params
     severity = params.get("severity")
@@ -318,17 +551,27 @@ def search_incidents(
 
 
 @app.get("/v1/score", response_model=ScoreOut)
-def get_score(tenant: Tenant = Depends(require_tenant), db: Session = Depends(get_db)):
+async def get_score(tenant: Tenant = Depends(require_tenant), db: AsyncSession = Depends(get_async_read_db)):
     window = int(os.getenv("SCORE_DEFAULT_WINDOW_DAYS", "7"))
     since = datetime.utcnow() - timedelta(days=window)
-    sev_weight = {"low": 1, "medium": 3, "high": 7, "critical": 12}
-    q = db.execute(select(Incident.severity, func.sum(Incident.count)).where(Incident.tenant_id == tenant.id, Incident.last_seen >= since).group_by(Incident.severity))
-    total = 0
-    for severity, cnt in q:
-        total += sev_weight.get(severity or "low", 1) * int(cnt or 0)
-    # Very simple score: 100 - scaled incident weight.
-    score = max(0, 100 - min(100, total))
-    return ScoreOut(score=score, window_days=window)
+    # Very simple score: 100 - scaled incident weight (ocorrências da janela, via incident_rollups)
+    q = await db.execute(incident_totals_stmt(tenant.id, since))
+    return ScoreOut(score=score_from_totals(q), window_days=window)
+
+
+@app.get("/v1/stats")
+def get_stats(days: int = 7, tenant: Tenant = Depends(require_tenant), db: Session = Depends(get_read_db)):
+    # Séries por hora e totais da janela, lidos dos agregados (event_rollups / incident_rollups)
+    since, until = stats_window(days)
+    totals = list(db.execute(incident_totals_stmt(tenant.id, since, until)))
+    return {
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "score": score_from_totals(totals),
+        "incidents_by_severity": {sev: int(n or 0) for sev, n in totals},
+        **breakdown(db, tenant.id, since, until),
+        "series": hourly_series(db, tenant.id, since, until),
+    }
 
 
 
@@ -344,7 +587,7 @@ def latest_report(tenant: Tenant = Depends(require_tenant)):
 
 
 @app.get("/v1/assets")
-def list_assets(tenant: Tenant = Depends(require_tenant), db: Session = Depends(get_db)):
+def list_assets(tenant: Tenant = Depends(require_tenant), db: Session = Depends(get_read_db)):
     q = db.execute(select(Asset).where(Asset.tenant_id == tenant.id).order_by(Asset.last_seen_at.desc().nullslast()))
     items = []
     for (a,) in q:
@@ -367,6 +610,62 @@ def ack_incident(incident_id: int, tenant: Tenant = Depends(require_tenant), db:
     return {"ok": True}
 
 
+@app.get("/v1/events/search")
+def search_events(request: Request, tenant: Tenant = Depends(require_tenant), db: Session = Depends(get_read_db)):
+    # Eventos recentes (tabela events) + histórico arquivado (api/archive.py), mais recentes primeiro.
+    # Com group_by=host|src_ip|event_type|..., retorna contagens por valor.
+    params = request.query_params
+    filters = {f: params.get(f) for f in ARCHIVE_FIELDS if params.get(f)}
+    group_by = params.get("group_by")
+    if group_by and group_by not in ARCHIVE_FIELDS:
+        raise HTTPException(status_code=400, detail="invalid group_by")
+    try:
+        limit = min(1000, max(1, int(params.get("limit", 200))))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid limit")
+    def parse_dt(s):
+        try:
+            return datetime.fromisoformat(s.replace("Z", "+00:00"))
+        except Exception:
+            return None
+    since = parse_dt(params.get("since") or "")
+    until = parse_dt(params.get("until") or "")
+    conds = [Event.tenant_id == tenant.id] + [getattr(Event, f) == v for f, v in filters.items()]
+    if since:
+        conds.append(Event.ts >= since)
+    if until:
+        conds.append(Event.ts < until)
+    archived = archive_query(tenant.id, since, until, filters, group_by, limit)
+    if group_by:
+        col = getattr(Event, group_by)
+        counts = {k: int(n) for k, n in db.execute(select(col, func.count()).where(*conds, col.is_not(None)).group_by(col))}
+        for k, n in archived["counts"].items():
+            counts[k] = counts.get(k, 0) + n
+        return {"counts": dict(sorted(counts.items(), key=lambda kv: -kv[1])), "archived_rows_scanned": archived["scanned_rows"]}
+    cols = (Event.id, Event.ts, *(getattr(Event, f) for f in ARCHIVE_FIELDS))
+    hot = [dict(r) for r in db.execute(select(*cols).where(*conds).order_by(Event.ts.desc(), Event.id.desc()).limit(limit)).mappings()]
+    for r in hot:
+        r["archived"] = False
+    cold = [{**r, "archived": True} for r in archived["items"]]
+    items = sorted(hot + cold, key=lambda r: utc_naive(r["ts"]), reverse=True)[:limit]
+    for r in items:
+        r["ts"] = r["ts"].isoformat()
+    return {"items": items, "archived_rows_scanned": archived["scanned_rows"]}
+
+
+@app.get("/v1/events/{event_id}/raw")
+def get_event_raw(event_id: int, tenant: Tenant = Depends(require_tenant), db: Session = Depends(get_db)):
+    # Payload original do evento, descomprimido sob demanda (api/payloads.py); eventos que já
+    # saíram de `events` vêm do segmento do arquivo (api/archive.py)
+    raw = load_payloads(db, tenant.id, [event_id])
+    if event_id in raw:
+        return {"id": event_id, "raw": raw[event_id]}
+    ev = archive_find_event(tenant.id, event_id)
+    if ev is None:
+        raise HTTPException(status_code=404, detail="not found")
+    return {"id": event_id, "raw": ev["raw"], "archived": True}
+
+
 @app.post("/v1/actions/block_ip")
 def api_block_ip(payload: dict, tenant: Tenant = Depends(require_tenant), db: Session = Depends(get_db)):
     ip = payload.get("ip")
@@ -378,7 +677,7 @@ def api_block_ip(payload: dict, tenant: Tenant = Depends(require_tenant), db: Se
 
 
 @app.get("/v1/reports")
-def list_reports(tenant: Tenant = Depends(require_tenant), db: Session = Depends(get_db)):
+def list_reports(tenant: Tenant = Depends(require_tenant), db: Session = Depends(get_read_db)):
     from .models import Report
     rows = db.execute(select(Report).where(Report.tenant_id == tenant.id).order_by(Report.period_end.desc()).limit(20))
     items = []
@@ -461,6 +760,28 @@ async def create_tenant(payload: dict, _: bool = Depends(require_admin), db: Ses
     return {"id": tid, "ingest_token": token, "plan": plan, "alert_email": alert_email}
 
 
+@app.get("/admin/ingest/stats")
+async def ingest_stats(_: bool = Depends(require_admin)):
+    return {"coalescer": coalescer.stats(), "idempotency": recent_batches.snapshot(), "workers": ingest_pool.stats(),
+            "event_inserts": event_inserts.stats(), "rules_pool": rules_pool.stats(),
+            "pending_events": (await run_in_threadpool(_pending_ingest, ""))[1]}
+
+
+@app.get("/admin/payloads/stats")
+def payloads_stats(_: bool = Depends(require_admin), db: Session = Depends(get_db)):
+    return payload_stats(db)
+
+
+@app.get("/admin/db/pool")
+async def db_pool_stats(_: bool = Depends(require_admin)):
+    return pool_metrics()
+
+
+@app.get("/admin/reputation/stats")
+async def reputation_stats(_: bool = Depends(require_admin)):
+    return {"resolver": reputation_resolver.stats(), "cache": reputation_cache.stats(), "feeds": reputation_feeds.stats()}
+
+
 @app.post("/admin/tenants/{tenant_id}/rotate-token")
 async def rotate_token(tenant_id: str, _: bool = Depends(require_admin), db: Session = Depends(get_db)):
     t = db.get(Tenant, tenant_id)
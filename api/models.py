@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, Boolean, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, Boolean, UniqueConstraint, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -63,7 +63,11 @@ class Event(Base):
     dst_ip = Column(String, nullable=True)
     username = Column(String, nullable=True)
     severity = Column(String, nullable=True)
-    raw_json = Column(JSON, nullable=True)
+    raw_json = Column(JSON, nullable=True)  # nulo quando o payload está em event_payload_blocks
+    payload_block_id = Column(Integer, nullable=True)
+    payload_idx = Column(Integer, nullable=True)
+    # janela das regras, replay e listagens: sempre por tenant e intervalo de ts
+    __table_args__ = (Index('ix_events_tenant_ts', 'tenant_id', 'ts'),)
 
 
 class Incident(Base):
@@ -77,6 +81,63 @@ class Incident(Base):
     count = Column(Integer, nullable=False, default=1)
     context_json = Column(JSON, nullable=True)
     status = Column(String, nullable=False, default="open")
+    fingerprint = Column(String, nullable=True)  # ver rules.incident_fingerprint
+    __table_args__ = (
+        Index('uq_incident_fingerprint', 'tenant_id', 'fingerprint', unique=True),
+        Index('ix_incidents_tenant_last_seen', 'tenant_id', 'last_seen'),  # listagem e score
+        Index('ix_incidents_tenant_status', 'tenant_id', 'status'),  # checklist
+    )
+
+
+class ReplayIncident(Base):
+    # Resultado de replay em modo dry-run (api/replay.py); não afeta `incidents`
+    __tablename__ = "replay_incidents"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(String, nullable=False, index=True)
+    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False)
+    fingerprint = Column(String, nullable=False)
+    kind = Column(String, nullable=False)
+    severity = Column(String, nullable=False)
+    first_seen = Column(DateTime(timezone=True), nullable=False)
+    last_seen = Column(DateTime(timezone=True), nullable=False)
+    count = Column(Integer, nullable=False, default=1)
+    context_json = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class EventPayloadBlock(Base):
+    # Payloads (raw) de um lote de eventos, comprimidos juntos (api/payloads.py)
+    __tablename__ = "event_payload_blocks"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False)
+    codec = Column(String, nullable=False)  # zlib|zstd
+    count = Column(Integer, nullable=False)
+    raw_bytes = Column(Integer, nullable=False)
+    stored_bytes = Column(Integer, nullable=False)
+    ts_min = Column(DateTime(timezone=True), nullable=True)
+    ts_max = Column(DateTime(timezone=True), nullable=True)
+    data = Column(LargeBinary, nullable=False)
+    __table_args__ = (Index('ix_event_payload_blocks_tenant_ts_max', 'tenant_id', 'ts_max'),)
+
+
+class EventRollup(Base):
+    # Eventos por hora (api/rollups.py); severity/event_type ausentes viram ""
+    __tablename__ = "event_rollups"
+    tenant_id = Column(String, ForeignKey("tenants.id"), primary_key=True)
+    hour = Column(DateTime(timezone=True), primary_key=True)
+    severity = Column(String, primary_key=True, default="")
+    event_type = Column(String, primary_key=True, default="")
+    count = Column(Integer, nullable=False, default=0)
+
+
+class IncidentRollup(Base):
+    # Ocorrências de incidentes por hora, alimenta score e relatórios
+    __tablename__ = "incident_rollups"
+    tenant_id = Column(String, ForeignKey("tenants.id"), primary_key=True)
+    hour = Column(DateTime(timezone=True), primary_key=True)
+    severity = Column(String, primary_key=True)
+    kind = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
 
 
 class IPReputation(Base):
@@ -0,0 +1,232 @@
+"""Particionamento de `events` por tempo e retenção por plano.
+
+No Postgres, `events` é particionada por RANGE (ts) em partições diárias ou
+semanais (EVENTS_PARTITION_INTERVAL). `ensure_partitions` cria as próximas
+partições com antecedência e a retenção descarta partições inteiras (DETACH +
+DROP) em vez de DELETE. No SQLite (dev) a tabela é comum e a retenção apaga as
+linhas vencidas em blocos.
+
+Uso:
+  python -m api.partitions            # cria partições e aplica a retenção
+  python -m api.partitions --dry-run  # só mostra o que seria feito
+"""
+import argparse
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.orm import Session
+
+from .models import Event, Plan, Tenant
+from .archive import prune_segments
+from .payloads import prune_payload_blocks
+
+
+EVENTS_PARTITION_INTERVAL = os.getenv("EVENTS_PARTITION_INTERVAL", "day")  # day|week
+EVENTS_PARTITION_PREMAKE = int(os.getenv("EVENTS_PARTITION_PREMAKE", "7"))
+# Dias de retenção por plano ("starter=30,pro=90"); Plan.features["retention_days"] tem precedência
+EVENTS_RETENTION_DAYS = os.getenv("EVENTS_RETENTION_DAYS", "starter=30,pro=90,enterprise=365")
+EVENTS_RETENTION_DEFAULT_DAYS = int(os.getenv("EVENTS_RETENTION_DEFAULT_DAYS", "90"))
+EVENTS_RETENTION_DELETE_CHUNK = int(os.getenv("EVENTS_RETENTION_DELETE_CHUNK", "5000"))
+
+_BOUND_RE = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+
+def _parse_plan_days(value: str) -> Dict[str, int]:
+    out = {}
+    for part in (value or "").split(","):
+        name, _, days = part.partition("=")
+        try:
+            out[name.strip()] = int(days)
+        except ValueError:
+            continue
+    return out
+
+
+def plan_retention_days(db: Session) -> Dict[str, int]:
+    days = _parse_plan_days(EVENTS_RETENTION_DAYS)
+    for name, features in db.execute(select(Plan.name, Plan.features)):
+        if isinstance(features, str):
+            try:
+                features = json.loads(features)
+            except ValueError:
+                features = None
+        if isinstance(features, dict) and features.get("retention_days"):
+            days[name] = int(features["retention_days"])
+    return days
+
+
+def tenant_retention_days(db: Session) -> Dict[str, int]:
+    by_plan = plan_retention_days(db)
+    return {tid: by_plan.get(plan, EVENTS_RETENTION_DEFAULT_DAYS) for tid, plan in db.execute(select(Tenant.id, Tenant.plan))}
+
+
+def is_partitioned(db: Session) -> bool:
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    return db.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('events')"
+    )).first() is not None
+
+
+def _utc(ts: datetime) -> datetime:
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+
+def partition_start(ts: datetime, interval: str = EVENTS_PARTITION_INTERVAL) -> datetime:
+    start = _utc(ts).replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == "week":
+        start -= timedelta(days=start.weekday())  # semanas começam na segunda
+    return start
+
+
+def partition_step(interval: str = EVENTS_PARTITION_INTERVAL) -> timedelta:
+    return timedelta(days=7 if interval == "week" else 1)
+
+
+def partition_name(start: datetime, interval: str = EVENTS_PARTITION_INTERVAL) -> str:
+    return f"events_{'w' if interval == 'week' else 'p'}{start:%Y%m%d}"
+
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return _utc(datetime.fromisoformat(value.strip("'").replace(" ", "T")))
+
+
+def list_partitions(db: Session) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """(nome, início, fim) das partições de events; a partição DEFAULT vem com (None, None)."""
+    rows = db.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass('events') ORDER BY c.relname"
+    ))
+    out = []
+    for name, bound in rows:
+        m = _BOUND_RE.search(bound or "")
+        if m:
+            out.append((name, _parse_bound(m.group(1)), _parse_bound(m.group(2))))
+        else:
+            out.append((name, None, None))
+    return out
+
+
+def _create_partition(db: Session, name: str, lo: datetime, hi: datetime, default: Optional[str]):
+    bounds = f"FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')"
+    moved = default and db.execute(text(
+        f"SELECT 1 FROM {default} WHERE ts >= :lo AND ts < :hi LIMIT 1"), {"lo": lo, "hi": hi}).first()
+    if not moved:
+        db.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF events FOR VALUES {bounds}"))
+        return
+    # Linhas dessa faixa caíram na DEFAULT (partição criada atrasada): move para a nova
+    db.execute(text(f"ALTER TABLE events DETACH PARTITION {default}"))
+    db.execute(text(f"CREATE TABLE {name} PARTITION OF events FOR VALUES {bounds}"))
+    db.execute(text(f"INSERT INTO events SELECT * FROM {default} WHERE ts >= :lo AND ts < :hi"), {"lo": lo, "hi": hi})
+    db.execute(text(f"DELETE FROM {default} WHERE ts >= :lo AND ts < :hi"), {"lo": lo, "hi": hi})
+    db.execute(text(f"ALTER TABLE events ATTACH PARTITION {default} DEFAULT"))
+
+
+def ensure_partitions(db: Session, now: Optional[datetime] = None, ahead: int = EVENTS_PARTITION_PREMAKE,
+                      interval: str = EVENTS_PARTITION_INTERVAL) -> List[str]:
+    """Cria a partição atual e as `ahead` seguintes que faltarem. Retorna os nomes criados."""
+    if not is_partitioned(db):
+        return []
+    existing = list_partitions(db)
+    covered = [(lo, hi) for _, lo, hi in existing if hi is not None]
+    default = next((name for name, lo, hi in existing if lo is None and hi is None), None)
+    step = partition_step(interval)
+    start = partition_start(now or datetime.now(timezone.utc), interval)
+    created = []
+    for i in range(ahead + 1):
+        lo, hi = start + i * step, start + (i + 1) * step
+        # partição de outro intervalo (ex.: troca de day para week) já cobrindo o trecho
+        if any((a is None or a < hi) and lo < b for a, b in covered):
+            continue
+        name = partition_name(lo, interval)
+        _create_partition(db, name, lo, hi, default)
+        covered.append((lo, hi))
+        created.append(name)
+    db.commit()
+    return created
+
+
+def drop_expired_partitions(db: Session, cutoff: datetime, dry_run: bool = False) -> List[str]:
+    """Desanexa e apaga as partições que terminam antes de `cutoff`."""
+    cutoff = _utc(cutoff)
+    dropped = []
+    for name, _, hi in list_partitions(db):
+        if hi is None or hi > cutoff:
+            continue
+        if not dry_run:
+            db.execute(text(f"ALTER TABLE events DETACH PARTITION {name}"))
+            db.execute(text(f"DROP TABLE {name}"))
+            db.commit()
+        dropped.append(name)
+    return dropped
+
+
+def delete_expired_events(db: Session, tenant_id: str, cutoff: datetime, chunk: int = EVENTS_RETENTION_DELETE_CHUNK) -> int:
+    # Blocos pequenos pelo índice (tenant_id, ts): transações curtas, sem travar a ingestão
+    if db.get_bind().dialect.name != "postgresql":
+        cutoff = _utc(cutoff).replace(tzinfo=None)
+    total = 0
+    while True:
+        ids = select(Event.id).where(Event.tenant_id == tenant_id, Event.ts < cutoff).limit(chunk)
+        n = db.execute(delete(Event).where(Event.id.in_(ids.scalar_subquery()))).rowcount or 0
+        db.commit()
+        total += n
+        if n < chunk:
+            return total
+
+
+def enforce_retention(db: Session, now: Optional[datetime] = None, dry_run: bool = False,
+                      tenant_ids: Optional[List[str]] = None) -> dict:
+    """Aplica a retenção de eventos de cada tenant conforme o plano.
+
+    Com partições, as que ficaram inteiras além da maior retenção são
+    descartadas; tenants de planos com retenção menor ainda têm as linhas
+    vencidas apagadas dentro das partições restantes. `tenant_ids` limita as
+    exclusões por linha a esses tenants (a maior retenção considera todos).
+    """
+    now = _utc(now or datetime.now(timezone.utc))
+    days = tenant_retention_days(db)
+    longest = max(days.values(), default=EVENTS_RETENTION_DEFAULT_DAYS)
+    stats = {"partitioned": is_partitioned(db), "dropped_partitions": [], "deleted_rows": 0, "deleted_payload_blocks": 0,
+             "deleted_archive_segments": 0,
+             "longest_days": longest}
+    if stats["partitioned"]:
+        stats["dropped_partitions"] = drop_expired_partitions(db, now - timedelta(days=longest), dry_run)
+    if dry_run:
+        return stats
+    for tid, d in days.items():
+        if tenant_ids is not None and tid not in tenant_ids:
+            continue
+        cutoff = now - timedelta(days=d)
+        stats["deleted_payload_blocks"] += prune_payload_blocks(db, tid, cutoff)
+        stats["deleted_archive_segments"] += prune_segments(tid, cutoff)
+        if stats["partitioned"] and d >= longest:
+            continue
+        stats["deleted_rows"] += delete_expired_events(db, tid, cutoff)
+    return stats
+
+
+def run_maintenance(db: Session, now: Optional[datetime] = None, dry_run: bool = False,
+                    tenant_ids: Optional[List[str]] = None) -> dict:
+    created = [] if dry_run else ensure_partitions(db, now)
+    return {"created_partitions": created, **enforce_retention(db, now, dry_run, tenant_ids)}
+
+
+def main(argv=None):
+    from .database import SessionLocal
+    ap = argparse.ArgumentParser(description="Partições e retenção da tabela events")
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args(argv)
+    with SessionLocal() as db:
+        print(json.dumps(run_maintenance(db, dry_run=args.dry_run), default=str, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,198 @@
+"""Armazenamento frio e comprimido do `raw` dos eventos.
+
+Com EVENT_PAYLOAD_STORE=compressed (padrão), os payloads de cada lote gravado
+por `bulk.insert_event_rows` vão para um único bloco comprimido em
+`event_payload_blocks` (zstd se o pacote `zstandard` estiver instalado, senão
+zlib) e o evento guarda só (payload_block_id, payload_idx); `events.raw_json`
+fica nulo. Só as regras que olham o payload (indicadores, `message`) e as
+investigações descomprimem blocos, via `attach_payloads` / `load_payloads`.
+Eventos antigos com `raw_json` preenchido continuam sendo lidos normalmente.
+"""
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from .models import Event, EventPayloadBlock
+from .ruleset import utc_naive
+
+try:
+    import zstandard
+except ImportError:  # opcional
+    zstandard = None
+
+
+EVENT_PAYLOAD_STORE = os.getenv("EVENT_PAYLOAD_STORE", "compressed")  # compressed|inline
+EVENT_PAYLOAD_CODEC = os.getenv("EVENT_PAYLOAD_CODEC", "auto")  # auto|zstd|zlib
+EVENT_PAYLOAD_CACHE_BLOCKS = int(os.getenv("EVENT_PAYLOAD_CACHE_BLOCKS", "256"))
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+LOAD_IN_CHUNK = 500
+
+
+def default_codec() -> str:
+    if EVENT_PAYLOAD_CODEC == "zlib" or zstandard is None:
+        return "zlib"
+    return "zstd"
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard not installed: cannot read zstd payload blocks")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def encode_block(payloads: List[object], codec: Optional[str] = None) -> tuple:
+    codec = codec or default_codec()
+    raw = json.dumps(payloads, separators=(",", ":"), default=str).encode("utf-8")
+    return codec, len(raw), compress(raw, codec)
+
+
+def decode_block(codec: str, data: bytes) -> list:
+    return json.loads(decompress(data, codec).decode("utf-8"))
+
+
+def store_payloads(db: Session, rows: List[dict], mode: Optional[str] = None) -> List[dict]:
+    """Grava os payloads do lote num bloco e retorna as linhas para `events`.
+
+    As linhas originais não são alteradas (a detecção incremental ainda usa o
+    `raw_json` em memória). Não faz commit.
+    """
+    if (mode or EVENT_PAYLOAD_STORE) != "compressed":
+        return rows
+    payloads = []
+    for r in rows:
+        if r.get("raw_json") is not None:
+            payloads.append(r["raw_json"])
+    if not payloads:
+        return rows
+    codec, raw_bytes, data = encode_block(payloads)
+    tss = [utc_naive(r["ts"]) for r in rows]
+    res = db.execute(insert(EventPayloadBlock.__table__).values(
+        tenant_id=rows[0]["tenant_id"], codec=codec, count=len(payloads), raw_bytes=raw_bytes,
+        stored_bytes=len(data), ts_min=min(tss), ts_max=max(tss), data=data,
+    ))
+    block_id = res.inserted_primary_key[0]
+    out = []
+    idx = 0
+    for r in rows:
+        if r.get("raw_json") is None:
+            out.append({**r, "payload_block_id": None, "payload_idx": None})
+            continue
+        out.append({**r, "raw_json": None, "payload_block_id": block_id, "payload_idx": idx})
+        idx += 1
+    return out
+
+
+class _BlockCache:
+    # Blocos já descomprimidos (LRU); investigações e replays costumam reler os mesmos
+    def __init__(self, maxsize: int = EVENT_PAYLOAD_CACHE_BLOCKS):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[int, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, block_id: int) -> Optional[list]:
+        with self._lock:
+            v = self._data.get(block_id)
+            if v is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(block_id)
+            self.hits += 1
+            return v
+
+    def put(self, block_id: int, payloads: list):
+        with self._lock:
+            self._data[block_id] = payloads
+            self._data.move_to_end(block_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+block_cache = _BlockCache()
+
+
+def _blocks(db: Session, block_ids: Iterable[int]) -> Dict[int, list]:
+    out = {}
+    missing = []
+    for bid in set(block_ids):
+        v = block_cache.get(bid)
+        if v is None:
+            missing.append(bid)
+        else:
+            out[bid] = v
+    for i in range(0, len(missing), LOAD_IN_CHUNK):
+        stmt = select(EventPayloadBlock.id, EventPayloadBlock.codec, EventPayloadBlock.data).where(
+            EventPayloadBlock.id.in_(missing[i:i + LOAD_IN_CHUNK]))
+        for bid, codec, data in db.execute(stmt):
+            payloads = decode_block(codec, data)
+            block_cache.put(bid, payloads)
+            out[bid] = payloads
+    return out
+
+
+def attach_payloads(db: Session, rows: Iterable) -> List[dict]:
+    """Preenche `raw_json` das linhas (dicts ou mappings com payload_block_id/payload_idx)."""
+    rows = [dict(r) for r in rows]
+    blocks = _blocks(db, (r["payload_block_id"] for r in rows if r.get("payload_block_id") is not None))
+    for r in rows:
+        bid = r.get("payload_block_id")
+        if bid is not None and r.get("raw_json") is None:
+            payloads = blocks.get(bid)
+            r["raw_json"] = payloads[r["payload_idx"]] if payloads is not None else None
+    return rows
+
+
+def load_payloads(db: Session, tenant_id: str, event_ids: List[int]) -> Dict[int, object]:
+    """raw de eventos específicos do tenant (investigação), carregado sob demanda."""
+    cols = (Event.id, Event.raw_json, Event.payload_block_id, Event.payload_idx)
+    rows = []
+    for i in range(0, len(event_ids), LOAD_IN_CHUNK):
+        stmt = select(*cols).where(Event.tenant_id == tenant_id, Event.id.in_(event_ids[i:i + LOAD_IN_CHUNK]))
+        rows.extend(db.execute(stmt).mappings())
+    return {r["id"]: r["raw_json"] for r in attach_payloads(db, rows)}
+
+
+def prune_payload_blocks(db: Session, tenant_id: str, cutoff: datetime) -> int:
+    # Blocos cujos eventos já saíram da retenção (ts_max < cutoff)
+    res = db.execute(delete(EventPayloadBlock).where(
+        EventPayloadBlock.tenant_id == tenant_id, EventPayloadBlock.ts_max < utc_naive(cutoff)))
+    db.commit()
+    return res.rowcount or 0
+
+
+def payload_stats(db: Session) -> dict:
+    rows = db.execute(select(
+        EventPayloadBlock.codec, func.count(), func.sum(EventPayloadBlock.count),
+        func.sum(EventPayloadBlock.raw_bytes), func.sum(EventPayloadBlock.stored_bytes),
+    ).group_by(EventPayloadBlock.codec))
+    codecs = {}
+    for codec, blocks, events, raw_bytes, stored in rows:
+        raw_bytes, stored = int(raw_bytes or 0), int(stored or 0)
+        codecs[codec] = {"blocks": blocks, "events": int(events or 0), "raw_bytes": raw_bytes,
+                         "stored_bytes": stored, "ratio": round(raw_bytes / stored, 2) if stored else None}
+    raw_total = sum(c["raw_bytes"] for c in codecs.values())
+    stored_total = sum(c["stored_bytes"] for c in codecs.values())
+    return {
+        "store": EVENT_PAYLOAD_STORE,
+        "codec": default_codec(),
+        "codecs": codecs,
+        "ratio": round(raw_total / stored_total, 2) if stored_total else None,
+        "cache": {"blocks": len(block_cache._data), "hits": block_cache.hits, "misses": block_cache.misses},
+    }
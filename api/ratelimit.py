@@ -1,29 +1,58 @@
 import os
 import time
-from typing import Dict, Tuple
+from typing import Dict, Iterable, Optional, Tuple
 from fastapi import HTTPException
 
 
 RATE = int(os.getenv("INGEST_RATE_LIMIT_PER_MIN", "600"))
 REDIS_URL = os.getenv("REDIS_URL")
 
+# Admission control do ingest: eventos pendentes (aceitos e ainda não processados)
+MAX_PENDING_PER_TENANT = int(os.getenv("INGEST_MAX_PENDING_PER_TENANT", "50000"))
+MAX_PENDING_GLOBAL = int(os.getenv("INGEST_MAX_PENDING_GLOBAL", "500000"))
+# Acima desta fração do limite, lotes só com eventos de baixa severidade são recusados primeiro
+SHED_RATIO = float(os.getenv("INGEST_SHED_RATIO", "0.8"))
+RETRY_AFTER_SEC = int(os.getenv("INGEST_RETRY_AFTER_SEC", "30"))
+# Contadores de pendência no Redis expiram sem novos lotes e são zerados quando a fila RQ esvazia
+PENDING_TTL_SEC = int(os.getenv("INGEST_PENDING_TTL_SEC", "900"))
+PENDING_RECONCILE_SEC = int(os.getenv("INGEST_PENDING_RECONCILE_SEC", "30"))
+LOW_SEVERITIES = {"low", "info", "informational", "debug"}
+
 # state: key -> (window_start_epoch, count)
 _STATE: Dict[str, Tuple[int, int]] = {}
 
+_PENDING_KEY = "pending:ingest"
+_last_reconcile = 0.0
+_redis = None
+
+
+def redis_client():
+    """Cliente Redis do processo (pool de conexões thread-safe), criado no primeiro uso."""
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(os.getenv("REDIS_URL") or REDIS_URL)
+    return _redis
+
+
+def _rate_exceeded(now: int):
+    raise HTTPException(status_code=429, detail="Rate limit exceeded", headers={"Retry-After": str(60 - now % 60)})
+
 
 def check_rate(key: str, quota: int | None = None):
     q = quota or RATE
     if REDIS_URL:
         try:
-            import redis
-            r = redis.Redis.from_url(REDIS_URL)
+            r = redis_client()
             bucket = f"rl:{key}:{int(time.time())//60}"
             val = r.incr(bucket)
             if val == 1:
                 r.expire(bucket, 70)
             if int(val) > q:
-                raise HTTPException(status_code=429, detail="Rate limit exceeded")
+                _rate_exceeded(int(time.time()))
             return
+        except HTTPException:
+            raise
         except Exception:
             pass
     # fallback in-memory
@@ -35,4 +64,76 @@ def check_rate(key: str, quota: int | None = None):
     cnt += 1
     _STATE[key] = (win, cnt)
     if cnt > q:
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+        _rate_exceeded(now)
+
+
+def is_low_severity_only(events: Iterable[dict]) -> bool:
+    seen = False
+    for e in events:
+        seen = True
+        if (e.get("severity") or "").lower() not in LOW_SEVERITIES:
+            return False
+    return seen
+
+
+def check_admission(tenant_id: str, pending_tenant: int, pending_global: int, incoming: int = 0, low_only: bool = False,
+                    max_tenant: Optional[int] = None, max_global: Optional[int] = None):
+    """Recusa o lote quando o trabalho pendente passa dos limites.
+
+    Limite do tenant -> 429; limite global -> 503; ambos com Retry-After. Entre
+    SHED_RATIO e o limite, só lotes com eventos de baixa severidade são recusados.
+    """
+    mt = max_tenant or MAX_PENDING_PER_TENANT
+    mg = max_global or MAX_PENDING_GLOBAL
+    headers = {"Retry-After": str(RETRY_AFTER_SEC)}
+    if pending_global + incoming > mg or (low_only and pending_global + incoming > mg * SHED_RATIO):
+        raise HTTPException(status_code=503, detail="Ingest backlog full, retry later", headers=headers)
+    if pending_tenant + incoming > mt or (low_only and pending_tenant + incoming > mt * SHED_RATIO):
+        raise HTTPException(status_code=429, detail="Tenant ingest backlog full, retry later", headers=headers)
+
+
+# Contadores de pendências para o caminho RQ (compartilhados entre processos via Redis)
+def add_pending(r, tenant_id: str, n: int):
+    # O TTL é renovado a cada lote: um contador órfão (worker caiu) some sozinho
+    key = f"{_PENDING_KEY}:{tenant_id}"
+    pipe = r.pipeline()
+    pipe.incrby(key, n)
+    pipe.expire(key, PENDING_TTL_SEC)
+    pipe.incrby(_PENDING_KEY, n)
+    pipe.expire(_PENDING_KEY, PENDING_TTL_SEC)
+    pipe.execute()
+
+
+def release_pending(r, tenant_id: str, n: int):
+    pipe = r.pipeline()
+    pipe.decrby(f"{_PENDING_KEY}:{tenant_id}", n)
+    pipe.decrby(_PENDING_KEY, n)
+    pipe.execute()
+
+
+def get_pending(r, tenant_id: str) -> Tuple[int, int]:
+    t, g = r.mget(f"{_PENDING_KEY}:{tenant_id}", _PENDING_KEY)
+    return max(0, int(t or 0)), max(0, int(g or 0))
+
+
+def reconcile_pending(r, queue_name: str = "ingest", now: Optional[float] = None) -> bool:
+    """Zera os contadores quando a fila RQ não tem jobs esperando nem em execução.
+
+    Se um worker cai entre add_pending e release_pending, o tenant ficaria com 429
+    até o TTL; com a fila vazia a pendência real é zero. Roda no máximo a cada
+    PENDING_RECONCILE_SEC por processo. Um lote enfileirado entre a checagem e o
+    reset fica sem contar (o release deixa o contador negativo até o próximo reset).
+    """
+    global _last_reconcile
+    now = time.monotonic() if now is None else now
+    if now - _last_reconcile < PENDING_RECONCILE_SEC:
+        return False
+    _last_reconcile = now
+    from rq import Queue
+    from rq.registry import StartedJobRegistry
+    from .workers import INFLIGHT_KEY
+    q = Queue(queue_name, connection=r)
+    if q.count or StartedJobRegistry(queue=q).count or r.scard(INFLIGHT_KEY):
+        return False
+    r.delete(_PENDING_KEY, *r.scan_iter(match=f"{_PENDING_KEY}:*", count=500))
+    return True
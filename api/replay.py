@@ -0,0 +1,314 @@
+"""Replay histórico das regras de detecção sobre eventos já gravados.
+
+Uso:
+  python -m api.replay --tenant t1 --since 2025-09-01 --until 2025-10-01            # dry-run
+  python -m api.replay --all --since 2025-09-01 --mode apply --workers 4
+  python -m api.replay --tenant t1 --since 2025-09-01 --rules novas_regras.yaml
+
+Contagem diferente da detecção ao vivo: o replay soma uma ocorrência por vez que
+o grupo cruza o limite da regra (ou por evento, em regras `per_event`). Ao vivo,
+cada lote de ingest que toca um grupo acima do limite soma uma ocorrência, então
+o `count` depende de como os agentes fatiaram os envios e os lotes originais não
+ficam gravados para reproduzir isso. Fingerprint, first_seen e last_seen batem;
+em regras sem `per_event`, o `count` do replay fica igual ou menor que o ao vivo.
+
+O apply soma ao `count` dos incidentes existentes; por isso recusa (ApplyConflict)
+quando algum incidente que ele tocaria já tem ocorrências no intervalo (detecção
+ao vivo ou apply anterior), salvo com `--force`.
+"""
+import argparse
+import logging
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import case, func, insert, select
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, engine
+from .models import Event, Incident, ReplayIncident, Tenant
+from .payloads import attach_payloads
+from .rollups import record_incidents
+from .rules import DETECTION_COLUMNS, incident_fingerprint
+from .ruleset import RuleSet, ruleset_for_tenant, utc_naive
+
+
+REPLAY_CHUNK = 5000
+MODES = ("dry-run", "apply")
+
+log = logging.getLogger("api.replay")
+
+
+class ApplyConflict(RuntimeError):
+    pass
+
+
+class EventTimeEvaluator:
+    """Avalia as regras com janelas pelo horário dos eventos (não pelo relógio).
+
+    Os eventos devem chegar em ordem de ts. Cada grupo (regra + chave) guarda os
+    timestamps da sua janela; uma ocorrência é registrada quando o grupo atinge o
+    limite (ou a cada evento, em regras `per_event`). Eventos antes de `start`
+    só aquecem as janelas.
+    """
+
+    def __init__(self, ruleset: RuleSet, start: datetime):
+        self.ruleset = ruleset
+        self.start = utc_naive(start)
+        self._windows: Dict[tuple, deque] = {}
+        self._spans = [timedelta(minutes=r.window_minutes) for r in ruleset.rules]
+        self.findings: Dict[str, dict] = {}
+
+    def feed(self, ev: dict):
+        ts = utc_naive(ev["ts"])
+        for group in self.ruleset.match(ev):
+            idx, key = group
+            rule = self.ruleset.rules[idx]
+            dq = self._windows.get(group)
+            if dq is None:
+                dq = self._windows[group] = deque()
+            cutoff = ts - self._spans[idx]
+            while dq and dq[0] < cutoff:
+                dq.popleft()
+            before = len(dq)
+            dq.append(ts)
+            if ts < self.start or before + 1 < rule.threshold:
+                continue
+            fp = incident_fingerprint(rule.kind, *key)
+            f = self.findings.get(fp)
+            # grupo que já estava acima do limite no aquecimento conta uma vez ao entrar no intervalo
+            emit = rule.per_event or before + 1 == rule.threshold or f is None
+            if f is None:
+                f = self.findings[fp] = {
+                    "fingerprint": fp, "kind": rule.kind, "severity": rule.severity,
+                    "first_seen": ts, "last_seen": ts, "count": 0, "context_json": None,
+                }
+            f["last_seen"] = ts
+            f["context_json"] = rule.context(key, before + 1)
+            if emit:
+                f["count"] += 1
+
+    def compact(self, now: datetime):
+        # descarta grupos cuja janela já esvaziou (memória proporcional aos grupos ativos)
+        now = utc_naive(now)
+        for group in [g for g, dq in self._windows.items() if not dq or dq[-1] < now - self._spans[g[0]]]:
+            del self._windows[group]
+
+
+def stream_events(db: Session, tenant_id: str, since: datetime, until: Optional[datetime], chunk: int = REPLAY_CHUNK):
+    """Eventos do tenant em ordem de ts, em blocos, com cursor no servidor."""
+    stmt = select(*DETECTION_COLUMNS).where(Event.tenant_id == tenant_id, Event.ts >= since)
+    if until is not None:
+        stmt = stmt.where(Event.ts < until)
+    stmt = stmt.order_by(Event.ts, Event.id).execution_options(stream_results=True, yield_per=chunk)
+    result = db.execute(stmt).mappings()
+    for part in result.partitions(chunk):
+        yield part
+
+
+def _write_dry_run(db: Session, run_id: str, tenant_id: str, findings: List[dict]):
+    if findings:
+        db.execute(insert(ReplayIncident.__table__), [{"run_id": run_id, "tenant_id": tenant_id, **f} for f in findings])
+
+
+def _applied_in_range(db: Session, tenant_id: str, fingerprints: List[str], since: datetime, until: Optional[datetime]) -> int:
+    # incidentes que o apply tocaria e que já têm ocorrências em [since, until)
+    if db.get_bind().dialect.name == "postgresql":
+        since = since.replace(tzinfo=timezone.utc)
+        until = until.replace(tzinfo=timezone.utc) if until else None
+    n = 0
+    for i in range(0, len(fingerprints), 500):
+        stmt = select(func.count()).select_from(Incident).where(
+            Incident.tenant_id == tenant_id, Incident.fingerprint.in_(fingerprints[i:i + 500]), Incident.last_seen >= since)
+        if until is not None:
+            stmt = stmt.where(Incident.first_seen < until)
+        n += db.execute(stmt).scalar() or 0
+    return n
+
+
+def _apply(db: Session, tenant_id: str, findings: List[dict]):
+    # Mesmo upsert por fingerprint da detecção ao vivo, com first/last_seen do horário dos eventos
+    rows = [{"tenant_id": tenant_id, "status": "open", **f} for f in findings]
+    if not rows:
+        return
+    record_incidents(db, tenant_id, ((f["last_seen"], f["severity"], f["kind"], f["count"]) for f in findings))
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        t = Incident.__table__
+        stmt = dialect_insert(t).values(rows)
+        ex = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["tenant_id", "fingerprint"],
+            set_={
+                "count": t.c.count + ex.count,
+                "first_seen": case((ex.first_seen < t.c.first_seen, ex.first_seen), else_=t.c.first_seen),
+                "last_seen": case((ex.last_seen > t.c.last_seen, ex.last_seen), else_=t.c.last_seen),
+                "severity": ex.severity,
+                "context_json": ex.context_json,
+            },
+        )
+        db.execute(stmt)
+        return
+    for row in rows:
+        inc = db.execute(
+            select(Incident).where(Incident.tenant_id == tenant_id, Incident.fingerprint == row["fingerprint"])
+        ).scalars().first()
+        if inc:
+            inc.count = (inc.count or 0) + row["count"]
+            inc.first_seen = min(utc_naive(inc.first_seen), row["first_seen"])
+            inc.last_seen = max(utc_naive(inc.last_seen), row["last_seen"])
+            inc.severity = row["severity"]
+            inc.context_json = row["context_json"]
+        else:
+            db.add(Incident(**row))
+
+
+def replay_tenant(db: Session, tenant_id: str, since: datetime, until: Optional[datetime] = None, mode: str = "dry-run",
+                  run_id: Optional[str] = None, rules_file: Optional[str] = None, chunk: int = REPLAY_CHUNK,
+                  progress: Optional[Callable[[dict], None]] = None, force: bool = False) -> dict:
+    """Reavalia as regras do tenant sobre [since, until) e grava o resultado.
+
+    mode="dry-run" grava em `replay_incidents` (com `run_id`); mode="apply"
+    faz upsert em `incidents` (ver no topo do módulo como o `count` difere da
+    detecção ao vivo) e levanta ApplyConflict se o intervalo já foi contado,
+    a menos que `force`. Retorna estatísticas da execução.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}")
+    run_id = run_id or uuid.uuid4().hex[:12]
+    since = utc_naive(since)
+    until = utc_naive(until) if until else None
+    ruleset = ruleset_for_tenant(db, tenant_id, rules_file)
+    evaluator = EventTimeEvaluator(ruleset, since)
+    warmup = since - timedelta(minutes=ruleset.window_minutes)
+    stats = {"tenant_id": tenant_id, "run_id": run_id, "mode": mode, "events": 0, "chunks": 0}
+    t0 = time.perf_counter()
+    for part in stream_events(db, tenant_id, warmup, until, chunk):
+        if ruleset.needs_raw:
+            part = attach_payloads(db, part)
+        for ev in part:
+            evaluator.feed(ev)
+        stats["events"] += len(part)
+        stats["chunks"] += 1
+        evaluator.compact(part[-1]["ts"])
+        if progress:
+            elapsed = time.perf_counter() - t0
+            progress({**stats, "elapsed_sec": round(elapsed, 2), "events_per_sec": round(stats["events"] / elapsed, 1) if elapsed else 0.0})
+    findings = list(evaluator.findings.values())
+    if mode == "apply":
+        overlap = 0 if force else _applied_in_range(db, tenant_id, [f["fingerprint"] for f in findings], since, until)
+        if overlap:
+            raise ApplyConflict(f"{overlap} incidents already have occurrences in the replayed range; "
+                                "apply would count them twice (use --force to add anyway)")
+        _apply(db, tenant_id, findings)
+    else:
+        _write_dry_run(db, run_id, tenant_id, findings)
+    db.commit()
+    elapsed = time.perf_counter() - t0
+    stats.update(
+        incidents=len(findings),
+        occurrences=sum(f["count"] for f in findings),
+        elapsed_sec=round(elapsed, 2),
+        events_per_sec=round(stats["events"] / elapsed, 1) if elapsed else 0.0,
+    )
+    return stats
+
+
+def _log_progress(s: dict):
+    log.info("%s: %d eventos (%d blocos), %.0f eventos/s", s["tenant_id"], s["events"], s["chunks"], s["events_per_sec"])
+
+
+def _worker_init():
+    # conexões herdadas do processo pai não podem ser reutilizadas no filho
+    engine.dispose(close=False)
+
+
+def _replay_job(tenant_id: str, kwargs: dict) -> dict:
+    with SessionLocal() as db:
+        return replay_tenant(db, tenant_id, progress=_log_progress, **kwargs)
+
+
+def replay_tenants(tenant_ids: List[str], since: datetime, until: Optional[datetime] = None, mode: str = "dry-run",
+                   workers: int = 1, run_id: Optional[str] = None, rules_file: Optional[str] = None,
+                   chunk: int = REPLAY_CHUNK, on_done: Optional[Callable[[dict], None]] = None, force: bool = False) -> List[dict]:
+    """Replay de vários tenants; com workers > 1, um processo por tenant em paralelo."""
+    kwargs = {"since": since, "until": until, "mode": mode, "run_id": run_id or uuid.uuid4().hex[:12],
+              "rules_file": rules_file, "chunk": chunk, "force": force}
+    results = []
+    if workers <= 1 or len(tenant_ids) <= 1:
+        for tid in tenant_ids:
+            try:
+                res = _replay_job(tid, kwargs)
+            except ApplyConflict as e:
+                res = {"tenant_id": tid, "error": str(e)}
+            results.append(res)
+            if on_done:
+                on_done(res)
+        return results
+    with ProcessPoolExecutor(max_workers=workers, initializer=_worker_init) as pool:
+        futures = {pool.submit(_replay_job, tid, kwargs): tid for tid in tenant_ids}
+        for fut in as_completed(futures):
+            try:
+                res = fut.result()
+            except Exception as e:
+                res = {"tenant_id": futures[fut], "error": str(e)}
+            results.append(res)
+            if on_done:
+                on_done(res)
+    return results
+
+
+def _parse_dt(value: str) -> datetime:
+    return utc_naive(datetime.fromisoformat(value.replace("Z", "+00:00")))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Replay das regras de detecção sobre eventos históricos")
+    ap.add_argument("--tenant", action="append", default=[], help="tenant_id (pode repetir)")
+    ap.add_argument("--all", action="store_true", help="todos os tenants ativos")
+    ap.add_argument("--since", required=True, type=_parse_dt)
+    ap.add_argument("--until", type=_parse_dt)
+    ap.add_argument("--mode", choices=MODES, default="dry-run",
+                    help="dry-run grava em replay_incidents; apply faz upsert em incidents somando ao count existente "
+                         "e recusa intervalos já contados (ao vivo ou apply anterior) sem --force. "
+                         "Em regras sem per_event o replay conta um por cruzamento do limite, não um por lote "
+                         "como a detecção ao vivo (count menor ou igual)")
+    ap.add_argument("--force", action="store_true", help="apply mesmo com incidentes já contados no intervalo")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--chunk", type=int, default=REPLAY_CHUNK)
+    ap.add_argument("--rules", help="arquivo de regras alternativo (YAML/JSON)")
+    ap.add_argument("--run-id")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    tenant_ids = list(args.tenant)
+    if args.all:
+        with SessionLocal() as db:
+            tenant_ids += [t for (t,) in db.execute(select(Tenant.id).where(Tenant.status == "active")) if t not in tenant_ids]
+    if not tenant_ids:
+        ap.error("use --tenant or --all")
+    t0 = time.perf_counter()
+
+    def done(res: dict):
+        if "error" in res:
+            log.error("%s: falhou: %s", res["tenant_id"], res["error"])
+        else:
+            log.info("%s: %d eventos, %d incidentes (%d ocorrências) em %.1fs, %.0f eventos/s [run %s]",
+                     res["tenant_id"], res["events"], res["incidents"], res["occurrences"], res["elapsed_sec"], res["events_per_sec"], res["run_id"])
+
+    results = replay_tenants(tenant_ids, args.since, args.until, args.mode, args.workers, args.run_id, args.rules, args.chunk,
+                             on_done=done, force=args.force)
+    elapsed = time.perf_counter() - t0
+    total = sum(r.get("events", 0) for r in results)
+    log.info("total: %d tenants, %d eventos em %.1fs (%.0f eventos/s)", len(results), total, elapsed, total / elapsed if elapsed else 0.0)
+    return 1 if any("error" in r for r in results) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,71 +1,527 @@
+import calendar
 import os
+import threading
 import time
-from typing import Optional
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+from .database import SessionLocal
+from .feeds import feeds
 from .models import IPReputation
 
 
-def get_ip_reputation(db: Session, ip: str) -> Optional[int]:
-    if not ip:
+REPUTATION_WORKERS = int(os.getenv("REPUTATION_WORKERS", "16"))
+REPUTATION_TIMEOUT_SEC = float(os.getenv("REPUTATION_TIMEOUT_SEC", "5"))
+REP_TTL_SEC = int(os.getenv("IP_REP_TTL_SEC", "86400"))
+# Falhas/sem resposta ("none") expiram antes para serem tentadas de novo
+REP_NEGATIVE_TTL_SEC = int(os.getenv("IP_REP_NEGATIVE_TTL_SEC", "300"))
+# Depois de expirar, o valor antigo ainda é servido por até REP_STALE_SEC enquanto é renovado em background
+REP_STALE_SEC = int(os.getenv("IP_REP_STALE_SEC", "3600"))
+REP_CACHE_SIZE = int(os.getenv("IP_REP_CACHE_SIZE", "50000"))
+REP_IN_CHUNK = 500  # IPs por SELECT ... IN / INSERT em lote
+NEGATIVE_SOURCE = "none"
+
+# (score, source)
+Lookup = Tuple[int, str]
+
+
+# Endpoints configuráveis (ex.: proxy interno ou servidor falso em testes)
+ABUSEIPDB_URL = os.getenv("ABUSEIPDB_URL", "https://api.abuseipdb.com/api/v2/check")
+IPINFO_URL = os.getenv("IPINFO_URL", "https://ipinfo.io")
+SHODAN_URL = os.getenv("SHODAN_URL", "https://api.shodan.io/shodan/host")
+
+# Circuit breaker por provedor: abre após N falhas seguidas (erro, 429/5xx ou
+# latência acima do SLO), fica aberto OPEN_SEC e então deixa passar uma sondagem.
+REP_BREAKER_FAILURES = int(os.getenv("REP_BREAKER_FAILURES", "5"))
+REP_BREAKER_SLO_MS = float(os.getenv("REP_BREAKER_SLO_MS", "2000"))
+REP_BREAKER_OPEN_SEC = float(os.getenv("REP_BREAKER_OPEN_SEC", "60"))
+
+
+class ProviderError(Exception):
+    pass
+
+
+def _check(r: requests.Response):
+    # Limite de taxa e erro do provedor contam como falha; 4xx comuns só significam "sem dado"
+    if r.status_code == 429 or r.status_code >= 500:
+        raise ProviderError(f"HTTP {r.status_code}")
+
+
+def _abuseipdb(session: requests.Session, ip: str, key: str) -> Optional[int]:
+    r = session.get(ABUSEIPDB_URL, params={"ipAddress": ip, "maxAgeInDays": 60}, headers={"Key": key, "Accept": "application/json"}, timeout=REPUTATION_TIMEOUT_SEC)
+    _check(r)
+    if r.ok:
+        data = r.json().get("data", {})
+        return int(data.get("abuseConfidenceScore", 0))
+    return None
+
+
+def _ipinfo(session: requests.Session, ip: str, key: str) -> Optional[int]:
+    r = session.get(f"{IPINFO_URL}/{ip}", params={"token": key}, timeout=REPUTATION_TIMEOUT_SEC)
+    _check(r)
+    if r.ok:
+        data = r.json()
+        # crude heuristic: treat hosting/bogon as higher risk
+        return 80 if data.get("bogon") else 20
+    return None
+
+
+def _shodan(session: requests.Session, ip: str, key: str) -> Optional[int]:
+    r = session.get(f"{SHODAN_URL}/{ip}", params={"key": key}, timeout=REPUTATION_TIMEOUT_SEC)
+    _check(r)
+    if r.status_code == 200:
+        data = r.json()
+        # if many open ports or tags, increase risk
+        ports = data.get("ports", [])
+        return min(100, 10 + len(ports) * 5)
+    return None
+
+
+# Provedores na ordem de consulta: (nome, variável com a chave, função)
+PROVIDERS = [
+    ("abuseipdb", "ABUSEIPDB_KEY", _abuseipdb),
+    ("ipinfo", "IPINFO_KEY", _ipinfo),
+    ("shodan", "SHODAN_KEY", _shodan),
+]
+
+
+class CircuitBreaker:
+    """closed -> open (após `failures` falhas seguidas) -> half_open (uma sondagem) -> closed."""
+
+    def __init__(self, failures: int = REP_BREAKER_FAILURES, slo_ms: float = REP_BREAKER_SLO_MS, open_sec: float = REP_BREAKER_OPEN_SEC):
+        self.max_failures = max(1, failures)
+        self.slo_ms = slo_ms
+        self.open_sec = open_sec
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.open_sec:
+                    return False
+                self.state = "half_open"
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, ok: bool, latency_ms: float):
+        ok = ok and latency_ms <= self.slo_ms
+        with self._lock:
+            self._probing = False
+            if ok:
+                self.state = "closed"
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.max_failures:
+                if self.state != "open":
+                    self.opens += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures, "opens": self.opens}
+
+
+class CallBudget:
+    """Limite de chamadas por minuto (janela fixa); 0 = sem limite."""
+
+    def __init__(self, per_minute: int = 0, clock=time.time):
+        self.per_minute = per_minute
+        self._clock = clock
+        self._minute = 0
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        if self.per_minute <= 0:
+            return True
+        minute = int(self._clock() // 60)
+        with self._lock:
+            if minute != self._minute:
+                self._minute, self.used = minute, 0
+            if self.used >= self.per_minute:
+                return False
+            self.used += 1
+            return True
+
+    def refund(self):
+        if self.per_minute <= 0:
+            return
+        with self._lock:
+            self.used = max(0, self.used - 1)
+
+    def snapshot(self) -> dict:
+        minute = int(self._clock() // 60)
+        with self._lock:
+            used = self.used if minute == self._minute else 0
+        return {"budget_per_min": self.per_minute, "used_this_minute": used}
+
+
+class Provider:
+    def __init__(self, name: str, env_key: Optional[str], fn, budget_per_min: Optional[int] = None, breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.env_key = env_key
+        self.fn = fn
+        if budget_per_min is None:
+            budget_per_min = int(os.getenv(f"{name.upper()}_BUDGET_PER_MIN", "0") or 0)
+        self.budget = CallBudget(budget_per_min)
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "failures": 0, "skipped_open": 0, "skipped_budget": 0, "latency_ms_total": 0.0}
+
+    def _count(self, name: str, value: float = 1):
+        with self._lock:
+            self._stats[name] += value
+
+    def call(self, session: requests.Session, ip: str, key: str) -> Optional[int]:
+        """Chama o provedor se o breaker e o orçamento permitirem; senão levanta ProviderError na hora."""
+        if not self.budget.take():
+            self._count("skipped_budget")
+            raise ProviderError("budget exhausted")
+        if not self.breaker.allow():
+            self.budget.refund()
+            self._count("skipped_open")
+            raise ProviderError("circuit open")
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            result = self.fn(session, ip, key)
+            ok = True
+            return result
+        finally:
+            latency = (time.perf_counter() - t0) * 1000
+            self.breaker.record(ok, latency)
+            self._count("calls")
+            self._count("latency_ms_total", latency)
+            if not ok:
+                self._count("failures")
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        s["avg_latency_ms"] = round(s.pop("latency_ms_total") / s["calls"], 2) if s["calls"] else 0.0
+        return {**s, **self.breaker.snapshot(), **self.budget.snapshot()}
+
+
+class ReputationResolver:
+    """Consulta provedores de reputação em paralelo (pool de threads limitado).
+
+    Consultas simultâneas ao mesmo IP são colapsadas numa única requisição em
+    andamento (singleflight). Cada provedor tem sua própria `requests.Session`,
+    com pool de conexões do tamanho do pool de threads.
+    """
+
+    def __init__(self, workers: int = REPUTATION_WORKERS, providers=None):
+        self.workers = max(1, workers)
+        self.providers = [p if isinstance(p, Provider) else Provider(*p) for p in (providers if providers is not None else PROVIDERS)]
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._sessions: Dict[str, requests.Session] = {}
+        self._stats = {"lookups": 0, "collapsed": 0, "errors": 0}
+
+    def _session(self, name: str) -> requests.Session:
+        with self._lock:
+            s = self._sessions.get(name)
+            if s is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                self._sessions[name] = s
+            return s
+
+    def lookup(self, ip: str) -> Lookup:
+        # Provedores em ordem; o primeiro que responder define o score
+        # Provedor com breaker aberto ou sem orçamento é pulado na hora
+        for p in self.providers:
+            key = os.getenv(p.env_key) if p.env_key else ""
+            if p.env_key and not key:
+                continue
+            try:
+                score = p.call(self._session(p.name), ip, key)
+            except Exception:
+                with self._lock:
+                    self._stats["errors"] += 1
+                continue
+            if score is not None:
+                return score, p.name
+        return 0, NEGATIVE_SOURCE
+
+    def submit(self, ip: str) -> Future:
+        with self._lock:
+            fut = self._inflight.get(ip)
+            if fut is not None:
+                self._stats["collapsed"] += 1
+                return fut
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reputation")
+            self._stats["lookups"] += 1
+            fut = self._executor.submit(self.lookup, ip)
+            self._inflight[ip] = fut
+        fut.add_done_callback(lambda f, ip=ip: self._done(ip, f))
+        return fut
+
+    def _done(self, ip: str, fut: Future):
+        with self._lock:
+            if self._inflight.get(ip) is fut:
+                del self._inflight[ip]
+
+    def resolve_many(self, ips: Iterable[str], timeout: Optional[float] = None) -> Dict[str, Lookup]:
+        """Resolve um conjunto de IPs em paralelo; IPs sem resposta no prazo ficam de fora."""
+        futures = {ip: self.submit(ip) for ip in set(ips) if ip}
+        if not futures:
+            return {}
+        wait(list(futures.values()), timeout=timeout)
+        out = {}
+        for ip, fut in futures.items():
+            if fut.done() and not fut.exception():
+                out[ip] = fut.result()
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = {**self._stats, "inflight": len(self._inflight), "workers": self.workers}
+        s["providers"] = {p.name: p.stats() for p in self.providers}
+        return s
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            sessions, self._sessions = self._sessions, {}
+        if executor is not None:
+            executor.shutdown(wait=False)
+        for s in sessions.values():
+            s.close()
+
+
+resolver = ReputationResolver()
+
+
+def _ttl(source: Optional[str]) -> int:
+    return REP_NEGATIVE_TTL_SEC if source in (None, NEGATIVE_SOURCE) else REP_TTL_SEC
+
+
+class ReputationCache:
+    """Camada TTL + LRU em memória na frente de `ip_reputation_cache`.
+
+    Respostas reais valem `ttl`; falhas (source "none") valem `negative_ttl`.
+    Entradas vencidas há menos de `stale` segundos ainda são servidas (estado
+    "stale") para o chamador disparar a renovação em background.
+    """
+
+    def __init__(self, capacity: int = REP_CACHE_SIZE, ttl: int = REP_TTL_SEC, negative_ttl: int = REP_NEGATIVE_TTL_SEC, stale: int = REP_STALE_SEC):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale = stale
+        self._items: "OrderedDict[str, Tuple[int, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "stale_hits": 0, "negative_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def get(self, ip: str, now: Optional[float] = None) -> Tuple[Optional[Lookup], Optional[str]]:
+        """Retorna ((score, source), "fresh" | "stale") ou (None, None)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            item = self._items.get(ip)
+            if item is None:
+                self._stats["misses"] += 1
+                return None, None
+            score, source, expires = item
+            if now < expires:
+                self._items.move_to_end(ip)
+                self._stats["negative_hits" if source == NEGATIVE_SOURCE else "hits"] += 1
+                return (score, source), "fresh"
+            if now < expires + self.stale and source != NEGATIVE_SOURCE:
+                self._items.move_to_end(ip)
+                self._stats["stale_hits"] += 1
+                return (score, source), "stale"
+            del self._items[ip]
+            self._stats["expired"] += 1
+            self._stats["misses"] += 1
+            return None, None
+
+    def put(self, ip: str, score: int, source: str, updated_at: Optional[float] = None):
+        ttl = self.negative_ttl if source in (None, NEGATIVE_SOURCE) else self.ttl
+        expires = (time.time() if updated_at is None else updated_at) + ttl
+        with self._lock:
+            self._items[ip] = (score, source, expires)
+            self._items.move_to_end(ip)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s.update(size=len(self._items), capacity=self.capacity, ttl=self.ttl, negative_ttl=self.negative_ttl, stale=self.stale)
+        lookups = s["hits"] + s["stale_hits"] + s["negative_hits"] + s["misses"]
+        s["hit_ratio"] = round((lookups - s["misses"]) / lookups, 3) if lookups else 0.0
+        return s
+
+
+cache = ReputationCache()
+
+
+def _updated_ts(rep: IPReputation) -> Optional[float]:
+    # updated_at vem do banco (UTC); sem fuso, trata como UTC
+    if not rep or not rep.updated_at:
         return None
-    ttl = int(os.getenv("IP_REP_TTL_SEC", "86400"))
-    now = int(time.time())
-    rep = db.get(IPReputation, ip)
-    if rep and rep.updated_at and (now - int(rep.updated_at.timestamp())) < ttl:
-        return rep.score
-    score = None
-    source = None
-    # Try providers in order depending on keys
-    try:
-        key = os.getenv("ABUSEIPDB_KEY")
-        if key:
-            r = requests.get("https://api.abuseipdb.com/api/v2/check", params={"ipAddress": ip, "maxAgeInDays": 60}, headers={"Key": key, "Accept": "application/json"}, timeout=5)
-            if r.ok:
-                data = r.json().get("data", {})
-                score = int(data.get("abuseConfidenceScore", 0))
-                source = "abuseipdb"
-    except Exception:
-        pass
-    try:
-        if score is None:
-            key = os.getenv("IPINFO_KEY")
-            if key:
-                r = requests.get(f"https://ipinfo.io/{ip}", params={"token": key}, timeout=5)
-                if r.ok:
-                    data = r.json()
-                    # crude heuristic: treat hosting/bogon as higher risk
-                    if data.get("bogon"):
-                        score = 80
-                    else:
-                        score = 20
-                    source = "ipinfo"
-    except Exception:
-        pass
+    dt = rep.updated_at
+    if dt.tzinfo is not None:
+        return dt.timestamp()
+    return float(calendar.timegm(dt.timetuple()))
+
+
+def get_cached_many(db: Session, ips: Iterable[str]) -> Dict[str, IPReputation]:
+    """Linhas de `ip_reputation_cache` para vários IPs com um SELECT ... WHERE ip IN (...)."""
+    ips = sorted({i for i in ips if i})
+    out: Dict[str, IPReputation] = {}
+    for i in range(0, len(ips), REP_IN_CHUNK):
+        for rep in db.execute(select(IPReputation).where(IPReputation.ip.in_(ips[i:i + REP_IN_CHUNK]))).scalars():
+            out[rep.ip] = rep
+    return out
+
+
+def upsert_many(db: Session, results: Dict[str, Lookup], meta: Optional[Dict[str, dict]] = None) -> int:
+    """Grava vários scores num único INSERT ... ON CONFLICT (ip) DO UPDATE e faz commit."""
+    if not results:
+        return 0
+    meta = meta or {}
+    rows = [
+        {"ip": ip, "score": score, "source": source, "asn": (meta.get(ip) or {}).get("asn"), "country": (meta.get(ip) or {}).get("country")}
+        for ip, (score, source) in results.items()
+    ]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        t = IPReputation.__table__
+        for i in range(0, len(rows), REP_IN_CHUNK):
+            stmt = dialect_insert(t).values(rows[i:i + REP_IN_CHUNK])
+            ex = stmt.excluded
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["ip"],
+                set_={
+                    "score": ex.score,
+                    "source": ex.source,
+                    "asn": func.coalesce(ex.asn, t.c.asn),
+                    "country": func.coalesce(ex.country, t.c.country),
+                    "updated_at": func.now(),
+                },
+            )
+            db.execute(stmt)
+    else:
+        existing = get_cached_many(db, results.keys())
+        for row in rows:
+            rep = existing.get(row["ip"])
+            if rep:
+                rep.score, rep.source, rep.updated_at = row["score"], row["source"], func.now()
+                rep.asn = row["asn"] or rep.asn
+                rep.country = row["country"] or rep.country
+            else:
+                db.add(IPReputation(**row))
+    db.commit()
+    return len(rows)
+
+
+def _revalidated(fut: Future, ip: str):
+    # Renovação em background (stale-while-revalidate): atualiza memória e banco
+    if fut.cancelled() or fut.exception():
+        return
+    score, source = fut.result()
+    cache.put(ip, score, source)
     try:
-        if score is None:
-            key = os.getenv("SHODAN_KEY")
-            if key:
-                r = requests.get("https://api.shodan.io/shodan/host/" + ip, params={"key": key}, timeout=5)
-                if r.status_code == 200:
-                    data = r.json()
-                    # if many open ports or tags, increase risk
-                    ports = data.get("ports", [])
-                    score = min(100, 10 + len(ports) * 5)
-                    source = "shodan"
+        with SessionLocal() as db:
+            upsert_many(db, {ip: (score, source)})
     except Exception:
         pass
-    # default if none worked
-    if score is None:
-        score = 0
-        source = "none"
-    # upsert cache
-    if rep:
-        rep.score = score
-        rep.source = source
-    else:
-        rep = IPReputation(ip=ip, score=score, source=source)
-        db.add(rep)
-    db.commit()
-    return score
 
+
+def _revalidate(ip: str):
+    fut = resolver.submit(ip)
+    fut.add_done_callback(lambda f, ip=ip: _revalidated(f, ip))
+
+
+def resolve_many(db: Session, ips: Iterable[str], timeout: Optional[float] = None) -> Dict[str, int]:
+    """Score de reputação de vários IPs.
+
+    Ordem: feeds locais (blocklists) -> memória (TTL + LRU) -> `ip_reputation_cache`
+    -> provedores em paralelo. Valores vencidos há pouco são devolvidos na hora e
+    renovados em background. ASN/país dos feeds acompanham o que for gravado.
+    """
+    now = time.time()
+    scores: Dict[str, int] = {}
+    meta: Dict[str, dict] = {}
+    to_db = []
+    for ip in {i for i in ips if i}:
+        if feeds.enabled:
+            found = feeds.lookup(ip)
+            if "blocklist" in found:
+                scores[ip] = found["blocklist"][1]
+                continue
+            if found:
+                meta[ip] = found
+        hit, state = cache.get(ip, now)
+        if hit is not None:
+            scores[ip] = hit[0]
+            if state == "stale":
+                _revalidate(ip)
+            continue
+        to_db.append(ip)
+    if not to_db:
+        return scores
+    # uma ida ao banco para todos os IPs que não estavam em memória
+    cached = get_cached_many(db, to_db)
+    missing = []
+    for ip in to_db:
+        rep = cached.get(ip)
+        updated = _updated_ts(rep)
+        if updated is not None:
+            age = now - updated
+            ttl = _ttl(rep.source)
+            if age < ttl:
+                cache.put(ip, rep.score, rep.source, updated)
+                scores[ip] = rep.score
+                continue
+            if age < ttl + REP_STALE_SEC and rep.source != NEGATIVE_SOURCE:
+                scores[ip] = rep.score
+                _revalidate(ip)
+                continue
+        missing.append(ip)
+    if not missing:
+        return scores
+    results = resolver.resolve_many(missing, timeout=timeout)
+    for ip, (score, source) in results.items():
+        cache.put(ip, score, source)
+        scores[ip] = score
+    upsert_many(db, results, meta)
+    return scores
+
+
+def get_ip_reputation(db: Session, ip: str) -> Optional[int]:
+    if not ip:
+        return None
+    return resolve_many(db, [ip]).get(ip)
@@ -0,0 +1,115 @@
+"""Agregados por hora de eventos e incidentes.
+
+`event_rollups` e `incident_rollups` são incrementados na mesma transação da
+ingestão (bulk.insert_event_rows) e da detecção (rules.upsert_incidents /
+replay). Score, relatórios e /v1/stats leem daqui: uma janela de 7 ou 30 dias
+custa no máximo 24 linhas por dia e por (severidade, tipo), não uma linha por
+evento ou incidente.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .models import EventRollup, IncidentRollup
+from .ruleset import utc_naive
+
+
+SEV_WEIGHT = {"low": 1, "medium": 3, "high": 7, "critical": 12}
+STATS_MAX_DAYS = 90
+
+
+def hour_bucket(ts: datetime) -> datetime:
+    return utc_naive(ts).replace(minute=0, second=0, microsecond=0)
+
+
+def _upsert_counts(db: Session, model, keys: Tuple[str, ...], counts: Counter):
+    rows = [{**dict(zip(keys, k)), "count": n} for k, n in counts.items()]
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        t = model.__table__
+        stmt = dialect_insert(t).values(rows)
+        stmt = stmt.on_conflict_do_update(index_elements=list(keys), set_={"count": t.c.count + stmt.excluded.count})
+        db.execute(stmt)
+        return
+    for row in rows:
+        obj = db.get(model, tuple(row[k] for k in keys))
+        if obj:
+            obj.count = (obj.count or 0) + row["count"]
+        else:
+            db.add(model(**row))
+
+
+def record_events(db: Session, rows: Iterable[dict], sign: int = 1):
+    """Soma as linhas de eventos recém-inseridas em `event_rollups` (sign=-1 desconta). Não faz commit."""
+    counts = Counter()
+    for r in rows:
+        counts[(r["tenant_id"], hour_bucket(r["ts"]), r.get("severity") or "", r.get("event_type") or "")] += sign
+    _upsert_counts(db, EventRollup, ("tenant_id", "hour", "severity", "event_type"), counts)
+
+
+def record_incidents(db: Session, tenant_id: str, items: Iterable[Tuple[datetime, str, str, int]]):
+    """Soma ocorrências (ts, severity, kind, count) em `incident_rollups`. Não faz commit."""
+    counts = Counter()
+    for ts, severity, kind, n in items:
+        counts[(tenant_id, hour_bucket(ts), severity, kind)] += n
+    _upsert_counts(db, IncidentRollup, ("tenant_id", "hour", "severity", "kind"), counts)
+
+
+def incident_totals_stmt(tenant_id: str, since: datetime, until: Optional[datetime] = None):
+    stmt = select(IncidentRollup.severity, func.sum(IncidentRollup.count)).where(
+        IncidentRollup.tenant_id == tenant_id, IncidentRollup.hour >= hour_bucket(since)
+    )
+    if until is not None:
+        stmt = stmt.where(IncidentRollup.hour <= utc_naive(until))
+    return stmt.group_by(IncidentRollup.severity)
+
+
+def score_from_totals(totals: Iterable[Tuple[str, int]]) -> int:
+    total = 0
+    for severity, cnt in totals:
+        total += SEV_WEIGHT.get(severity or "low", 1) * int(cnt or 0)
+    return max(0, 100 - min(100, total))
+
+
+def compute_score(db: Session, tenant_id: str, since: datetime, until: Optional[datetime] = None) -> int:
+    return score_from_totals(db.execute(incident_totals_stmt(tenant_id, since, until)))
+
+
+def hourly_series(db: Session, tenant_id: str, since: datetime, until: Optional[datetime] = None) -> Dict[str, List[dict]]:
+    """Séries por hora para gráficos: eventos por severidade e ocorrências por severidade."""
+    since = hour_bucket(since)
+    out = {}
+    for name, model in (("events", EventRollup), ("incidents", IncidentRollup)):
+        stmt = select(model.hour, model.severity, func.sum(model.count)).where(model.tenant_id == tenant_id, model.hour >= since)
+        if until is not None:
+            stmt = stmt.where(model.hour <= utc_naive(until))
+        stmt = stmt.group_by(model.hour, model.severity).order_by(model.hour)
+        out[name] = [{"hour": h, "severity": sev or None, "count": int(n or 0)} for h, sev, n in db.execute(stmt)]
+    return out
+
+
+def breakdown(db: Session, tenant_id: str, since: datetime, until: Optional[datetime] = None) -> dict:
+    """Totais da janela por event_type e por tipo de incidente."""
+    since = hour_bucket(since)
+    out = {}
+    for name, model, col in (("event_types", EventRollup, EventRollup.event_type), ("incident_kinds", IncidentRollup, IncidentRollup.kind)):
+        stmt = select(col, func.sum(model.count)).where(model.tenant_id == tenant_id, model.hour >= since)
+        if until is not None:
+            stmt = stmt.where(model.hour <= utc_naive(until))
+        out[name] = {k or None: int(n or 0) for k, n in db.execute(stmt.group_by(col))}
+    return out
+
+
+def stats_window(days: int, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    now = utc_naive(now or datetime.utcnow())
+    days = max(1, min(STATS_MAX_DAYS, days))
+    return now - timedelta(days=days), now
@@ -1,75 +1,124 @@
+import hashlib
 from datetime import datetime, timedelta
-from collections import defaultdict
 from sqlalchemy.orm import Session
 from sqlalchemy import select
+from typing import Optional
 from .models import Event, Incident
+from .indicators import IndicatorMatcher, get_matcher
+from .payloads import attach_payloads
+from .rollups import record_incidents
+from .ruleset import ruleset_for_tenant
 
 
-def classify_and_upsert_incidents(db: Session, tenant_id: str, window_minutes: int = 30):
-    since = datetime.utcnow() - timedelta(minutes=window_minutes)
-    # Load recent events (simple approach)
-    rows = db.execute(
-        select(Event).where(Event.tenant_id == tenant_id, Event.ts >= since)
-    )
-    brute = defaultdict(int)
-    suspicious = []
-    critical = []
-
-    for (e,) in rows:
-        if e.event_type in {"auth_failed", "ssh_auth_failed", "rdp_auth_failed"} and e.src_ip:
-            key = (e.src_ip, e.username or "?")
-            brute[key] += 1
-        # suspicious execution
-        rawmsg = str((e.raw_json or {}).get("message", ""))
-        combined = f"{rawmsg} {e.app or ''} {e.event_type or ''}"
-        if any(tok in combined.lower() for tok in ["powershell", "base64", "certutil", "wmic", "rundll32"]):
-            suspicious.append(e)
-        # critical change
-        if e.event_type in {"sudoers_changed", "user_group_modified", "administrators_group_modified"}:
-            critical.append(e)
+# colunas que as regras podem usar (ver api/ruleset.py)
+DETECTION_COLUMNS = (Event.id, Event.ts, Event.host, Event.app, Event.event_type, Event.src_ip, Event.dst_ip, Event.username, Event.severity, Event.raw_json,
+                     Event.payload_block_id, Event.payload_idx)
+
+
+def is_suspicious(raw, app, event_type, matcher: Optional[IndicatorMatcher] = None) -> bool:
+    return (matcher or get_matcher()).match_event(raw, app, event_type) is not None
+
 
+def classify_and_upsert_incidents(db: Session, tenant_id: str, window_minutes: Optional[int] = None):
+    # Varredura completa da janela: todas as regras numa só passada pelos eventos
+    ruleset = ruleset_for_tenant(db, tenant_id)
     now = datetime.utcnow()
-    new_critical_payloads = []
-    # Upsert brute force incidents
-    for (src_ip, username), count in brute.items():
-        if count >= 5:  # threshold
-            ctx = {"src_ip": src_ip, "username": username, "threshold": 5}
-            inc = _upsert_incident(db, tenant_id, kind="brute_force", severity="high", context_key=("src_ip", src_ip), now=now, context=ctx)
-            new_critical_payloads.append({"kind": "brute_force", "severity": "high", "context": ctx})
-
-    # Upsert suspicious execution
-    if suspicious:
-        _upsert_incident(db, tenant_id, kind="suspicious_execution", severity="medium", context_key=("count", len(suspicious)), now=now, context={"count": len(suspicious)})
-
-    # Upsert critical changes
-    for e in critical:
-        ctx = {"host": e.host, "event_type": e.event_type}
-        _upsert_incident(db, tenant_id, kind="critical_change", severity="high", context_key=("event_type", e.event_type or ""), now=now, context=ctx)
-        new_critical_payloads.append({"kind": "critical_change", "severity": "high", "context": ctx})
+    window = min(window_minutes or ruleset.window_minutes, ruleset.window_minutes)
+    since = now - timedelta(minutes=window)
+    rows = db.execute(
+        select(*DETECTION_COLUMNS).where(Event.tenant_id == tenant_id, Event.ts >= since)
+    ).mappings()
+    if ruleset.needs_raw:
+        rows = attach_payloads(db, rows)
+    hits = ruleset.scan(rows, now=now, window_minutes=window)
+    return _apply_detections(db, tenant_id, hits, now)
+
 
+def detect_and_upsert_incidents(db: Session, tenant_id: str, rows: list):
+    """Versão incremental de classify_and_upsert_incidents: só olha os eventos novos.
+
+    Os contadores da janela ficam em memória (api.detection); as decisões usam
+    as mesmas regras da varredura completa.
+    """
+    from .detection import detector
+    hits = detector.observe(db, tenant_id, rows, ruleset_for_tenant(db, tenant_id))
+    return _apply_detections(db, tenant_id, hits)
+
+
+def incident_fingerprint(kind: str, *parts) -> str:
+    # Identidade estável do incidente: tipo + contexto relevante (ex.: IP de origem, host)
+    key = "|".join([kind, *("" if p is None else str(p) for p in parts)])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _apply_detections(db: Session, tenant_id: str, hits: list, now: Optional[datetime] = None):
+    now = now or datetime.utcnow()
+    new_critical_payloads = []
+    candidates = []
+    for hit in hits:
+        rule = hit.rule
+        ctx = rule.context(hit.key, hit.count)
+        fp = incident_fingerprint(rule.kind, *hit.key)
+        candidates.extend([(fp, rule.kind, rule.severity, ctx)] * hit.emissions)
+        if rule.notify:
+            new_critical_payloads.extend({"kind": rule.kind, "severity": rule.severity, "context": ctx} for _ in range(hit.emissions))
+    upsert_incidents(db, tenant_id, candidates, now)
     db.commit()
     return new_critical_payloads
 
 
-def _upsert_incident(db: Session, tenant_id: str, *, kind: str, severity: str, context_key: tuple, now: datetime, context: dict):
-    inc = db.execute(
-        select(Incident).where(Incident.tenant_id == tenant_id, Incident.kind == kind)
-    ).scalars().first()
-    if inc:
-        inc.last_seen = now
-        inc.count = (inc.count or 0) + 1
-        inc.severity = severity
-        inc.context_json = {**(inc.context_json or {}), **{context_key[0]: context_key[1]}, **context}
-    else:
-        inc = Incident(
-            tenant_id=tenant_id,
-            kind=kind,
-            severity=severity,
-            first_seen=now,
-            last_seen=now,
-            count=1,
-            context_json={context_key[0]: context_key[1], **context},
-            status="open",
+def upsert_incidents(db: Session, tenant_id: str, candidates: list, now: datetime) -> int:
+    """Grava os incidentes de uma passada de detecção num único INSERT ... ON CONFLICT.
+
+    `candidates` é uma lista de (fingerprint, kind, severity, context). Repetições do
+    mesmo fingerprint são somadas antes; no banco, `count` é incrementado e
+    `last_seen`/`severity`/`context_json` atualizados sem SELECT prévio.
+    Não faz commit.
+    """
+    merged = {}
+    for fp, kind, severity, ctx in candidates:
+        row = merged.get(fp)
+        if row is None:
+            merged[fp] = {
+                "tenant_id": tenant_id, "fingerprint": fp, "kind": kind, "severity": severity,
+                "first_seen": now, "last_seen": now, "count": 1, "context_json": ctx, "status": "open",
+            }
+        else:
+            row["count"] += 1
+            row["severity"] = severity
+            row["context_json"] = ctx
+    if not merged:
+        return 0
+    rows = list(merged.values())
+    record_incidents(db, tenant_id, ((now, r["severity"], r["kind"], r["count"]) for r in rows))
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(Incident.__table__).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["tenant_id", "fingerprint"],
+            set_={
+                "count": Incident.__table__.c.count + stmt.excluded.count,
+                "last_seen": stmt.excluded.last_seen,
+                "severity": stmt.excluded.severity,
+                "context_json": stmt.excluded.context_json,
+            },
         )
-        db.add(inc)
-    
+        db.execute(stmt)
+        return len(rows)
+    # outros bancos: um SELECT por fingerprint
+    for row in rows:
+        inc = db.execute(
+            select(Incident).where(Incident.tenant_id == tenant_id, Incident.fingerprint == row["fingerprint"])
+        ).scalars().first()
+        if inc:
+            inc.last_seen = now
+            inc.count = (inc.count or 0) + row["count"]
+            inc.severity = row["severity"]
+            inc.context_json = row["context_json"]
+        else:
+            db.add(Incident(**row))
+    return len(rows)
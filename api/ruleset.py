@@ -0,0 +1,257 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import yaml
+from sqlalchemy.orm import Session
+
+from .indicators import IndicatorMatcher, get_matcher, matcher_for_tenant
+
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(__file__), "detections.yaml")
+RULES_FILE = os.getenv("RULES_FILE") or DEFAULT_RULES_FILE
+# Com RULES_FILE_OPTIONAL=1, um RULES_FILE ausente cai nas regras padrão (com aviso) em vez de erro
+RULES_FILE_OPTIONAL = os.getenv("RULES_FILE_OPTIONAL", "0").lower() in ("1", "true", "yes")
+DEFAULT_WINDOW_MINUTES = 30
+EVENT_FIELDS = ("host", "app", "event_type", "src_ip", "dst_ip", "username", "severity", "message")
+NOTIFY_SEVERITIES = {"high", "critical"}
+
+# Uma decisão: regra, chave do grupo, eventos do grupo na janela e quantas
+# ocorrências do incidente registrar nesta passada.
+Hit = namedtuple("Hit", "rule key count emissions")
+
+log = logging.getLogger("api.ruleset")
+
+
+class RuleError(ValueError):
+    pass
+
+
+def utc_naive(ts: datetime) -> datetime:
+    if ts.tzinfo is not None:
+        return ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def _getter(field: str) -> Callable[[dict], object]:
+    if field == "message":
+        def get(ev):
+            raw = ev.get("raw_json")
+            return raw.get("message") if isinstance(raw, dict) else None
+        return get
+    if field not in EVENT_FIELDS:
+        raise RuleError(f"unknown field '{field}'")
+    return lambda ev: ev.get(field)
+
+
+def _compile_field(field: str, spec) -> Callable[[dict], bool]:
+    get = _getter(field)
+    if not isinstance(spec, dict):
+        spec = {"in": spec} if isinstance(spec, list) else {"eq": spec}
+    checks = []
+    for op, arg in spec.items():
+        if op == "eq":
+            checks.append(lambda v, a=arg: v == a)
+        elif op == "in":
+            checks.append(lambda v, a=frozenset(arg): v in a)
+        elif op == "not_in":
+            checks.append(lambda v, a=frozenset(arg): v not in a)
+        elif op == "exists":
+            checks.append(lambda v, a=bool(arg): (v not in (None, "")) == a)
+        elif op == "contains":
+            m = IndicatorMatcher(arg if isinstance(arg, list) else [arg])
+            checks.append(lambda v, m=m: v is not None and m.search(str(v)) is not None)
+        else:
+            raise RuleError(f"unknown operator '{op}' for field '{field}'")
+    if len(checks) == 1:
+        check = checks[0]
+        return lambda ev: check(get(ev))
+    return lambda ev: all(c(get(ev)) for c in checks)
+
+
+def _indexed_types(spec) -> Optional[frozenset]:
+    # event_type com igualdade/lista vira chave do índice em vez de predicado
+    if isinstance(spec, list):
+        return frozenset(spec)
+    if isinstance(spec, dict):
+        if set(spec) == {"in"}:
+            return frozenset(spec["in"])
+        if set(spec) == {"eq"}:
+            return frozenset([spec["eq"]])
+        return None
+    return frozenset([spec])
+
+
+class Rule:
+    __slots__ = ("id", "kind", "severity", "group_by", "defaults", "threshold", "window_minutes",
+                 "per_event", "notify", "event_types", "predicates", "needs_raw", "_key_getters")
+
+    def __init__(self, spec: dict, matcher: IndicatorMatcher):
+        if not isinstance(spec, dict) or not spec.get("id"):
+            raise RuleError("rule without id")
+        self.id = str(spec["id"])
+        self.kind = str(spec.get("kind") or self.id)
+        self.severity = str(spec.get("severity", "medium"))
+        self.group_by = tuple(spec.get("group_by") or ())
+        self.defaults = dict(spec.get("defaults") or {})
+        self.threshold = max(1, int(spec.get("threshold", 1)))
+        self.window_minutes = max(1, int(spec.get("window_minutes", DEFAULT_WINDOW_MINUTES)))
+        self.per_event = bool(spec.get("per_event", False))
+        self.notify = bool(spec.get("notify", self.severity in NOTIFY_SEVERITIES))
+        match = dict(spec.get("match") or {})
+        self.event_types = None
+        if "event_type" in match:
+            self.event_types = _indexed_types(match["event_type"])
+            if self.event_types is not None:
+                match.pop("event_type")
+        self.predicates = []
+        # regras que leem o payload (raw_json) exigem descomprimir os blocos (api/payloads.py)
+        self.needs_raw = bool(match.get("indicators")) or "message" in match or "message" in self.group_by
+        if match.pop("indicators", False):
+            self.predicates.append(lambda ev: matcher.match_event(ev.get("raw_json"), ev.get("app"), ev.get("event_type")) is not None)
+        for field, fspec in match.items():
+            self.predicates.append(_compile_field(field, fspec))
+        self._key_getters = [(_getter(f), self.defaults.get(f)) for f in self.group_by]
+
+    def key(self, ev: dict) -> tuple:
+        return tuple(v if v not in (None, "") else d for v, d in ((g(ev), d) for g, d in self._key_getters))
+
+    def context(self, key: tuple, count: int) -> dict:
+        ctx = dict(zip(self.group_by, key))
+        ctx["count"] = count
+        if self.threshold > 1:
+            ctx["threshold"] = self.threshold
+        return ctx
+
+
+class RuleSet:
+    """Regras compiladas num avaliador de passada única.
+
+    As regras são indexadas por event_type: cada evento consulta só as regras do
+    seu tipo e as que não filtram por tipo, e é visitado uma vez, não importa
+    quantas regras estejam ativas.
+    """
+
+    def __init__(self, rules: List[Rule], version: str = ""):
+        self.rules = rules
+        self.version = version
+        self.window_minutes = max((r.window_minutes for r in rules), default=DEFAULT_WINDOW_MINUTES)
+        self.needs_raw = any(r.needs_raw for r in rules)
+        by_type: Dict[str, list] = {}
+        any_type = []
+        for idx, r in enumerate(rules):
+            if r.event_types is None:
+                any_type.append((idx, r))
+            else:
+                for et in r.event_types:
+                    by_type.setdefault(et, []).append((idx, r))
+        self._by_type = by_type
+        self._any = any_type
+
+    def match(self, ev: dict) -> List[Tuple[int, tuple]]:
+        """Retorna (índice da regra, chave do grupo) de cada regra que casa com o evento."""
+        out = []
+        for candidates in (self._by_type.get(ev.get("event_type"), ()), self._any):
+            for idx, r in candidates:
+                for p in r.predicates:
+                    if not p(ev):
+                        break
+                else:
+                    out.append((idx, r.key(ev)))
+        return out
+
+    def scan(self, events: Iterable[dict], now: Optional[datetime] = None, window_minutes: Optional[int] = None) -> List[Hit]:
+        """Varredura completa: conta os grupos de todas as regras numa passada pelos eventos."""
+        now = utc_naive(now or datetime.utcnow())
+        cutoffs = [now - timedelta(minutes=min(r.window_minutes, window_minutes or r.window_minutes)) for r in self.rules]
+        counts = Counter()
+        for ev in events:
+            ts = utc_naive(ev["ts"])
+            for idx, key in self.match(ev):
+                if ts >= cutoffs[idx]:
+                    counts[(idx, key)] += 1
+        hits = []
+        for (idx, key), n in counts.items():
+            r = self.rules[idx]
+            if n >= r.threshold:
+                hits.append(Hit(r, key, n, n if r.per_event else 1))
+        return hits
+
+
+def compile_rules(specs: List[dict], matcher: Optional[IndicatorMatcher] = None, version: str = "") -> RuleSet:
+    matcher = matcher or get_matcher()
+    return RuleSet([Rule(s, matcher) for s in specs if s.get("enabled", True)], version)
+
+
+def merge_rules(base: List[dict], overrides: List[dict]) -> List[dict]:
+    """Aplica as regras do tenant sobre as do arquivo (mesmo id sobrescreve campos)."""
+    merged = {s["id"]: dict(s) for s in base if isinstance(s, dict) and s.get("id")}
+    for o in overrides or []:
+        if not isinstance(o, dict) or not o.get("id"):
+            continue
+        merged[o["id"]] = {**merged.get(o["id"], {}), **o}
+    return list(merged.values())
+
+
+_file_lock = threading.Lock()
+_file_state = {"path": None, "mtime": None, "specs": [], "warned": set()}
+
+
+def load_rule_specs(path: Optional[str] = None) -> List[dict]:
+    # Relido quando o arquivo muda (mtime); YAML ou JSON. Arquivo ausente é erro:
+    # sem regras a detecção pararia em silêncio.
+    path = path or RULES_FILE
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        if path == RULES_FILE and RULES_FILE_OPTIONAL and path != DEFAULT_RULES_FILE:
+            with _file_lock:
+                if path not in _file_state["warned"]:
+                    _file_state["warned"].add(path)
+                    log.warning("RULES_FILE %s não encontrado; usando as regras padrão (%s)", path, DEFAULT_RULES_FILE)
+            return load_rule_specs(DEFAULT_RULES_FILE)
+        with _file_lock:
+            if _file_state["path"] == path and _file_state["specs"]:
+                # sumiu depois de carregado (deploy pela metade): mantém a última versão válida
+                log.error("arquivo de regras %s não encontrado; mantendo as regras carregadas antes", path)
+                return _file_state["specs"]
+        raise RuleError(f"rules file not found: {path}")
+    with _file_lock:
+        if _file_state["path"] != path or _file_state["mtime"] != mtime:
+            with open(path, encoding="utf-8") as f:
+                data = yaml.safe_load(f) or {}
+            specs = data.get("rules", []) if isinstance(data, dict) else data
+            _file_state.update(path=path, mtime=mtime, specs=[s for s in specs or [] if isinstance(s, dict)])
+        return _file_state["specs"]
+
+
+@lru_cache(maxsize=256)
+def _compiled(specs_json: str, matcher: IndicatorMatcher) -> RuleSet:
+    version = hashlib.sha1((specs_json + "\n" + "\n".join(matcher.indicators)).encode("utf-8")).hexdigest()[:16]
+    return compile_rules(json.loads(specs_json), matcher, version)
+
+
+def ruleset_for_tenant(db: Session, tenant_id: str, rules_file: Optional[str] = None) -> RuleSet:
+    """Regras efetivas do tenant (arquivo + integrations_json["rules"]).
+
+    Mudanças no arquivo ou nas regras do tenant valem a partir da próxima
+    avaliação; conjuntos iguais reaproveitam a mesma compilação. `rules_file`
+    troca o arquivo base (ex.: testar regras novas num replay).
+    """
+    from .models import Tenant
+    tenant = db.get(Tenant, tenant_id)
+    overrides = ((tenant.integrations_json or {}).get("rules") if tenant else None) or []
+    matcher = matcher_for_tenant(db, tenant_id)
+    base = load_rule_specs(rules_file)
+    specs = merge_rules(base, overrides if isinstance(overrides, list) else [])
+    try:
+        return _compiled(json.dumps(specs, sort_keys=True, default=str), matcher)
+    except (RuleError, TypeError, ValueError):
+        # regra inválida do tenant não derruba a detecção: usa só as do arquivo
+        return _compiled(json.dumps(merge_rules(base, []), sort_keys=True, default=str), matcher)
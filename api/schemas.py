@@ -1,5 +1,6 @@
 from typing import List, Optional, Any
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
+from typing_extensions import TypedDict, NotRequired
 
 
 class EventIn(BaseModel):
@@ -20,6 +21,28 @@ class IngestBatchIn(BaseModel):
     events: List[EventIn]
 
 
+# Mesmo formato de IngestBatchIn/EventIn, validado direto para dicts (sem objetos por evento)
+class EventDict(TypedDict):
+    ts: str
+    host: NotRequired[Optional[str]]
+    app: NotRequired[Optional[str]]
+    event_type: NotRequired[Optional[str]]
+    src_ip: NotRequired[Optional[str]]
+    dst_ip: NotRequired[Optional[str]]
+    username: NotRequired[Optional[str]]
+    severity: NotRequired[Optional[str]]
+    raw: NotRequired[Any]
+
+
+class IngestBatchDict(TypedDict):
+    agent_id: str
+    batch_id: str
+    events: List[EventDict]
+
+
+ingest_batch_adapter = TypeAdapter(IngestBatchDict)
+
+
 class AgentRegisterIn(BaseModel):
     agent_id: str
     os: Optional[str] = None
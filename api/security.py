@@ -1,7 +1,8 @@
 import os
-from fastapi import Header, HTTPException, Depends
-from sqlalchemy.orm import Session
-from .database import SessionLocal
+from fastapi import Header, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import SessionLocal, AsyncSessionLocal, ReadSessionLocal, AsyncReadSessionLocal
 from .models import Tenant
 from .auth import decode_jwt
 
@@ -14,16 +15,42 @@ def get_db():
         db.close()
 
 
-def require_tenant(authorization: str | None = Header(None), db: Session = Depends(get_db)) -> Tenant:
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_read_db():
+    # Só leitura: réplica (DATABASE_READ_URL) quando configurada, senão o primário
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+async def require_tenant(authorization: str | None = Header(None)) -> Tenant:
+    # Sessão curta só para a busca: a conexão volta ao pool antes da rota rodar (a rota
+    # usa a sua própria sessão, sync ou async). O Tenant retornado fica desanexado.
+    async with AsyncSessionLocal() as db:
+        return await _tenant_for(db, authorization)
+
+
+async def _tenant_for(db: AsyncSession, authorization: str | None) -> Tenant:
     # Public mode: allow anonymous access under demo tenant
     public_mode = os.getenv("PUBLIC_ALLOW_ANON", "0").lower() in ("1", "true", "yes")
     if not authorization or not authorization.lower().startswith("bearer "):
         if public_mode:
-            tenant = db.get(Tenant, "demo")
+            tenant = await db.get(Tenant, "demo")
             if not tenant:
                 tenant = Tenant(id="demo", name="Demo Org", plan="starter", ingest_token="demo-token", status="active")
                 db.add(tenant)
-                db.commit()
+                await db.commit()
             if tenant and tenant.status == "active":
                 return tenant
         raise HTTPException(status_code=401, detail="Missing bearer token")
@@ -33,13 +60,13 @@ def require_tenant(authorization: str | None = Header(None), db: Session = Depen
         claims = decode_jwt(token)
         tid = claims.get("tenant_id")
         if tid:
-            tenant = db.get(Tenant, tid)
+            tenant = await db.get(Tenant, tid)
             if tenant and tenant.status == "active":
                 return tenant
     except Exception:
         pass
     # Fallback to ingest token (agents / legacy panel token)
-    tenant = db.query(Tenant).filter(Tenant.ingest_token == token, Tenant.status == "active").first()
+    tenant = (await db.execute(select(Tenant).where(Tenant.ingest_token == token, Tenant.status == "active"))).scalars().first()
     if not tenant:
         raise HTTPException(status_code=401, detail="Invalid token")
     return tenant
@@ -0,0 +1,73 @@
+import json
+import os
+import zlib
+from typing import AsyncIterator
+
+
+STREAM_CHUNK_EVENTS = int(os.getenv("INGEST_STREAM_CHUNK_EVENTS", "1000"))
+STREAM_MAX_LINE_BYTES = int(os.getenv("INGEST_STREAM_MAX_LINE_BYTES", str(1024 * 1024)))
+# Limite de saída por chamada ao descompressor (evita explosão de memória com "gzip bombs")
+_INFLATE_STEP = 256 * 1024
+
+
+class StreamError(ValueError):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def _inflate(stream: AsyncIterator[bytes], gzipped: bool) -> AsyncIterator[bytes]:
+    if not gzipped:
+        async for chunk in stream:
+            if chunk:
+                yield chunk
+        return
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        async for chunk in stream:
+            data = chunk
+            while data:
+                out = d.decompress(data, _INFLATE_STEP)
+                if out:
+                    yield out
+                data = d.unconsumed_tail
+        tail = d.flush()
+    except zlib.error as e:
+        raise StreamError(f"Invalid gzip stream: {e}")
+    if tail:
+        yield tail
+
+
+async def iter_ndjson(stream: AsyncIterator[bytes], gzipped: bool = False) -> AsyncIterator[tuple]:
+    """Lê um corpo NDJSON (opcionalmente gzip) de forma incremental.
+
+    Gera tuplas (número_da_linha, objeto) sem nunca manter mais que uma linha
+    parcial em memória.
+    """
+    buf = b""
+    lineno = 0
+    async for data in _inflate(stream, gzipped):
+        buf += data
+        start = 0
+        while True:
+            nl = buf.find(b"\n", start)
+            if nl < 0:
+                break
+            line = buf[start:nl].strip()
+            start = nl + 1
+            lineno += 1
+            if line:
+                yield lineno, _loads(line, lineno)
+        buf = buf[start:]
+        if len(buf) > STREAM_MAX_LINE_BYTES:
+            raise StreamError(f"line {lineno + 1} exceeds {STREAM_MAX_LINE_BYTES} bytes", status_code=413)
+    line = buf.strip()
+    if line:
+        yield lineno + 1, _loads(line, lineno + 1)
+
+
+def _loads(line: bytes, lineno: int):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        raise StreamError(f"line {lineno}: invalid JSON: {e}")
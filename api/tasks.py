@@ -1,8 +1,19 @@
 from api.database import SessionLocal
 from api.main import _process_events
+from api.ratelimit import release_pending, redis_client
 
 
 def process_events_job(tenant_id: str, agent_id: str, items: list[dict]):
-    with SessionLocal() as db:
-        _process_events(db, tenant_id, agent_id, items)
+    try:
+        with SessionLocal() as db:
+            _process_events(db, tenant_id, agent_id, items)
+    finally:
+        _release(tenant_id, len(items))
 
+
+def _release(tenant_id: str, n: int):
+    # Libera a pendência contada em /v1/ingest (admission control)
+    try:
+        release_pending(redis_client(), tenant_id, n)
+    except Exception:
+        pass
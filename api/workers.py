@@ -0,0 +1,264 @@
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Callable, List, Optional
+
+from .database import SessionLocal
+
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_WORKER_QUEUE = int(os.getenv("INGEST_WORKER_QUEUE", "1000"))
+# Com a fila do tenant cheia, /v1/ingest espera até isso antes de cair no BackgroundTasks
+INGEST_SUBMIT_WAIT_SEC = float(os.getenv("INGEST_SUBMIT_WAIT_SEC", "5"))
+
+_STOP = object()
+
+log = logging.getLogger("api.workers")
+
+
+class _Job:
+    __slots__ = ("tenant_id", "agent_id", "items", "on_done", "handler", "enqueued")
+
+    def __init__(self, tenant_id: str, agent_id: str, items: List[dict], on_done: Optional[Callable] = None,
+                 handler: Optional[Callable] = None):
+        self.tenant_id = tenant_id
+        self.agent_id = agent_id
+        self.items = items
+        self.on_done = on_done
+        self.handler = handler
+        self.enqueued = time.monotonic()
+
+
+class IngestWorkerPool:
+    """Pool de threads que processa lotes de ingest fora do threadpool da API.
+
+    Cada tenant é sempre roteado para a mesma fila (crc32 do tenant_id), então
+    os lotes de um tenant são processados na ordem de chegada. Cada job abre a
+    sua própria sessão. As filas são limitadas (`queue_size` jobs por worker).
+    `on_done(ok)`, se passado no submit, roda depois do handler (que faz commit);
+    `handler`, se passado, substitui o do pool só para aquele job.
+    """
+
+    def __init__(self, handler: Optional[Callable] = None, workers: int = INGEST_WORKERS, queue_size: int = INGEST_WORKER_QUEUE, session_factory=SessionLocal):
+        self.workers = max(0, workers)
+        self.queue_size = queue_size
+        self._handler = handler
+        self._session_factory = session_factory
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._pending_by_tenant = {}
+        self._recent = deque()  # (monotonic, eventos) dos últimos 60s
+        self._stats = {"submitted_jobs": 0, "rejected_jobs": 0, "processed_jobs": 0, "processed_events": 0, "failed_jobs": 0, "last_lag_ms": 0.0, "max_lag_ms": 0.0, "busy_ms": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _resolve_handler(self) -> Callable:
+        if self._handler is None:
+            from .main import _process_events
+            self._handler = _process_events
+        return self._handler
+
+    def start(self):
+        with self._lock:
+            if self._threads or not self.enabled:
+                return
+            for i, q in enumerate(self._queues):
+                t = threading.Thread(target=self._run, args=(q,), name=f"ingest-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, tenant_id: str, agent_id: str, items: List[dict], block: bool = False, timeout: Optional[float] = None,
+               on_done: Optional[Callable[[bool], None]] = None, handler: Optional[Callable] = None) -> bool:
+        """Enfileira um lote; retorna False se a fila do tenant está cheia."""
+        if not self.enabled:
+            return False
+        self.start()
+        q = self._queues[zlib.crc32(tenant_id.encode("utf-8")) % self.workers]
+        try:
+            q.put(_Job(tenant_id, agent_id, items, on_done, handler), block=block, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected_jobs"] += 1
+            return False
+        with self._lock:
+            self._stats["submitted_jobs"] += 1
+            self._pending_by_tenant[tenant_id] = self._pending_by_tenant.get(tenant_id, 0) + len(items)
+        return True
+
+    def pending_events(self, tenant_id: Optional[str] = None) -> int:
+        with self._lock:
+            if tenant_id is None:
+                return sum(self._pending_by_tenant.values())
+            return self._pending_by_tenant.get(tenant_id, 0)
+
+    def _run(self, q: "queue.Queue"):
+        handler = self._resolve_handler()
+        while True:
+            job = q.get()
+            if job is _STOP:
+                return
+            started = time.monotonic()
+            ok = True
+            try:
+                with self._session_factory() as db:
+                    (job.handler or handler)(db, job.tenant_id, job.agent_id, job.items)
+            except Exception:
+                log.exception("ingest job failed (tenant=%s agent=%s, %d eventos, %s)",
+                              job.tenant_id, job.agent_id, len(job.items), threading.current_thread().name)
+                ok = False
+            if job.on_done is not None:
+                try:
+                    job.on_done(ok)
+                except Exception:
+                    log.exception("ingest pool: on_done falhou (tenant=%s agent=%s)", job.tenant_id, job.agent_id)
+            finished = time.monotonic()
+            self._record(job, ok, started, finished)
+
+    def _record(self, job: _Job, ok: bool, started: float, finished: float):
+        lag_ms = (started - job.enqueued) * 1000
+        n = len(job.items)
+        with self._lock:
+            left = self._pending_by_tenant.get(job.tenant_id, 0) - n
+            if left > 0:
+                self._pending_by_tenant[job.tenant_id] = left
+            else:
+                self._pending_by_tenant.pop(job.tenant_id, None)
+            s = self._stats
+            s["last_lag_ms"] = round(lag_ms, 2)
+            s["max_lag_ms"] = round(max(s["max_lag_ms"], lag_ms), 2)
+            s["busy_ms"] += (finished - started) * 1000
+            if ok:
+                s["processed_jobs"] += 1
+                s["processed_events"] += n
+                self._recent.append((finished, n))
+            else:
+                s["failed_jobs"] += 1
+
+    def stop(self, timeout: float = 10.0):
+        # Drena as filas: o sentinela entra depois dos jobs já enfileirados
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for q in self._queues:
+            if threads:
+                q.put(_STOP)
+        for t in threads:
+            t.join(timeout)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0][0] > 60:
+                self._recent.popleft()
+            s = dict(self._stats)
+            s["busy_ms"] = round(s["busy_ms"], 1)
+            s["workers"] = self.workers
+            s["queue_size"] = self.queue_size
+            s["queue_depth"] = [q.qsize() for q in self._queues]
+            s["pending_events"] = sum(self._pending_by_tenant.values())
+            s["pending_by_tenant"] = dict(self._pending_by_tenant)
+            s["events_per_sec_1m"] = round(sum(n for _, n in self._recent) / 60.0, 2)
+        return s
+
+
+ingest_pool = IngestWorkerPool()
+
+
+INFLIGHT_KEY = "ingest:inflight"
+
+
+def recover_inflight(conn, rq_queue) -> int:
+    """Devolve à frente da fila os jobs RQ que ficaram em voo (processo caiu antes do commit)."""
+    from rq.exceptions import NoSuchJobError
+    from rq.job import Job
+
+    recovered = 0
+    for raw_id in conn.smembers(INFLIGHT_KEY):
+        job_id = raw_id.decode() if isinstance(raw_id, bytes) else raw_id
+        try:
+            rq_queue.enqueue_job(Job.fetch(job_id, connection=conn), at_front=True)
+            recovered += 1
+        except NoSuchJobError:
+            pass
+        conn.srem(INFLIGHT_KEY, raw_id)
+    return recovered
+
+
+def run_standalone():
+    """Processo dedicado: consome a fila RQ `ingest` e despacha para o pool.
+
+    Substitui `rq worker ingest` quando se quer concorrência com ordem por tenant.
+    Cada job retirado da fila fica em `ingest:inflight` até o pool gravar os
+    eventos; só então é apagado. Jobs em voo de um processo que caiu voltam à
+    fila no próximo start.
+    """
+    import redis
+    from rq import Queue
+    from rq.exceptions import DequeueTimeout
+
+    logging.basicConfig(level=logging.INFO)
+    url = os.getenv("REDIS_URL")
+    if not url:
+        raise SystemExit("REDIS_URL is required for the standalone ingest worker")
+    conn = redis.Redis.from_url(url)
+    rq_queue = Queue("ingest", connection=conn)
+    from .main import _process_events
+    from .ratelimit import release_pending
+
+    recovered = recover_inflight(conn, rq_queue)
+    if recovered:
+        log.warning("ingest pool: %d jobs em voo de uma execução anterior devolvidos à fila", recovered)
+
+    def handler(db, tenant_id, agent_id, items):
+        try:
+            _process_events(db, tenant_id, agent_id, items)
+        finally:
+            try:
+                release_pending(conn, tenant_id, len(items))
+            except Exception:
+                pass
+
+    def acker(job):
+        def on_done(ok: bool):
+            # Após o commit de _process_events; com falha o job fica no Redis para inspeção
+            try:
+                if ok:
+                    job.delete()
+                else:
+                    log.error("ingest pool: job %s falhou (tenant=%s)", job.id, job.args[0])
+            finally:
+                conn.srem(INFLIGHT_KEY, job.id)
+        return on_done
+
+    pool = IngestWorkerPool(handler, workers=max(1, INGEST_WORKERS))
+    pool.start()
+    last_report = time.monotonic()
+    try:
+        while True:
+            try:
+                res = Queue.dequeue_any([rq_queue], timeout=5, connection=conn)
+            except DequeueTimeout:
+                res = None
+            if res:
+                job, _ = res
+                conn.sadd(INFLIGHT_KEY, job.id)
+                tenant_id, agent_id, items = job.args
+                pool.submit(tenant_id, agent_id, items, block=True, on_done=acker(job))
+            if time.monotonic() - last_report >= 60:
+                s = pool.stats()
+                log.info("ingest pool: %.1f events/s, pending=%d, last_lag=%.0fms", s["events_per_sec_1m"], s["pending_events"], s["last_lag_ms"])
+                last_report = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+
+
+if __name__ == "__main__":
+    run_standalone()
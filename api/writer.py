@@ -0,0 +1,218 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+from .database import SessionLocal, SQLITE_TUNED
+
+
+SQLITE_WRITER_MAX_EVENTS = int(os.getenv("SQLITE_WRITER_MAX_EVENTS", "5000"))
+SQLITE_WRITER_WAIT_MS = int(os.getenv("SQLITE_WRITER_WAIT_MS", "20"))
+SQLITE_WRITER_QUEUE = int(os.getenv("SQLITE_WRITER_QUEUE", "2000"))
+
+_STOP = object()
+
+log = logging.getLogger("api.writer")
+
+
+class WriteJob:
+    __slots__ = ("tenant_id", "agent_id", "items", "batch_id", "enqueued")
+
+    def __init__(self, tenant_id: str, agent_id: str, items: List[dict], batch_id: Optional[str] = None):
+        self.tenant_id = tenant_id
+        self.agent_id = agent_id
+        self.items = items
+        self.batch_id = batch_id
+        self.enqueued = time.monotonic()
+
+
+class EventInsertWriter:
+    """INSERTs de eventos serializados numa thread, para o SQLite otimizado.
+
+    O SQLite aceita um escritor por vez; com várias threads gravando, os commits
+    se enfileiram no lock do arquivo ("database is locked"). Aqui os lotes de
+    todos os requests e tenants entram numa fila e a thread junta o que chegar
+    em até `wait_ms` (ou `max_events`) numa única transação:
+    `write_batch(db, jobs)` grava, faz commit e retorna os jobs que não puderam
+    ser gravados (contados à parte). A ordem de chegada é mantida. Só INSERTs
+    devem rodar aqui: nada que espere rede (reputação, e-mail).
+
+    Não é o único escritor do banco: incidentes, rollups de incidentes, cache de
+    reputação e notificações são gravados pelo pós-processamento (rules_pool) em
+    transações próprias e curtas, que esperam o lock até SQLITE_BUSY_TIMEOUT_MS.
+    """
+
+    def __init__(self, write_batch: Optional[Callable] = None, session_factory=SessionLocal,
+                 max_events: int = SQLITE_WRITER_MAX_EVENTS, wait_ms: int = SQLITE_WRITER_WAIT_MS,
+                 queue_size: int = SQLITE_WRITER_QUEUE, enabled: bool = True):
+        self.max_events = max_events
+        self.wait = wait_ms / 1000.0
+        self.queue_size = queue_size
+        self._enabled = enabled
+        self._write_batch = write_batch
+        self._session_factory = session_factory
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._inflight = 0
+        self._pending_by_tenant = {}
+        self._recent = deque()  # (monotonic, eventos) dos últimos 60s
+        self._stats = {"submitted_jobs": 0, "rejected_jobs": 0, "transactions": 0, "written_jobs": 0,
+                       "written_events": 0, "failed_jobs": 0, "failed_events": 0, "failed_transactions": 0, "max_batch_jobs": 0,
+                       "last_lag_ms": 0.0, "max_lag_ms": 0.0, "busy_ms": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def _resolve_handler(self) -> Callable:
+        if self._write_batch is None:
+            from .main import _write_batch
+            self._write_batch = _write_batch
+        return self._write_batch
+
+    def start(self):
+        with self._lock:
+            if (self._thread and self._thread.is_alive()) or not self.enabled:
+                return
+            self._thread = threading.Thread(target=self._run, name="event-inserts", daemon=True)
+            self._thread.start()
+
+    def submit(self, tenant_id: str, agent_id: str, items: List[dict], block: bool = False, timeout: Optional[float] = None,
+               batch_id: Optional[str] = None) -> bool:
+        """Enfileira um lote; retorna False se a fila está cheia."""
+        if not self.enabled:
+            return False
+        self.start()
+        with self._lock:
+            self._inflight += 1
+            self._pending_by_tenant[tenant_id] = self._pending_by_tenant.get(tenant_id, 0) + len(items)
+        try:
+            self._queue.put(WriteJob(tenant_id, agent_id, items, batch_id), block=block, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected_jobs"] += 1
+                self._done([WriteJob(tenant_id, agent_id, items)])
+            return False
+        with self._lock:
+            self._stats["submitted_jobs"] += 1
+        return True
+
+    def pending_events(self, tenant_id: Optional[str] = None) -> int:
+        with self._lock:
+            if tenant_id is None:
+                return sum(self._pending_by_tenant.values())
+            return self._pending_by_tenant.get(tenant_id, 0)
+
+    def _collect(self, first) -> tuple:
+        # Junta o que já está na fila (ou chega em até `wait`) até max_events
+        jobs = [first]
+        events = len(first.items)
+        deadline = time.monotonic() + self.wait
+        stop = False
+        while events < self.max_events:
+            left = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=left) if left > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is _STOP:
+                stop = True
+                break
+            jobs.append(job)
+            events += len(job.items)
+        return jobs, stop
+
+    def _run(self):
+        handler = self._resolve_handler()
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            jobs, stop = self._collect(first)
+            started = time.monotonic()
+            failed = []
+            try:
+                with self._session_factory() as db:
+                    failed = handler(db, jobs) or []
+            except Exception:
+                log.exception("event inserts: transação de %d lotes falhou", len(jobs))
+                failed = None
+            self._record(jobs, failed, started, time.monotonic())
+            if stop:
+                return
+
+    def _done(self, jobs: List[WriteJob]):
+        # chamado com o lock
+        for job in jobs:
+            left = self._pending_by_tenant.get(job.tenant_id, 0) - len(job.items)
+            if left > 0:
+                self._pending_by_tenant[job.tenant_id] = left
+            else:
+                self._pending_by_tenant.pop(job.tenant_id, None)
+        self._inflight -= len(jobs)
+        if self._inflight <= 0:
+            self._idle.notify_all()
+
+    def _record(self, jobs: List[WriteJob], failed: Optional[List[WriteJob]], started: float, finished: float):
+        # failed=None: a transação inteira falhou; senão, só os jobs listados ficaram de fora
+        lag_ms = (started - jobs[0].enqueued) * 1000
+        lost = jobs if failed is None else failed
+        lost_ids = {id(j) for j in lost}
+        n = sum(len(j.items) for j in jobs if id(j) not in lost_ids)
+        with self._lock:
+            s = self._stats
+            s["last_lag_ms"] = round(lag_ms, 2)
+            s["max_lag_ms"] = round(max(s["max_lag_ms"], lag_ms), 2)
+            s["busy_ms"] += (finished - started) * 1000
+            s["max_batch_jobs"] = max(s["max_batch_jobs"], len(jobs))
+            s["failed_jobs"] += len(lost)
+            s["failed_events"] += sum(len(j.items) for j in lost)
+            if failed is None:
+                s["failed_transactions"] += 1
+            else:
+                s["transactions"] += 1
+                s["written_jobs"] += len(jobs) - len(lost)
+                s["written_events"] += n
+                self._recent.append((finished, n))
+            self._done(jobs)
+
+    def drain(self, timeout: float = 10.0) -> bool:
+        """Espera a fila e a transação em andamento terminarem (testes, shutdown)."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._inflight > 0:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._idle.wait(left)
+        return True
+
+    def stop(self, timeout: float = 10.0):
+        # O sentinela entra depois dos lotes já enfileirados
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0][0] > 60:
+                self._recent.popleft()
+            s = dict(self._stats)
+            s["busy_ms"] = round(s["busy_ms"], 1)
+            s["enabled"] = self.enabled
+            s["queue_depth"] = self._queue.qsize()
+            s["queue_size"] = self.queue_size
+            s["pending_events"] = sum(self._pending_by_tenant.values())
+            s["events_per_sec_1m"] = round(sum(n for _, n in self._recent) / 60.0, 2)
+        return s
+
+
+event_inserts = EventInsertWriter(enabled=SQLITE_TUNED)
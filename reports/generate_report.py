@@ -7,6 +7,7 @@ from sqlalchemy import select
 
 from api.database import SessionLocal
 from api.models import Tenant, Incident, Report
+from api.rollups import compute_score as rollup_score
 
 
 TEMPLATE = Template(
@@ -31,13 +32,8 @@ TEMPLATE = Template(
 
 
 def compute_score(db: Session, tenant_id: str, start: datetime, end: datetime) -> int:
-    from api.main import get_score  # reuse weights logic if needed
-    sev_weight = {"low": 1, "medium": 3, "high": 7, "critical": 12}
-    q = db.execute(select(Incident.severity, Incident.count).where(Incident.tenant_id == tenant_id, Incident.last_seen >= start, Incident.last_seen <= end))
-    total = 0
-    for severity, cnt in q:
-        total += sev_weight.get(severity or "low", 1) * int(cnt or 0)
-    return max(0, 100 - min(100, total))
+    # Mesmos pesos de /v1/score, lidos dos agregados por hora
+    return rollup_score(db, tenant_id, start, end)
 
 
 def generate(tenant_id: str, out_dir: str = "./data/reports") -> str:
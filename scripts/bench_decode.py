@@ -0,0 +1,49 @@
+"""Micro-benchmark da decodificação de /v1/ingest: json.loads + modelos pydantic vs modo rápido.
+
+Uso:
+  PYTHONPATH=. python scripts/bench_decode.py [--events 10000] [--rounds 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from api.decoding import decode_ingest_batch  # noqa: E402
+
+
+def make_body(n: int) -> bytes:
+    events = [{
+        "ts": "2025-09-21T12:34:56Z",
+        "host": f"h{i % 20}",
+        "app": "linux-auth",
+        "event_type": "auth_failed",
+        "src_ip": f"203.0.113.{i % 250}",
+        "username": "root",
+        "severity": "high",
+        "raw": {"message": f"Failed password for root from 203.0.113.{i % 250} port {1000 + i}"},
+    } for i in range(n)]
+    return json.dumps({"agent_id": "AG-BENCH", "batch_id": "b", "events": events}).encode("utf-8")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=10000)
+    ap.add_argument("--rounds", type=int, default=5)
+    args = ap.parse_args()
+    body = make_body(args.events)
+    print(f"{args.events} eventos, {len(body) / 1024:.0f} KiB, melhor de {args.rounds}")
+    for label, fast in (("pydantic", False), ("fast", True)):
+        best = None
+        for _ in range(args.rounds):
+            t0 = time.perf_counter()
+            decode_ingest_batch(body, fast=fast)
+            dt = time.perf_counter() - t0
+            best = dt if best is None else min(best, dt)
+        print(f"  {label:9s} {best * 1000:8.1f} ms  ({args.events / best:,.0f} eventos/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Benchmark do armazenamento de payloads: raw_json inline vs blocos comprimidos.
+
+Mede o tamanho do banco, a taxa de compressão e a vazão de varredura da janela
+de detecção com e sem leitura do payload.
+
+Uso:
+  PYTHONPATH=. python scripts/bench_payloads.py [--events 50000] [--batch 500] [--rounds 3]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from api.database import Base  # noqa: E402
+from api.models import Agent, Event, Tenant  # noqa: E402
+from api import payloads  # noqa: E402
+from api.bulk import insert_event_rows, prepare_event_rows  # noqa: E402
+from api.rules import DETECTION_COLUMNS  # noqa: E402
+
+
+def make_items(n: int) -> list:
+    base = datetime(2025, 9, 21, 12, 0, 0)
+    out = []
+    for i in range(n):
+        ip = f"203.0.113.{i % 250}"
+        out.append({
+            "ts": (base + timedelta(seconds=i)).isoformat(),
+            "host": f"h{i % 20}",
+            "app": "sshd" if i % 4 else "sudo",
+            "event_type": "auth_failed" if i % 3 else "login",
+            "src_ip": ip,
+            "username": "root",
+            "severity": "high",
+            "raw": {
+                "message": f"Sep 21 12:{i % 60:02d}:{i % 60:02d} h{i % 20} sshd[{2000 + i % 5000}]: Failed password for root from {ip} port {1000 + i} ssh2",
+                "pid": 2000 + i % 5000,
+                "facility": "auth",
+                "program": "sshd",
+            },
+        })
+    return out
+
+
+def build(path: str, mode: str, items: list, batch: int) -> dict:
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+    payloads.EVENT_PAYLOAD_STORE = mode
+    with Session() as db:
+        db.add(Tenant(id="bench", name="bench", plan="starter", ingest_token="bench", status="active"))
+        db.add(Agent(id="AG-B", tenant_id="bench"))
+        db.commit()
+        t0 = time.perf_counter()
+        for i in range(0, len(items), batch):
+            rows, _ = prepare_event_rows("bench", "AG-B", items[i:i + batch])
+            insert_event_rows(db, rows)
+            db.commit()
+        insert = time.perf_counter() - t0
+        stats = payloads.payload_stats(db)
+    engine.dispose()
+    return {"engine": create_engine(f"sqlite:///{path}", future=True), "insert": insert, "stats": stats}
+
+
+def scan(engine, with_raw: bool) -> int:
+    Session = sessionmaker(bind=engine, future=True)
+    with Session() as db:
+        rows = db.execute(select(*DETECTION_COLUMNS).where(Event.tenant_id == "bench")).mappings()
+        if with_raw:
+            payloads.block_cache._data.clear()
+            rows = payloads.attach_payloads(db, rows)
+        n = 0
+        for r in rows:
+            n += r["raw_json"] is not None if with_raw else 1
+        return n
+
+
+def best_of(rounds: int, fn) -> float:
+    best = None
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=50000)
+    ap.add_argument("--batch", type=int, default=500)
+    ap.add_argument("--rounds", type=int, default=3)
+    args = ap.parse_args()
+    items = make_items(args.events)
+    print(f"{args.events} eventos em lotes de {args.batch}, codec {payloads.default_codec()}, melhor de {args.rounds}")
+    print(f"  {'modo':<11s} {'banco MB':>9s} {'insert ev/s':>12s} {'scan ev/s':>12s} {'scan+raw ev/s':>14s}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("inline", "compressed"):
+            path = os.path.join(tmp, f"{mode}.db")
+            res = build(path, mode, items, args.batch)
+            size = os.path.getsize(path) / 1e6
+            meta = best_of(args.rounds, lambda: scan(res["engine"], False))
+            full = best_of(args.rounds, lambda: scan(res["engine"], True))
+            print(f"  {mode:<11s} {size:9.2f} {args.events / res['insert']:12.0f} {args.events / meta:12.0f} {args.events / full:14.0f}")
+            if mode == "compressed":
+                print(f"  taxa de compressão dos payloads: {res['stats']['ratio']}x")
+            res["engine"].dispose()
+
+
+if __name__ == "__main__":
+    main()
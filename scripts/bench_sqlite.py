@@ -0,0 +1,161 @@
+"""Benchmark de ingest sustentada no SQLite: modo padrão vs SQLITE_OPTIMIZED.
+
+Vários produtores (simulando requests/workers de ingest) gravam lotes enquanto
+leitores consultam a janela de detecção, durante `--seconds`:
+
+  padrão     journal de rollback, cada produtor faz insert + commit na sua sessão
+  otimizado  WAL + pragmas, produtores enfileiram no EventInsertWriter (INSERTs
+             serializados numa thread, transações agrupadas), leitores num pool query_only
+
+Reporta eventos/s gravados, erros "database is locked" e consultas/s dos leitores.
+
+Uso:
+  PYTHONPATH=. python scripts/bench_sqlite.py [--seconds 10] [--producers 8] [--batch 200] [--readers 2]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from api.database import Base, tune_sqlite_engine  # noqa: E402
+from api.models import Agent, Event, Tenant  # noqa: E402
+from api.bulk import insert_event_rows, prepare_event_rows  # noqa: E402
+from api.writer import EventInsertWriter  # noqa: E402
+
+TENANTS = ["bench-a", "bench-b", "bench-c", "bench-d"]
+
+
+def make_items(n: int, offset: int) -> list:
+    now = datetime.utcnow()
+    return [{
+        "ts": (now - timedelta(seconds=i % 600)).isoformat(),
+        "host": f"h{i % 20}",
+        "app": "sshd",
+        "event_type": "auth_failed" if i % 3 else "login",
+        "src_ip": f"203.0.113.{(offset + i) % 250}",
+        "username": "root",
+        "severity": "high",
+        "raw": {"message": f"Failed password for root from 203.0.113.{(offset + i) % 250} port {1000 + i}"},
+    } for i in range(n)]
+
+
+def setup(path: str, optimized: bool):
+    engine = create_engine(f"sqlite:///{path}", future=True, connect_args={"check_same_thread": False, "timeout": 5},
+                           pool_size=16, max_overflow=16)
+    if optimized:
+        tune_sqlite_engine(engine)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+    with Session() as db:
+        for tid in TENANTS:
+            db.add(Tenant(id=tid, name=tid, plan="starter", ingest_token=tid, status="active"))
+            db.add(Agent(id=f"AG-{tid}", tenant_id=tid))
+        db.commit()
+    read_engine = engine
+    if optimized:
+        read_engine = create_engine(f"sqlite:///{path}", future=True, connect_args={"check_same_thread": False},
+                                    pool_size=8, max_overflow=0)
+        tune_sqlite_engine(read_engine, read_only=True)
+    return engine, Session, sessionmaker(bind=read_engine, future=True), read_engine
+
+
+def write_batch(db, jobs):
+    for job in jobs:
+        with db.begin_nested():
+            rows, _ = prepare_event_rows(job.tenant_id, job.agent_id, job.items)
+            insert_event_rows(db, rows)
+    db.commit()
+    return []
+
+
+def run(path: str, optimized: bool, seconds: float, producers: int, batch: int, readers: int) -> dict:
+    engine, Session, ReadSession, read_engine = setup(path, optimized)
+    writer = EventInsertWriter(write_batch, session_factory=Session, enabled=True) if optimized else None
+    stop = threading.Event()
+    lock = threading.Lock()
+    res = {"submitted": 0, "locked": 0, "queries": 0, "read_locked": 0}
+
+    def producer(i):
+        tid = TENANTS[i % len(TENANTS)]
+        n = 0
+        while not stop.is_set():
+            items = make_items(batch, n)
+            n += batch
+            if writer is not None:
+                if not writer.submit(tid, f"AG-{tid}", items, block=True, timeout=1):
+                    continue
+            else:
+                try:
+                    with Session() as db:
+                        write_batch(db, [type("J", (), {"tenant_id": tid, "agent_id": f"AG-{tid}", "items": items})])
+                except OperationalError:
+                    with lock:
+                        res["locked"] += 1
+                    continue
+            with lock:
+                res["submitted"] += len(items)
+
+    def reader(i):
+        tid = TENANTS[i % len(TENANTS)]
+        while not stop.is_set():
+            try:
+                with ReadSession() as db:
+                    since = datetime.utcnow() - timedelta(minutes=5)
+                    db.execute(select(Event.src_ip, func.count()).where(Event.tenant_id == tid, Event.ts >= since)
+                               .group_by(Event.src_ip)).all()
+                with lock:
+                    res["queries"] += 1
+            except OperationalError:
+                with lock:
+                    res["read_locked"] += 1
+
+    threads = [threading.Thread(target=producer, args=(i,)) for i in range(producers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    if writer is not None:
+        writer.drain(60)
+        writer.stop()
+    elapsed = time.perf_counter() - t0
+    with Session() as db:
+        stored = db.scalar(select(func.count()).select_from(Event))
+    if writer is not None:
+        res["transactions"] = writer.stats()["transactions"]
+    engine.dispose()
+    read_engine.dispose()
+    res.update(stored=stored, elapsed=elapsed)
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--producers", type=int, default=8)
+    ap.add_argument("--batch", type=int, default=200)
+    ap.add_argument("--readers", type=int, default=2)
+    args = ap.parse_args()
+    print(f"{args.producers} produtores x lotes de {args.batch}, {args.readers} leitores, {args.seconds:.0f}s")
+    print(f"  {'modo':<10s} {'eventos/s':>10s} {'gravados':>10s} {'locked':>7s} {'consultas/s':>12s} {'transações':>11s}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, optimized in (("padrão", False), ("otimizado", True)):
+            r = run(os.path.join(tmp, f"{label}.db"), optimized, args.seconds, args.producers, args.batch, args.readers)
+            print(f"  {label:<10s} {r['stored'] / r['elapsed']:10.0f} {r['stored']:10d} {r['locked'] + r['read_locked']:7d} "
+                  f"{r['queries'] / r['elapsed']:12.1f} {r.get('transactions', '-'):>11}")
+
+
+if __name__ == "__main__":
+    main()
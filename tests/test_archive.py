@@ -0,0 +1,82 @@
+import os
+import uuid
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from api.database import init_db, SessionLocal
+from api.models import Tenant, Event
+from api.bulk import prepare_event_rows, insert_event_rows
+from api import archive, main
+
+
+def setup_module():
+    init_db()
+
+
+def _seed(db, tid, now):
+    db.add(Tenant(id=tid, name=tid, plan='starter', ingest_token=f"tok-{tid}", status='active'))
+    db.flush()
+    items = []
+    for days in (1, 10, 11, 12):
+        for i in range(30):
+            items.append({"ts": (now - timedelta(days=days, minutes=i)).isoformat(), "host": f"h{i % 3}",
+                          "event_type": "auth_failed" if i % 2 else "login", "src_ip": f"198.51.100.{i % 5}",
+                          "raw": {"message": f"m{days}-{i}"}})
+    rows, _ = prepare_event_rows(tid, 'AG-23', items)
+    insert_event_rows(db, rows)
+    db.commit()
+
+
+def test_archive_moves_old_days_and_queries_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "EVENTS_ARCHIVE_DIR", str(tmp_path))
+    tid = f"t23-{uuid.uuid4().hex[:8]}"
+    now = datetime.utcnow().replace(hour=12)
+    with SessionLocal() as db:
+        _seed(db, tid, now)
+        res = archive.run_archiver(db, after_days=7, now=now, tenant_ids=[tid])
+        left = db.execute(select(func.count()).select_from(Event).where(Event.tenant_id == tid)).scalar()
+        assert res["segments"] == 3 and res["rows"] == 90 and left == 30
+        assert archive.run_archiver(db, after_days=7, now=now, tenant_ids=[tid])["rows"] == 0
+    paths = archive.segment_paths(tid)
+    assert len(paths) == 3 and all(p.endswith(".seg") for p in paths)
+
+    counts = archive.query(tid, group_by="src_ip")["counts"]
+    assert sum(counts.values()) == 90 and counts["198.51.100.0"] == 18
+    res = archive.query(tid, filters={"host": "h1", "event_type": "auth_failed"}, limit=5)
+    assert len(res["items"]) == 5 and all(r["host"] == "h1" and r["event_type"] == "auth_failed" for r in res["items"])
+    assert [r["ts"] for r in res["items"]] == sorted((r["ts"] for r in res["items"]), reverse=True)
+    assert archive.query(tid, filters={"host": "nope"})["items"] == []
+    day11 = (now - timedelta(days=11)).replace(hour=0, minute=0, second=0, microsecond=0)
+    assert sum(archive.query(tid, since=day11, until=day11 + timedelta(days=1), group_by="host")["counts"].values()) == 30
+    with archive.Segment(paths[0]) as seg:
+        assert {r["message"] for r in seg.raw()} == {f"m12-{i}" for i in range(30)}
+
+    # busca une eventos recentes (banco) e arquivados
+    c = TestClient(main.app)
+    r = c.get("/v1/events/search", params={"src_ip": "198.51.100.0", "group_by": "host"}, headers={"Authorization": f"Bearer tok-{tid}"})
+    assert r.status_code == 200 and sum(r.json()["counts"].values()) == 24
+    r = c.get("/v1/events/search", params={"limit": 40}, headers={"Authorization": f"Bearer tok-{tid}"})
+    items = r.json()["items"]
+    assert len(items) == 40 and [i["archived"] for i in items] == [False] * 30 + [True] * 10
+    # payload original do evento arquivado continua acessível
+    r = c.get(f"/v1/events/{items[-1]['id']}/raw", headers={"Authorization": f"Bearer tok-{tid}"})
+    assert r.status_code == 200 and r.json()["archived"] and r.json()["raw"]["message"].startswith("m10-")
+    assert c.get("/v1/events/999999999/raw", headers={"Authorization": f"Bearer tok-{tid}"}).status_code == 404
+    assert c.get("/v1/events/search", params={"limit": "abc"}, headers={"Authorization": f"Bearer tok-{tid}"}).status_code == 400
+
+
+def test_archive_day_skips_rows_already_in_a_segment(tmp_path):
+    tid = f"t23-{uuid.uuid4().hex[:8]}"
+    now = datetime.utcnow().replace(hour=12)
+    with SessionLocal() as db:
+        _seed(db, tid, now)
+        day = (now - timedelta(days=10)).date()
+        lo = datetime.combine(day, datetime.min.time())
+        rows = db.execute(select(Event.id, Event.ts).where(Event.tenant_id == tid, Event.ts >= lo, Event.ts < lo + timedelta(days=1))).mappings().all()
+        # segmento gravado, mas o DELETE não aconteceu (falha no meio)
+        archive.write_segment(os.path.join(str(tmp_path), tid, f"{day.isoformat()}.seg"), [dict(r) for r in rows[:10]])
+        res = archive.archive_day(db, tid, day, base=str(tmp_path))
+    assert res["rows"] == 20
+    paths = archive.segment_paths(tid, base=str(tmp_path))
+    assert len(paths) == 2
+    assert archive._archived_ids(paths) == {r["id"] for r in rows}
@@ -0,0 +1,62 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+from api import database, main
+from api.database import init_db, SessionLocal
+from api.models import Tenant
+from api.security import get_read_db
+
+
+def setup_module():
+    init_db()
+    with SessionLocal() as db:
+        if not db.get(Tenant, 'tdb'):
+            db.add(Tenant(id='tdb', name='TDB', plan='starter', ingest_token='tok-tdb', status='active'))
+            db.commit()
+
+
+def test_pool_settings_and_pgbouncer_mode(monkeypatch):
+    kw = database._engine_kwargs("postgresql+psycopg://u@h/db", "t-pg")
+    assert issubclass(kw["poolclass"], QueuePool)
+    assert kw["pool_size"] == database.DB_POOL_SIZE and kw["pool_recycle"] == database.DB_POOL_RECYCLE
+    monkeypatch.setattr(database, "DB_PGBOUNCER", True)
+    kw = database._engine_kwargs("postgresql+psycopg://u@h/db", "t-pg")
+    assert issubclass(kw["poolclass"], NullPool) and "pool_size" not in kw
+    assert kw["connect_args"] == {"prepare_threshold": None}
+    kw = database._engine_kwargs("postgresql+asyncpg://u@h/db", "t-pg", is_async=True)
+    assert kw["connect_args"]["statement_cache_size"] == 0
+
+
+def test_pool_wait_and_timeouts(tmp_path):
+    stats = database.PoolStats("t-small")
+    eng = create_engine(f"sqlite:///{tmp_path}/p.db", poolclass=database._timed_pool(QueuePool, stats),
+                        pool_size=1, max_overflow=0, pool_timeout=0.05)
+    conn = eng.connect()
+    with pytest.raises(PoolTimeoutError):
+        eng.connect()
+    conn.close()
+    eng.dispose()
+    with eng.connect() as c:
+        c.execute(text("select 1"))
+    snap = stats.snapshot(eng.pool)
+    assert snap["checkouts"] == 2 and snap["timeouts"] == 1 and snap["connects"] == 2
+    assert snap["wait_ms_max"] >= 50 and snap["size"] == 1
+    eng.dispose()
+
+
+def test_read_routes_use_read_session(monkeypatch):
+    db = next(get_read_db())
+    assert db.get_bind() is database.read_engine
+    db.close()
+    monkeypatch.setenv("API_SECRET", "s3")
+    client = TestClient(main.app)
+    before = database.pool_stats["primary_async"].checkouts
+    r = client.get("/v1/incidents", headers={"Authorization": "Bearer tok-tdb"})
+    assert r.status_code == 200
+    r = client.get("/v1/assets", headers={"Authorization": "Bearer tok-tdb"})
+    assert r.status_code == 200
+    m = client.get("/admin/db/pool", headers={"X-API-Secret": "s3"}).json()
+    assert m["read_replica"] is False
+    assert m["primary_async"]["checkouts"] > before and m["primary"]["checkouts"] > 0
@@ -0,0 +1,212 @@
+import uuid
+import pytest
+from datetime import datetime, timedelta
+from api.database import init_db, SessionLocal
+from sqlalchemy import select
+from api.models import Tenant, Event
+from api.bulk import prepare_event_rows, insert_event_rows
+from api.detection import SlidingWindowDetector
+from api.rules import DETECTION_COLUMNS
+from api.payloads import attach_payloads
+from api import ruleset
+from api.ruleset import ruleset_for_tenant, load_rule_specs, RuleError
+
+
+def setup_module():
+    init_db()
+
+
+def _tenant():
+    # tenant novo por teste: a janela é carregada do banco e não deve ver execuções anteriores
+    tid = f"t6-{uuid.uuid4().hex[:8]}"
+    with SessionLocal() as db:
+        db.add(Tenant(id=tid, name=tid, plan='starter', ingest_token=f"tok-{tid}", status='active'))
+        db.commit()
+    return tid
+
+
+def _store(db, tenant_id, items):
+    rows, _ = prepare_event_rows(tenant_id, 'AG-6', items)
+    insert_event_rows(db, rows)
+    db.commit()
+    return rows
+
+
+def _by_kind(hits):
+    return {(h.rule.kind, h.key): (h.count, h.emissions) for h in hits}
+
+
+def test_incremental_detector_matches_window_thresholds():
+    tenant = _tenant()
+    now = datetime.utcnow()
+    ts = now.isoformat()
+    fail = {"ts": ts, "host": "h6", "event_type": "auth_failed", "src_ip": "203.0.113.66", "username": "root"}
+    d = SlidingWindowDetector()
+    with SessionLocal() as db:
+        rs = ruleset_for_tenant(db, tenant)
+        old = {**fail, "ts": (now - timedelta(hours=2)).isoformat()}
+        rows = _store(db, tenant, [fail] * 3 + [old] * 5)
+        assert d.observe(db, tenant, rows, rs, now=now) == []
+        rows = _store(db, tenant, [fail] * 3 + [
+            {"ts": ts, "host": "h6", "event_type": "sudoers_changed"},
+            {"ts": ts, "host": "h6", "app": "shell", "raw": {"message": "powershell -enc AAAA"}},
+        ])
+        hits = d.observe(db, tenant, rows, rs, now=now)
+        # a varredura completa chega às mesmas decisões para a janela
+        full = rs.scan(attach_payloads(db, db.execute(select(*DETECTION_COLUMNS).where(Event.tenant_id == tenant)).mappings()), now=now)
+    assert _by_kind(hits) == {
+        ("brute_force", ("203.0.113.66", "root")): (6, 1),
+        ("suspicious_execution", ()): (1, 1),
+        ("critical_change", ("h6", "sudoers_changed")): (1, 1),
+    }
+    assert _by_kind(full) == _by_kind(hits)
+    snap = d.snapshot(tenant, rs)
+    assert snap["event_types"]["auth_failed"] == 6 and snap["hosts"]["h6"] == 8
+    assert snap["rules"]["brute_force"] == {"203.0.113.66|root": 6}
+    # fora da janela, os buckets são descartados e os totais voltam a zero
+    with SessionLocal() as db:
+        assert d.observe(db, tenant, [], rs, now=now + timedelta(minutes=31)) == []
+    assert d.snapshot(tenant)["buckets"] == 0
+
+
+def test_rule_dsl_tenant_overrides_and_reload():
+    tenant = _tenant()
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        t = db.get(Tenant, tenant)
+        t.integrations_json = {"rules": [
+            {"id": "brute_force", "threshold": 2},
+            {"id": "suspicious_execution", "enabled": False},
+            {"id": "rdp_admin", "kind": "rdp_admin_login", "severity": "low", "group_by": ["host"],
+             "match": {"event_type": "login_success", "username": {"in": ["administrator"]}, "message": {"contains": "rdp"}}},
+        ]}
+        db.commit()
+        rs = ruleset_for_tenant(db, tenant)
+        assert [r.id for r in rs.rules] == ["brute_force", "critical_change", "rdp_admin"]
+        events = [
+            {"ts": now, "event_type": "auth_failed", "src_ip": "198.51.100.7"},
+            {"ts": now, "event_type": "auth_failed", "src_ip": "198.51.100.7"},
+            {"ts": now, "host": "w1", "event_type": "login_success", "username": "administrator", "raw_json": {"message": "RDP logon"}},
+            {"ts": now, "host": "w2", "event_type": "login_success", "username": "bob", "raw_json": {"message": "RDP logon"}},
+            {"ts": now, "app": "powershell", "event_type": "process"},
+        ]
+        assert _by_kind(rs.scan(events, now=now)) == {
+            ("brute_force", ("198.51.100.7", "?")): (2, 1),
+            ("rdp_admin_login", ("w1",)): (1, 1),
+        }
+        # mudança nas regras do tenant vale na próxima avaliação, sem reiniciar
+        t.integrations_json = {}
+        db.commit()
+        rs2 = ruleset_for_tenant(db, tenant)
+    assert rs2.version != rs.version and [r.id for r in rs2.rules] == ["brute_force", "suspicious_execution", "critical_change"]
+    # event_type vira índice; só src_ip fica como predicado
+    assert rs.rules[0].event_types == {"auth_failed", "ssh_auth_failed", "rdp_auth_failed"} and len(rs.rules[0].predicates) == 1
+
+
+def test_indicator_matcher_single_pass():
+    from api.indicators import IndicatorMatcher, matcher_for_tenant
+    m = IndicatorMatcher(["certutil", "cert", "mshta", "PowerShell", ""])
+    assert m.indicators == ("cert", "certutil", "mshta", "powershell")
+    assert m.search("C:\\> CertUtil -urlcache") in ("cert", "certutil")
+    assert m.match_event({"message": "run MSHTA.exe"}, None, None) == "mshta"
+    assert m.match_event({"message": "power"}, "shell", "x") is None  # não casa entre campos
+    assert m.match_event(None, "app", "login") is None
+    tenant = _tenant()
+    with SessionLocal() as db:
+        t = db.get(Tenant, tenant)
+        t.integrations_json = {"indicators": ["Regsvr32"]}
+        db.commit()
+        tm = matcher_for_tenant(db, tenant)
+    assert tm.match_event({"message": "regsvr32 /s x.dll"}, None, None) == "regsvr32"
+    assert tm.match_event({"message": "wmic process"}, None, None) == "wmic"
+
+
+def test_incidents_upserted_by_fingerprint():
+    from api.models import Incident
+    from api.rules import _apply_detections, incident_fingerprint
+    from api.ruleset import Hit
+    tenant = _tenant()
+    with SessionLocal() as db:
+        rules = {r.id: r for r in ruleset_for_tenant(db, tenant).rules}
+        brute1 = Hit(rules["brute_force"], ("203.0.113.1", "root"), 5, 1)
+        brute2 = Hit(rules["brute_force"], ("203.0.113.2", "admin"), 7, 1)
+        _apply_detections(db, tenant, [
+            brute1, brute2,
+            Hit(rules["suspicious_execution"], (), 1, 1),
+            Hit(rules["critical_change"], ("h1", "sudoers_changed"), 2, 2),
+        ])
+        payloads = _apply_detections(db, tenant, [brute1])
+        incs = db.execute(select(Incident).where(Incident.tenant_id == tenant)).scalars().all()
+    by_fp = {i.fingerprint: i for i in incs}
+    assert len(incs) == 4
+    assert payloads == [{"kind": "brute_force", "severity": "high", "context": {"src_ip": "203.0.113.1", "username": "root", "count": 5, "threshold": 5}}]
+    assert by_fp[incident_fingerprint("brute_force", "203.0.113.1", "root")].count == 2
+    assert by_fp[incident_fingerprint("brute_force", "203.0.113.2", "admin")].count == 1
+    assert by_fp[incident_fingerprint("critical_change", "h1", "sudoers_changed")].count == 2
+    assert by_fp[incident_fingerprint("suspicious_execution")].context_json == {"count": 1}
+
+
+def test_replay_uses_event_time_windows():
+    from api.models import Incident, ReplayIncident
+    from api.replay import ApplyConflict, replay_tenant
+    from api.rules import incident_fingerprint
+    tenant = _tenant()
+    base = datetime.utcnow() - timedelta(days=3)
+    burst = [{"ts": (base + timedelta(minutes=i)).isoformat(), "event_type": "ssh_auth_failed", "src_ip": "192.0.2.10", "username": "root"} for i in range(6)]
+    # mesmo volume espalhado em 3h não passa do limite em nenhuma janela de 30 min
+    sparse = [{"ts": (base + timedelta(minutes=40 * i)).isoformat(), "event_type": "ssh_auth_failed", "src_ip": "192.0.2.11", "username": "root"} for i in range(6)]
+    late = [{"ts": (base + timedelta(hours=2, minutes=i)).isoformat(), "event_type": "ssh_auth_failed", "src_ip": "192.0.2.10", "username": "root"} for i in range(5)]
+    progress = []
+    with SessionLocal() as db:
+        _store(db, tenant, burst + sparse + late)
+        stats = replay_tenant(db, tenant, base - timedelta(hours=1), base + timedelta(hours=4), chunk=4, progress=progress.append)
+        found = db.execute(
+            select(ReplayIncident.fingerprint, ReplayIncident.count, ReplayIncident.first_seen).where(ReplayIncident.run_id == stats["run_id"])
+        ).all()
+        assert db.execute(select(Incident).where(Incident.tenant_id == tenant)).first() is None
+        replay_tenant(db, tenant, base - timedelta(hours=1), mode="apply")
+        inc = db.execute(select(Incident).where(Incident.tenant_id == tenant)).scalars().one()
+    assert stats["events"] == 17 and stats["chunks"] == 5 and len(progress) == 5
+    assert [(fp, n) for fp, n, _ in found] == [(incident_fingerprint("brute_force", "192.0.2.10", "root"), 2)]
+    assert found[0][2].replace(tzinfo=None) == base + timedelta(minutes=4)
+    assert inc.count == 2 and inc.last_seen.replace(tzinfo=None) == base + timedelta(hours=2, minutes=4)
+    # mesmo intervalo de novo: recusado; com force, soma
+    with SessionLocal() as db:
+        with pytest.raises(ApplyConflict):
+            replay_tenant(db, tenant, base - timedelta(hours=1), mode="apply")
+        db.rollback()
+        assert db.execute(select(Incident.count).where(Incident.tenant_id == tenant)).scalar() == 2
+        replay_tenant(db, tenant, base - timedelta(hours=1), mode="apply", force=True)
+        assert db.execute(select(Incident.count).where(Incident.tenant_id == tenant)).scalar() == 4
+        # intervalo depois dos incidentes existentes: sem conflito
+        replay_tenant(db, tenant, base + timedelta(hours=3), mode="apply")
+
+
+def test_batch_committed_before_another_batch_seeds_is_not_counted_twice():
+    # A grava, B grava e é observado primeiro (a carga inicial já inclui A); depois A é observado
+    tenant = _tenant()
+    now = datetime.utcnow()
+    fail = {"ts": now.isoformat(), "host": "h6", "event_type": "auth_failed", "src_ip": "203.0.113.67", "username": "root"}
+    d = SlidingWindowDetector()
+    with SessionLocal() as db:
+        rs = ruleset_for_tenant(db, tenant)
+        a = _store(db, tenant, [fail] * 3)
+        b = _store(db, tenant, [fail] * 2)
+        assert all(r.get("id") for r in a + b)
+        d.observe(db, tenant, b, rs, now=now)
+        hits = d.observe(db, tenant, a, rs, now=now)
+    assert d.snapshot(tenant, rs)["rules"]["brute_force"] == {"203.0.113.67|root": 5}
+    assert _by_kind(hits) == {("brute_force", ("203.0.113.67", "root")): (5, 1)}
+
+
+def test_missing_rules_file_is_an_error_unless_optional(tmp_path, monkeypatch):
+    missing = str(tmp_path / "detections-typo.yaml")
+    with pytest.raises(RuleError):
+        load_rule_specs(missing)
+    monkeypatch.setattr(ruleset, "RULES_FILE", missing)
+    with pytest.raises(RuleError):
+        load_rule_specs()
+    # override opcional: cai nas regras padrão
+    monkeypatch.setattr(ruleset, "RULES_FILE_OPTIONAL", True)
+    specs = load_rule_specs()
+    assert specs and specs == load_rule_specs(ruleset.DEFAULT_RULES_FILE)
@@ -0,0 +1,298 @@
+import gzip
+import json
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select, func
+from api.database import init_db, SessionLocal
+from api.models import Tenant, Event, EventRollup, IngestBatch
+from api.bulk import bulk_insert_events
+from api.payloads import load_payloads
+from api import main, ratelimit
+from api.coalescer import IngestCoalescer
+from api.workers import IngestWorkerPool
+from api.decoding import decode_ingest_batch
+from api.idempotency import claim_batch, release_batch, recent_batches, prune_ingest_batches
+
+
+def setup_module():
+    init_db()
+    with SessionLocal() as db:
+        if not db.query(Tenant).filter_by(id='t4').first():
+            db.add(Tenant(id='t4', name='T4', plan='starter', ingest_token='tok-t4', status='active'))
+            db.commit()
+
+
+def auth():
+    return {"Authorization": "Bearer tok-t4"}
+
+
+def test_bulk_insert_events_persists_batch_and_collects_ips():
+    agent = f"AG-{uuid.uuid4().hex[:8]}"
+    items = [{"ts":"2025-09-21T12:34:56Z","host":"h4","event_type":"auth_failed","src_ip":f"198.51.100.{i % 3}","raw":{"message":"x"}} for i in range(10)]
+    items.append({"ts":None,"host":"h4","event_type":"login"})
+    with SessionLocal() as db:
+        ips = bulk_insert_events(db, 't4', agent, items)
+        db.commit()
+        n = db.execute(select(func.count()).select_from(Event).where(Event.agent_id == agent)).scalar()
+        eid, inline = db.execute(select(Event.id, Event.raw_json).where(Event.agent_id == agent, Event.src_ip.is_not(None))).first()
+        raw = load_payloads(db, 't4', [eid])[eid]
+    assert n == 11
+    assert ips == {"198.51.100.0", "198.51.100.1", "198.51.100.2"}
+    # payload fica no bloco comprimido, não na linha do evento
+    assert inline is None and raw == {"message": "x"}
+
+
+def _ndjson(events):
+    return ("\n".join(json.dumps(e) for e in events) + "\n").encode("utf-8")
+
+
+def test_ingest_stream_gzip_ndjson_in_chunks(monkeypatch):
+    monkeypatch.setattr(main, "STREAM_CHUNK_EVENTS", 7)
+    c = TestClient(main.app)
+    agent = f"AG-{uuid.uuid4().hex[:8]}"
+    batch = uuid.uuid4().hex
+    events = [{"ts":"2025-09-21T12:34:56Z","host":"h4","event_type":"login","src_ip":"192.0.2.1"} for _ in range(25)]
+    body = gzip.compress(_ndjson(events))
+    url = f"/v1/ingest/stream?agent_id={agent}&batch_id={batch}"
+    r = c.post(url, content=body, headers={**auth(), "Content-Encoding": "gzip", "Content-Type": "application/x-ndjson"})
+    assert r.status_code == 200
+    assert r.json() == {"status": "accepted", "accepted": 25}
+    with SessionLocal() as db:
+        n = db.execute(select(func.count()).select_from(Event).where(Event.agent_id == agent)).scalar()
+    assert n == 25
+    r = c.post(url, content=body, headers={**auth(), "Content-Encoding": "gzip"})
+    assert r.json()["status"] == "duplicate"
+
+
+def test_ingest_stream_post_processing_goes_through_ingest_pool(monkeypatch):
+    calls = []
+    pool = IngestWorkerPool(lambda *a: None, workers=1, queue_size=10)
+    monkeypatch.setattr(main, "ingest_pool", pool)
+    monkeypatch.setattr(main, "_post_process", lambda db, tenant_id, ips, rows=None: calls.append((tenant_id, ips)))
+    c = TestClient(main.app)
+    agent = f"AG-{uuid.uuid4().hex[:8]}"
+    body = _ndjson([{"ts": "2025-09-21T12:34:56Z", "src_ip": "192.0.2.33"}])
+    r = c.post(f"/v1/ingest/stream?agent_id={agent}&batch_id={uuid.uuid4().hex}", content=body, headers=auth())
+    assert r.json()["status"] == "accepted"
+    pool.stop()
+    assert calls == [('t4', {"192.0.2.33"})]
+    assert pool.stats()["processed_jobs"] == 1
+
+
+def test_ingest_stream_rejects_bad_line_without_persisting():
+    c = TestClient(main.app)
+    agent = f"AG-{uuid.uuid4().hex[:8]}"
+    body = _ndjson([{"ts":"2025-09-21T12:34:56Z"}]) + b'{"host":"no-ts"}\n'
+    r = c.post(f"/v1/ingest/stream?agent_id={agent}&batch_id=b-bad", content=body, headers=auth())
+    assert r.status_code == 400
+    assert "line 2" in r.json()["detail"]
+    with SessionLocal() as db:
+        n = db.execute(select(func.count()).select_from(Event).where(Event.agent_id == agent)).scalar()
+    assert n == 0
+
+
+def test_ingest_stream_commits_per_chunk_and_undoes_them_on_bad_line(monkeypatch):
+    monkeypatch.setattr(main, "STREAM_CHUNK_EVENTS", 2)
+    c = TestClient(main.app)
+    agent = f"AG-{uuid.uuid4().hex[:8]}"
+    batch = uuid.uuid4().hex
+    good = [{"ts": "2025-09-22T08:00:00Z", "host": "h5", "event_type": "t-stream", "raw": {"message": "x"}} for _ in range(5)]
+    url = f"/v1/ingest/stream?agent_id={agent}&batch_id={batch}"
+
+    def rollup():
+        with SessionLocal() as db:
+            return db.execute(select(func.coalesce(func.sum(EventRollup.count), 0)).where(
+                EventRollup.tenant_id == 't4', EventRollup.event_type == 't-stream')).scalar()
+
+    before = rollup()
+    # dois blocos commitados antes da linha inválida: são desfeitos junto com o claim
+    r = c.post(url, content=_ndjson(good) + b'{"host":"no-ts"}\n', headers=auth())
+    assert r.status_code == 400 and "line 6" in r.json()["detail"]
+    with SessionLocal() as db:
+        assert db.execute(select(func.count()).select_from(Event).where(Event.agent_id == agent)).scalar() == 0
+        assert db.query(IngestBatch).filter_by(tenant_id='t4', agent_id=agent, batch_id=batch).count() == 0
+    assert rollup() == before
+    # o retry com o mesmo batch_id entra inteiro
+    r = c.post(url, content=_ndjson(good), headers=auth())
+    assert r.json() == {"status": "accepted", "accepted": 5}
+    assert rollup() == before + 5
+
+
+def test_coalescer_flushes_tenant_batches_together():
+    flushed = []
+    co = IngestCoalescer(lambda tenant_id, entries: flushed.append((tenant_id, list(entries))), window_ms=100, max_events=1000)
+    assert co.submit('t4', 'AG-C', 'b1', [{"ts": "2025-09-21T12:34:56Z"}])
+    assert co.submit('t4', 'AG-C', 'b2', [{"ts": "2025-09-21T12:34:56Z"}] * 2)
+    assert not co.submit('t4', 'AG-C', 'b1', [])
+    assert co.stats()["queue_events"] == 3
+    co.stop()
+    assert len(flushed) == 1
+    tenant_id, entries = flushed[0]
+    assert tenant_id == 't4' and [b for _, b, _ in entries] == ['b1', 'b2']
+    s = co.stats()
+    assert s["flushes"] == 1 and s["flushed_events"] == 3 and s["queue_events"] == 0
+    assert not co.is_pending('t4', 'AG-C', 'b1')
+
+
+def test_coalescer_retries_failed_flush_once():
+    calls = []
+
+    def flush(tenant_id, entries):
+        calls.append([b for _, b, _ in entries])
+        if len(calls) == 1:
+            # chega outro lote do tenant enquanto o primeiro flush falha
+            co.submit('t4', 'AG-C', 'r2', [{"ts": "2025-09-21T12:34:56Z"}] * 2)
+        if len(calls) < 3:
+            raise RuntimeError("db down")
+
+    co = IngestCoalescer(flush, window_ms=60000, max_events=1000)
+    co.submit('t4', 'AG-C', 'r1', [{"ts": "2025-09-21T12:34:56Z"}])
+    co.stop()
+    # r1 volta na frente do buffer, falha de novo e é descartado; r2 passa na sua retentativa
+    assert calls == [['r1'], ['r1', 'r2'], ['r2']]
+    s = co.stats()
+    assert s["errors"] == 2 and s["retried_batches"] == 2 and s["dropped_batches"] == 1 and s["dropped_events"] == 1
+    assert s["flushed_batches"] == 1 and s["flushed_events"] == 2 and s["queue_events"] == 0
+    assert not co.is_pending('t4', 'AG-C', 'r1') and not co.is_pending('t4', 'AG-C', 'r2')
+
+
+def test_claim_batch_rejects_duplicates_from_memory_and_db():
+    batch = uuid.uuid4().hex
+    with SessionLocal() as db:
+        assert claim_batch(db, 't4', 'AG-I', batch)
+        db.commit()
+        before = recent_batches.snapshot()
+        assert not claim_batch(db, 't4', 'AG-I', batch)
+        assert recent_batches.snapshot()["memory_hits"] == before["memory_hits"] + 1
+        # sem a chave em memória, a uq_batch ainda recusa
+        release_batch('t4', 'AG-I', batch)
+        assert not claim_batch(db, 't4', 'AG-I', batch)
+        assert db.query(IngestBatch).filter_by(tenant_id='t4', batch_id=batch).count() == 1
+
+
+def test_prune_ingest_batches_removes_old_rows():
+    old, new = uuid.uuid4().hex, uuid.uuid4().hex
+    with SessionLocal() as db:
+        db.add(IngestBatch(tenant_id='t4', agent_id='AG-I', batch_id=old, created_at=datetime.utcnow() - timedelta(days=30)))
+        db.add(IngestBatch(tenant_id='t4', agent_id='AG-I', batch_id=new))
+        db.commit()
+        assert prune_ingest_batches(db, older_than_days=7) >= 1
+        left = {b for (b,) in db.query(IngestBatch.batch_id).filter(IngestBatch.batch_id.in_([old, new]))}
+    assert left == {new}
+
+
+def test_worker_pool_keeps_per_tenant_order_with_own_sessions():
+    seen = []
+    opened = []
+
+    def handler(db, tenant_id, agent_id, items):
+        seen.append((tenant_id, items[0]["seq"], db))
+
+    def session_factory():
+        db = SessionLocal()
+        opened.append(db)
+        return db
+
+    pool = IngestWorkerPool(handler, workers=3, queue_size=100, session_factory=session_factory)
+    for i in range(20):
+        assert pool.submit('t4' if i % 2 else 't5', 'AG-W', [{"seq": i}])
+    pool.stop()
+    for tenant in ('t4', 't5'):
+        seqs = [seq for t, seq, _ in seen if t == tenant]
+        assert seqs == sorted(seqs) and len(seqs) == 10
+    assert len(opened) == 20 and [db for _, _, db in seen if db not in opened] == []
+    s = pool.stats()
+    assert s["processed_jobs"] == 20 and s["pending_events"] == 0
+
+
+def test_worker_pool_acks_only_after_handler_finishes():
+    events = []
+
+    def handler(db, tenant_id, agent_id, items):
+        if items[0]["seq"] == 1:
+            raise RuntimeError("boom")
+        events.append(("written", items[0]["seq"]))
+
+    pool = IngestWorkerPool(handler, workers=1, queue_size=10)
+    for i in range(3):
+        assert pool.submit('t4', 'AG-W', [{"seq": i}], on_done=lambda ok, i=i: events.append(("ack", i, ok)))
+    pool.stop()
+    assert events == [("written", 0), ("ack", 0, True), ("ack", 1, False), ("written", 2), ("ack", 2, True)]
+
+
+def test_fast_decode_matches_model_decode():
+    body = json.dumps({"agent_id": "AG-F", "batch_id": "bf", "extra": 1, "events": [
+        {"ts": "2025-09-21T12:34:56Z", "host": "h", "src_ip": "192.0.2.9", "raw": {"message": "m"}},
+        {"ts": "2025-09-21T12:35:00Z", "event_type": "login", "username": None},
+    ]}).encode("utf-8")
+    slow = decode_ingest_batch(body, fast=False)
+    fast = decode_ingest_batch(body, fast=True)
+    assert fast[:2] == slow[:2] == ("AG-F", "bf")
+    fields = ("ts", "host", "app", "event_type", "src_ip", "dst_ip", "username", "severity", "raw")
+    assert [[e.get(f) for f in fields] for e in fast[2]] == [[e.get(f) for f in fields] for e in slow[2]]
+
+
+def test_fast_decode_rejects_what_model_rejects():
+    bad = [
+        {"agent_id": "a", "batch_id": "b", "events": [{"host": "missing-ts"}]},
+        {"agent_id": "a", "batch_id": "b", "events": [{"ts": 123}]},
+        {"agent_id": "a", "batch_id": "b", "events": [{"ts": "x", "src_ip": ["not", "a", "str"]}]},
+        {"agent_id": "a", "events": []},
+        {"agent_id": "a", "batch_id": "b", "events": {"ts": "x"}},
+    ]
+    for payload in bad:
+        body = json.dumps(payload).encode("utf-8")
+        for fast in (False, True):
+            with pytest.raises(ValueError):
+                decode_ingest_batch(body, fast=fast)
+
+
+def test_ingest_and_read_endpoints_on_async_sessions():
+    c = TestClient(main.app)
+    batch = {"agent_id": "AG-A", "batch_id": uuid.uuid4().hex, "events": [{"ts": "2025-09-21T12:34:56Z", "event_type": "login"}]}
+    body = gzip.compress(json.dumps(batch).encode("utf-8"))
+    headers = {**auth(), "Content-Encoding": "gzip", "Content-Type": "application/json"}
+    assert c.post('/v1/ingest', content=body, headers=headers).json() == {"status": "accepted", "accepted": 1}
+    assert c.post('/v1/ingest', content=body, headers=headers).json()["status"] == "duplicate"
+    r = c.get('/v1/score', headers=auth())
+    assert r.status_code == 200 and 0 <= r.json()["score"] <= 100
+    assert isinstance(c.get('/v1/incidents', headers=auth()).json()["items"], list)
+    assert c.get('/v1/incidents', headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+
+def test_ingest_retry_after_failed_claim_commit_is_accepted(monkeypatch):
+    from sqlalchemy.ext.asyncio import AsyncSession
+    real_commit = AsyncSession.commit
+    calls = []
+
+    async def failing_commit(self):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("commit failed")
+        return await real_commit(self)
+
+    monkeypatch.setattr(AsyncSession, "commit", failing_commit)
+    c = TestClient(main.app, raise_server_exceptions=False)
+    batch = {"agent_id": "AG-R", "batch_id": uuid.uuid4().hex, "events": [{"ts": "2025-09-21T12:34:56Z", "event_type": "login"}]}
+    assert c.post('/v1/ingest', json=batch, headers=auth()).status_code == 500
+    assert ('t4', 'AG-R', batch["batch_id"]) not in recent_batches
+    assert c.post('/v1/ingest', json=batch, headers=auth()).json() == {"status": "accepted", "accepted": 1}
+
+
+def test_ingest_backpressure_sheds_low_severity_first(monkeypatch):
+    c = TestClient(main.app)
+    limit = ratelimit.MAX_PENDING_PER_TENANT
+    monkeypatch.setattr(main, "_pending_ingest", lambda tenant_id: (int(limit * 0.9), 0))
+
+    def post(severity):
+        batch = {"agent_id": "AG-B", "batch_id": uuid.uuid4().hex, "events": [{"ts": "2025-09-21T12:34:56Z", "severity": severity}]}
+        return c.post('/v1/ingest', content=json.dumps(batch), headers=auth())
+
+    r = post("low")
+    assert r.status_code == 429 and int(r.headers["Retry-After"]) > 0
+    assert post("high").status_code == 200
+    monkeypatch.setattr(main, "_pending_ingest", lambda tenant_id: (0, ratelimit.MAX_PENDING_GLOBAL))
+    r = post("high")
+    assert r.status_code == 503 and "Retry-After" in r.headers
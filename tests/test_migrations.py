@@ -0,0 +1,37 @@
+import json
+import os
+from sqlalchemy import create_engine, text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_fingerprint_migration_merges_duplicate_incidents(tmp_path, monkeypatch):
+    # Dois incidentes antigos com o mesmo src_ip/username viram um só antes do índice único
+    from alembic import command
+    from alembic.config import Config
+
+    url = f"sqlite:///{tmp_path / 'migr.db'}"
+    monkeypatch.setenv("DATABASE_URL", url)
+    cfg = Config(os.path.join(ROOT, "alembic.ini"))
+    cfg.set_main_option("script_location", os.path.join(ROOT, "alembic"))
+    command.upgrade(cfg, "7bcf9c57e725")
+
+    eng = create_engine(url)
+    rows = [("2026-01-01 00:00:00", "2026-01-02 00:00:00", 3, "203.0.113.1", "medium"),
+            ("2025-12-01 00:00:00", "2026-01-01 00:00:00", 2, "203.0.113.1", "high"),
+            ("2026-02-01 00:00:00", "2026-02-02 00:00:00", 5, "203.0.113.2", "high")]
+    with eng.begin() as conn:
+        conn.execute(text("INSERT INTO tenants (id, name, plan, ingest_token, status) VALUES ('t11', 't11', 'starter', 'tok-t11', 'active')"))
+        for first, last, n, ip, sev in rows:
+            conn.execute(text("INSERT INTO incidents (tenant_id, kind, severity, first_seen, last_seen, count, context_json, status) "
+                              "VALUES ('t11', 'brute_force', :sev, :first, :last, :n, :ctx, 'open')"),
+                         {"sev": sev, "first": first, "last": last, "n": n,
+                          "ctx": json.dumps({"src_ip": ip, "username": "root"})})
+    command.upgrade(cfg, "a3f1c2d4e5b6")
+
+    with eng.connect() as conn:
+        got = conn.execute(text("SELECT id, severity, first_seen, last_seen, count FROM incidents ORDER BY id")).fetchall()
+    eng.dispose()
+    # fica a linha mais recente do grupo, com o período todo e a soma das contagens
+    assert [tuple(r) for r in got] == [(2, "high", "2025-12-01 00:00:00", "2026-01-02 00:00:00", 5),
+                                       (3, "high", "2026-02-01 00:00:00", "2026-02-02 00:00:00", 5)]
@@ -0,0 +1,114 @@
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from api.database import init_db, SessionLocal, DATABASE_URL
+from api.models import Tenant, Agent, Event, Plan
+from api.partitions import (run_maintenance, partition_start, partition_name, is_partitioned, list_partitions,
+                            ensure_partitions, drop_expired_partitions)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_module():
+    init_db()
+
+
+def _tenant(db, plan):
+    tid = f"t20-{uuid.uuid4().hex[:8]}"
+    db.add(Tenant(id=tid, name=tid, plan=plan, ingest_token=f"tok-{tid}", status='active'))
+    db.flush()
+    return tid
+
+
+def _events(db, tid, now, ages_days):
+    db.add_all(Event(tenant_id=tid, agent_id='AG-20', ts=now - timedelta(days=d), event_type='auth_failed') for d in ages_days)
+
+
+def test_retention_by_plan_without_partitions():
+    now = datetime.utcnow()
+    custom = f"custom-{uuid.uuid4().hex[:6]}"
+    with SessionLocal() as db:
+        db.add(Plan(name=custom, price=0, stripe_price_id=f"price_{custom}", features={"retention_days": 5}))
+        starter = _tenant(db, 'starter')
+        enterprise = _tenant(db, 'enterprise')
+        small = _tenant(db, custom)
+        for tid in (starter, enterprise, small):
+            _events(db, tid, now, [1, 10, 45, 400])
+        db.commit()
+
+        # só os tenants do teste: o banco é compartilhado com os demais testes
+        stats = run_maintenance(db, now, tenant_ids=[starter, enterprise, small])
+        assert stats["partitioned"] is False and stats["created_partitions"] == []
+
+        def left(tid):
+            return db.execute(select(func.count()).select_from(Event).where(Event.tenant_id == tid)).scalar()
+        # starter=30 dias, enterprise=365, plano com features.retention_days=5
+        assert (left(starter), left(enterprise), left(small)) == (2, 3, 1)
+
+
+def test_partition_bounds():
+    ts = datetime(2026, 10, 15, 13, 45, tzinfo=timezone(timedelta(hours=-3)))
+    assert partition_start(ts, "day") == datetime(2026, 10, 15, 0, 0, tzinfo=timezone.utc)
+    assert partition_start(ts, "week") == datetime(2026, 10, 12, 0, 0, tzinfo=timezone.utc)
+    assert partition_name(partition_start(ts, "week"), "week") == "events_w20261012"
+
+
+@pytest.mark.skipif(not DATABASE_URL.startswith("postgres"), reason="partições só existem no Postgres")
+def test_postgres_migration_partitions_default_move_and_drop(monkeypatch):
+    # Migrações num schema descartável: events particionada, DEFAULT, criação tardia e drop
+    from alembic import command
+    from alembic.config import Config
+
+    schema = f"t20_{uuid.uuid4().hex[:8]}"
+    url = make_url(DATABASE_URL)
+    admin = create_engine(url)
+    with admin.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+    scratch = url.update_query_dict({"options": f"-csearch_path={schema}"})
+    try:
+        monkeypatch.setenv("DATABASE_URL", scratch.render_as_string(hide_password=False))
+        cfg = Config(os.path.join(ROOT, "alembic.ini"))
+        cfg.set_main_option("script_location", os.path.join(ROOT, "alembic"))
+        command.upgrade(cfg, "head")
+
+        eng = create_engine(scratch)
+        with Session(eng) as db:
+            assert is_partitioned(db)
+            names = [n for n, _, _ in list_partitions(db)]
+            today = partition_name(partition_start(datetime.now(timezone.utc)))
+            assert "events_default" in names and today in names
+
+            db.add(Tenant(id='p20', name='p20', plan='starter', ingest_token='tok-p20', status='active'))
+            db.add(Agent(id='AG-20', tenant_id='p20'))
+            db.flush()
+            # evento além das partições pré-criadas cai na DEFAULT e é movido quando a partição surge
+            late = datetime.now(timezone.utc) + timedelta(days=60)
+            db.add(Event(tenant_id='p20', agent_id='AG-20', ts=late, event_type='login'))
+            db.commit()
+            where = text("SELECT tableoid::regclass::text FROM events WHERE tenant_id = 'p20'")
+            assert db.execute(where).scalar() == "events_default"
+            late_name = partition_name(partition_start(late))
+            assert ensure_partitions(db, now=late, ahead=0) == [late_name]
+            assert db.execute(where).scalar() == late_name
+            assert db.execute(text("SELECT count(*) FROM events_default")).scalar() == 0
+
+            # histórico (MINVALUE até hoje) inteiro antes do corte: desanexado e apagado com as linhas
+            old = datetime.now(timezone.utc) - timedelta(days=400)
+            assert ensure_partitions(db, now=old, ahead=0) == []
+            db.add(Event(tenant_id='p20', agent_id='AG-20', ts=old, event_type='login'))
+            db.commit()
+            assert db.execute(text(
+                "SELECT tableoid::regclass::text FROM events WHERE ts < now() - interval '1 day'")).scalar() == "events_history"
+            assert drop_expired_partitions(db, cutoff=partition_start(datetime.now(timezone.utc))) == ["events_history"]
+            left = {n for n, _, _ in list_partitions(db)}
+            assert "events_history" not in left and today in left and late_name in left
+            assert db.execute(text("SELECT count(*) FROM events WHERE tenant_id = 'p20'")).scalar() == 1
+        eng.dispose()
+    finally:
+        with admin.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        admin.dispose()
@@ -0,0 +1,47 @@
+import uuid
+from datetime import datetime
+from sqlalchemy import select
+from api.database import init_db, SessionLocal
+from api.models import Tenant, Event
+from api.bulk import prepare_event_rows, insert_event_rows
+from api.payloads import attach_payloads, load_payloads, payload_stats
+from api.rules import DETECTION_COLUMNS
+from api.ruleset import compile_rules
+
+
+def setup_module():
+    init_db()
+
+
+def test_payloads_stored_compressed_and_loaded_on_demand():
+    tid = f"t22-{uuid.uuid4().hex[:8]}"
+    now = datetime.utcnow()
+    items = [{"ts": now.isoformat(), "event_type": "auth_failed", "raw": {"message": f"Failed password for root port {1000 + i}"}} for i in range(50)]
+    items.append({"ts": now.isoformat(), "event_type": "login"})
+    with SessionLocal() as db:
+        db.add(Tenant(id=tid, name=tid, plan='starter', ingest_token=f"tok-{tid}", status='active'))
+        db.flush()
+        rows, _ = prepare_event_rows(tid, 'AG-22', items)
+        insert_event_rows(db, rows)
+        # evento antigo, gravado com raw_json inline
+        db.add(Event(tenant_id=tid, agent_id='AG-22', ts=now, event_type='legacy', raw_json={"message": "inline"}))
+        db.commit()
+        assert rows[0]["raw_json"] == {"message": "Failed password for root port 1000"}  # linhas em memória intactas
+
+        stored = db.execute(select(*DETECTION_COLUMNS).where(Event.tenant_id == tid)).mappings().all()
+        assert sum(r["raw_json"] is None for r in stored) == 51
+        loaded = attach_payloads(db, stored)
+        by_type = {r["event_type"]: r["raw_json"] for r in loaded}
+        assert by_type["legacy"] == {"message": "inline"} and by_type["login"] is None
+        assert {r["raw_json"]["message"] for r in loaded if r["event_type"] == "auth_failed"} == {f"Failed password for root port {1000 + i}" for i in range(50)}
+
+        ids = db.execute(select(Event.id).where(Event.tenant_id == tid).order_by(Event.id)).scalars().all()
+        assert load_payloads(db, tid, ids[:1]) == {ids[0]: {"message": "Failed password for root port 1000"}}
+        assert load_payloads(db, "other-tenant", ids[:1]) == {}
+        assert payload_stats(db)["ratio"] > 1
+
+
+def test_ruleset_needs_raw_only_for_payload_rules():
+    assert compile_rules([{"id": "a", "match": {"event_type": "x"}}]).needs_raw is False
+    assert compile_rules([{"id": "b", "match": {"message": {"contains": "sudo"}}}]).needs_raw is True
+    assert compile_rules([{"id": "c", "match": {"indicators": True}}]).needs_raw is True
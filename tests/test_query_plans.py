@@ -0,0 +1,68 @@
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import select, text
+from api.database import init_db, SessionLocal
+from api.models import Tenant, Event, Incident
+from api.rules import DETECTION_COLUMNS
+from api.rollups import incident_totals_stmt, record_incidents
+
+
+def setup_module():
+    init_db()
+
+
+def _seed(db, tenants=3, events=400, incidents=60):
+    now = datetime.utcnow()
+    tids = []
+    for _ in range(tenants):
+        tid = f"qp-{uuid.uuid4().hex[:8]}"
+        tids.append(tid)
+        db.add(Tenant(id=tid, name=tid, plan='starter', ingest_token=f"tok-{tid}", status='active'))
+        db.flush()
+        db.add_all(Event(tenant_id=tid, agent_id='AG-QP', ts=now - timedelta(minutes=i), host=f"h{i % 7}",
+                         event_type='auth_failed' if i % 3 else 'process_start', src_ip=f"198.51.100.{i % 50}")
+                   for i in range(events))
+        db.add_all(Incident(tenant_id=tid, kind='brute_force', severity=('low', 'medium', 'high')[i % 3],
+                            first_seen=now - timedelta(hours=i), last_seen=now - timedelta(hours=i), count=1,
+                            status='open' if i % 4 else 'resolved', fingerprint=f"{tid}-{i}")
+                    for i in range(incidents))
+        record_incidents(db, tid, ((now - timedelta(hours=i), ('low', 'medium', 'high')[i % 3], 'brute_force', 1) for i in range(incidents)))
+    db.commit()
+    return tids[0], now
+
+
+def _hot_queries(tid, now):
+    # Mesmas consultas de rules/detection/replay, main (incidentes, score, checklist) e security.require_tenant
+    since = now - timedelta(minutes=30)
+    return {
+        "rules_window": select(*DETECTION_COLUMNS).where(Event.tenant_id == tid, Event.ts >= since),
+        "replay_stream": select(*DETECTION_COLUMNS).where(Event.tenant_id == tid, Event.ts >= since).order_by(Event.ts, Event.id),
+        "incidents_latest": select(Incident).where(Incident.tenant_id == tid).order_by(Incident.last_seen.desc()).limit(200),
+        "incidents_by_status": select(Incident).where(Incident.tenant_id == tid, Incident.status == 'open').order_by(Incident.last_seen.desc()).limit(200),
+        "score": incident_totals_stmt(tid, now - timedelta(days=7)),
+        "checklist": select(Incident).where(Incident.tenant_id == tid, Incident.status == 'open'),
+        "require_tenant": select(Tenant).where(Tenant.ingest_token == f"tok-{tid}", Tenant.status == 'active'),
+    }
+
+
+def _full_scans(db, stmt):
+    dialect = db.get_bind().dialect
+    sql = str(stmt.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    if dialect.name == "postgresql":
+        # com poucas linhas o Postgres sempre prefere Seq Scan; desligado, só sobra quando não há índice
+        db.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = [r[0] for r in db.execute(text("EXPLAIN " + sql))]
+        return [line.strip() for line in plan if "Seq Scan" in line]
+    plan = [r[-1] for r in db.execute(text("EXPLAIN QUERY PLAN " + sql))]
+    # "SCAN t" é varredura da tabela; "SCAN t USING INDEX ..." percorre um índice
+    return [line for line in plan if line.startswith("SCAN ") and " INDEX " not in line]
+
+
+def test_hot_queries_use_indexes():
+    with SessionLocal() as db:
+        tid, now = _seed(db)
+        if db.get_bind().dialect.name == "sqlite":
+            db.execute(text("ANALYZE"))
+        scans = {name: _full_scans(db, stmt) for name, stmt in _hot_queries(tid, now).items()}
+        db.rollback()
+    assert {k: v for k, v in scans.items() if v} == {}
@@ -0,0 +1,263 @@
+import ipaddress
+import threading
+import time
+import uuid
+from sqlalchemy import delete
+from api.database import init_db, SessionLocal
+from api.models import IPReputation
+from api.reputation import ReputationResolver, resolve_many
+import api.reputation as reputation
+
+
+def setup_module():
+    init_db()
+
+
+def _fresh_ips(n):
+    # IPs novos a cada execução (100.64.0.0/10): data/app.db persiste o cache de reputação entre execuções
+    base = int(ipaddress.IPv4Address("100.64.0.0")) + (uuid.uuid4().int % (2 ** 22 - n))
+    return [str(ipaddress.IPv4Address(base + i)) for i in range(n)]
+
+
+def _forget(db, ips):
+    # para IPs fixos (faixas dos feeds): sem resto de execuções anteriores no cache do banco
+    db.execute(delete(IPReputation).where(IPReputation.ip.in_(ips)))
+    db.commit()
+
+
+class _Provider:
+    def __init__(self, delay=0.05, score=42):
+        self.delay = delay
+        self.score = score
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, session, ip, key):
+        with self.lock:
+            self.calls.append(ip)
+        time.sleep(self.delay)
+        return self.score
+
+
+def test_resolver_concurrent_and_singleflight():
+    slow = _Provider(delay=0.1)
+    r = ReputationResolver(workers=8, providers=[("fake", None, slow)])
+    ips = [f"198.51.100.{i}" for i in range(16)]
+    t0 = time.perf_counter()
+    first = r.submit(ips[0])
+    again = r.submit(ips[0])  # mesma consulta em andamento
+    res = r.resolve_many(ips + ips[:4])
+    elapsed = time.perf_counter() - t0
+    r.close()
+    assert first is again
+    assert res == {ip: (42, "fake") for ip in ips}
+    assert sorted(slow.calls) == sorted(ips)
+    assert elapsed < 0.1 * len(ips) / 2  # paralelo, não sequencial
+    assert r.stats()["collapsed"] >= 1
+
+
+def test_resolver_falls_through_providers():
+    def broken(session, ip, key):
+        raise RuntimeError("timeout")
+    r = ReputationResolver(workers=2, providers=[("a", None, broken), ("b", None, lambda s, ip, k: None), ("c", None, _Provider(0, 7))])
+    assert r.resolve_many(["192.0.2.1"]) == {"192.0.2.1": (7, "c")}
+    r.close()
+    assert r.stats()["errors"] == 1
+
+
+def test_resolve_many_uses_db_cache(monkeypatch):
+    from api.reputation import ReputationCache
+    prov = _Provider(delay=0, score=55)
+    monkeypatch.setattr(reputation, "resolver", ReputationResolver(workers=4, providers=[("fake", None, prov)]))
+    monkeypatch.setattr(reputation, "cache", ReputationCache())
+    cached, a, b = _fresh_ips(3)
+    with SessionLocal() as db:
+        db.merge(IPReputation(ip=cached, score=90, source="abuseipdb"))
+        db.commit()
+        scores = resolve_many(db, [cached, a, b, None])
+        assert db.get(IPReputation, a).source == "fake"
+    assert scores == {cached: 90, a: 55, b: 55}
+    assert sorted(prov.calls) == sorted([a, b])
+
+
+def test_cache_ttl_negative_stale_and_lru():
+    from api.reputation import ReputationCache
+    c = ReputationCache(capacity=2, ttl=100, negative_ttl=10, stale=50)
+    c.put("a", 70, "abuseipdb", updated_at=1000)
+    c.put("b", 0, "none", updated_at=1000)
+    assert c.get("a", now=1050) == ((70, "abuseipdb"), "fresh")
+    assert c.get("b", now=1005) == ((0, "none"), "fresh")
+    assert c.get("b", now=1011) == (None, None)          # negativo expira cedo e não é servido vencido
+    assert c.get("a", now=1120) == ((70, "abuseipdb"), "stale")
+    assert c.get("a", now=1151) == (None, None)
+    for ip in ("x", "y", "z"):
+        c.put(ip, 1, "ipinfo")
+    s = c.stats()
+    assert s["size"] == 2 and s["evictions"] == 1 and s["stale_hits"] == 1 and s["negative_hits"] == 1 and s["expired"] == 2
+
+
+def test_resolve_many_serves_stale_and_revalidates(monkeypatch):
+    from api.reputation import ReputationCache
+    prov = _Provider(delay=0, score=11)
+    mem = ReputationCache(ttl=100, negative_ttl=10, stale=1000)
+    monkeypatch.setattr(reputation, "resolver", ReputationResolver(workers=2, providers=[("fake", None, prov)]))
+    monkeypatch.setattr(reputation, "cache", mem)
+    mem.put("203.0.113.210", 99, "abuseipdb", updated_at=time.time() - 150)
+    with SessionLocal() as db:
+        assert resolve_many(db, ["203.0.113.210"]) == {"203.0.113.210": 99}
+        for _ in range(50):
+            if mem.get("203.0.113.210")[1] == "fresh":
+                break
+            time.sleep(0.02)
+        # já renovado: valor novo vem da memória, sem novo lookup
+        assert resolve_many(db, ["203.0.113.210"]) == {"203.0.113.210": 11}
+    assert prov.calls == ["203.0.113.210"]
+
+
+def test_cidr_feeds_lookup_and_reload(tmp_path, monkeypatch):
+    from api.feeds import ReputationFeeds
+    d = tmp_path / "feeds"
+    d.mkdir()
+    (d / "blocklist_spamhaus.txt").write_text("# drop list\n203.0.113.0/24 90\n203.0.113.128/25\n2001:db8::/32,70\nnot-a-cidr\n")
+    (d / "asn.csv").write_text("198.51.100.0/24,AS64500\n203.0.113.0/24,as64501\n")
+    (d / "country.txt").write_text("198.51.100.0/22 br\n")
+    (d / "README").write_text("ignorado")
+    f = ReputationFeeds(str(d), check_sec=0)
+    assert f.lookup("203.0.113.5") == {"blocklist": ("blocklist_spamhaus", 90), "asn": "AS64501"}
+    assert f.lookup("203.0.113.200")["blocklist"] == ("blocklist_spamhaus", 100)  # prefixo mais específico
+    assert f.lookup("2001:db8:1::1") == {"blocklist": ("blocklist_spamhaus", 70)}
+    assert f.lookup("198.51.101.9") == {"country": "BR"}
+    assert f.lookup("192.0.2.1") == {} and f.lookup("bogus") == {}
+    stats = f.stats()
+    assert stats["feeds"]["blocklist_spamhaus"]["ranges_v4"] == 2 and stats["feeds"]["blocklist_spamhaus"]["ranges_v6"] == 1
+    assert stats["memory_bytes"] == sum(x["memory_bytes"] for x in stats["feeds"].values()) > 0
+    # arquivo alterado: recompila e troca o conjunto inteiro
+    (d / "blocklist_spamhaus.txt").write_text("192.0.2.0/24 60\n")
+    assert f.maybe_reload(force=True)
+    assert f.lookup("203.0.113.5") == {"asn": "AS64501"}
+    assert f.lookup("192.0.2.1")["blocklist"] == ("blocklist_spamhaus", 60)
+    assert len(list((d / ".index").iterdir())) == 3
+
+    # blocklist local responde antes do cache e dos provedores
+    from api.reputation import ReputationCache
+    prov = _Provider(delay=0, score=5)
+    monkeypatch.setattr(reputation, "feeds", f)
+    monkeypatch.setattr(reputation, "resolver", ReputationResolver(workers=2, providers=[("fake", None, prov)]))
+    monkeypatch.setattr(reputation, "cache", ReputationCache())
+    with SessionLocal() as db:
+        _forget(db, ["192.0.2.77", "198.51.100.77"])
+        assert resolve_many(db, ["192.0.2.77", "198.51.100.77"]) == {"192.0.2.77": 60, "198.51.100.77": 5}
+        rep = db.get(IPReputation, "198.51.100.77")
+        assert (rep.asn, rep.country) == ("AS64500", "BR")
+    assert prov.calls == ["198.51.100.77"]
+    f.close()
+
+
+def test_resolve_many_costs_constant_round_trips(monkeypatch):
+    from sqlalchemy import event
+    from api.database import engine
+    from api.reputation import ReputationCache
+    prov = _Provider(delay=0, score=33)
+    monkeypatch.setattr(reputation, "resolver", ReputationResolver(workers=4, providers=[("fake", None, prov)]))
+    monkeypatch.setattr(reputation, "cache", ReputationCache())
+    ips = _fresh_ips(600)
+    with SessionLocal() as db:
+        db.merge(IPReputation(ip=ips[0], score=77, source="abuseipdb", asn="AS1"))
+        db.commit()
+        statements = []
+        listener = lambda conn, cursor, stmt, params, ctx, many: statements.append(stmt.split()[0].upper())
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            scores = resolve_many(db, ips)
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        rep = db.get(IPReputation, ips[1])
+    # 600 IPs: 2 SELECTs (lotes de 500) + 2 INSERTs em lote, independente de quantos IPs mudaram
+    assert statements.count("SELECT") == 2 and statements.count("INSERT") == 2
+    assert scores[ips[0]] == 77 and scores[ips[1]] == 33 and len(scores) == 600
+    assert (rep.score, rep.source) == (33, "fake")
+
+    # refresh de linha existente mantém ASN quando o feed não informa
+    with SessionLocal() as db:
+        reputation.upsert_many(db, {ips[0]: (10, "fake")})
+        rep = db.get(IPReputation, ips[0])
+        assert (rep.score, rep.asn) == (10, "AS1")
+
+
+class _FakeProviders:
+    """Servidor HTTP local que imita AbuseIPDB (/check) e ipinfo (/ipinfo/<ip>)."""
+
+    def __init__(self):
+        import json
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        fake = self
+        self.mode = "ok"  # ok | error | slow
+        self.hits = {"abuse": 0, "ipinfo": 0}
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.startswith("/check"):
+                    fake.hits["abuse"] += 1
+                    if fake.mode == "error":
+                        return self._send(503, {})
+                    if fake.mode == "slow":
+                        time.sleep(0.15)
+                    return self._send(200, {"data": {"abuseConfidenceScore": 88}})
+                fake.hits["ipinfo"] += 1
+                return self._send(200, {"bogon": False})
+
+            def _send(self, code, body):
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_circuit_breaker_and_budget_with_fake_provider(monkeypatch):
+    from api.reputation import CircuitBreaker, Provider, PROVIDERS
+    fake = _FakeProviders()
+    monkeypatch.setenv("ABUSEIPDB_KEY", "k")
+    monkeypatch.setenv("IPINFO_KEY", "k")
+    monkeypatch.setattr(reputation, "ABUSEIPDB_URL", fake.url + "/check")
+    monkeypatch.setattr(reputation, "IPINFO_URL", fake.url + "/ipinfo")
+    fns = {name: fn for name, _, fn in PROVIDERS}
+    abuse = Provider("abuseipdb", "ABUSEIPDB_KEY", fns["abuseipdb"], breaker=CircuitBreaker(failures=2, slo_ms=100, open_sec=0.2))
+    ipinfo = Provider("ipinfo", "IPINFO_KEY", fns["ipinfo"], budget_per_min=3)
+    ipinfo.budget = reputation.CallBudget(3, clock=lambda: 600.0)  # minuto fixo
+    r = ReputationResolver(workers=1, providers=[abuse, ipinfo])
+    try:
+        assert r.lookup("192.0.2.1") == (88, "abuseipdb")
+        fake.mode = "error"
+        assert r.lookup("192.0.2.2") == (20, "ipinfo")
+        fake.mode = "slow"  # responde, mas acima do SLO: conta como falha e abre o breaker
+        assert r.lookup("192.0.2.3") == (88, "abuseipdb")
+        assert abuse.stats()["state"] == "open"
+        hits = fake.hits["abuse"]
+        assert r.lookup("192.0.2.4") == (20, "ipinfo")
+        assert fake.hits["abuse"] == hits  # aberto: nem chega ao provedor
+        # orçamento do ipinfo (3/min) esgotado: sem provedor disponível
+        assert r.lookup("192.0.2.5") == (20, "ipinfo")
+        assert r.lookup("192.0.2.6") == (0, "none")
+        # depois de open_sec, uma sondagem bem-sucedida fecha o breaker
+        fake.mode = "ok"
+        time.sleep(0.25)
+        assert r.lookup("192.0.2.7") == (88, "abuseipdb")
+        s = r.stats()["providers"]
+    finally:
+        r.close()
+        fake.close()
+    assert s["abuseipdb"]["state"] == "closed" and s["abuseipdb"]["opens"] == 1 and s["abuseipdb"]["skipped_open"] == 3
+    assert s["ipinfo"]["used_this_minute"] == 3 and s["ipinfo"]["skipped_budget"] == 1
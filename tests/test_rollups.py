@@ -0,0 +1,40 @@
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from api.database import init_db, SessionLocal
+from api.models import Tenant, EventRollup
+from api.bulk import prepare_event_rows, insert_event_rows
+from api.rules import upsert_incidents, incident_fingerprint
+from api.rollups import compute_score, hourly_series, breakdown
+
+
+def setup_module():
+    init_db()
+
+
+def test_rollups_follow_ingest_and_detection():
+    tid = f"t21-{uuid.uuid4().hex[:8]}"
+    now = datetime.utcnow().replace(minute=30)
+    with SessionLocal() as db:
+        db.add(Tenant(id=tid, name=tid, plan='starter', ingest_token=f"tok-{tid}", status='active'))
+        db.commit()
+        items = [{"ts": (now - timedelta(hours=h)).isoformat(), "event_type": "auth_failed", "severity": "low"} for h in (0, 0, 1, 50)]
+        items.append({"ts": now.isoformat(), "event_type": None})
+        rows, _ = prepare_event_rows(tid, 'AG-21', items)
+        insert_event_rows(db, rows)
+        fp = incident_fingerprint("brute_force", "203.0.113.21")
+        upsert_incidents(db, tid, [(fp, "brute_force", "high", {})] * 2, now)
+        upsert_incidents(db, tid, [(fp, "brute_force", "high", {})], now)
+        db.commit()
+
+        total = db.execute(select(func.sum(EventRollup.count)).where(EventRollup.tenant_id == tid)).scalar()
+        assert total == 5
+        since = now - timedelta(days=1)
+        b = breakdown(db, tid, since)
+        assert b["event_types"] == {"auth_failed": 3, None: 1}
+        assert b["incident_kinds"] == {"brute_force": 3}
+        series = hourly_series(db, tid, since)
+        assert [s["count"] for s in series["events"] if s["severity"] == "low"] == [1, 2]
+        # 3 ocorrências high (peso 7) na janela
+        assert compute_score(db, tid, since) == 100 - 21
+        assert compute_score(db, tid, now - timedelta(days=30), now - timedelta(days=1)) == 100
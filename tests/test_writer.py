@@ -0,0 +1,92 @@
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import Session
+from api.database import Base, init_db, SessionLocal, sqlite_pragmas, tune_sqlite_engine
+from api.models import Tenant, Event
+from api.writer import EventInsertWriter
+from api import main
+
+
+def setup_module():
+    init_db()
+
+
+def _items(n, tag):
+    now = datetime.utcnow().isoformat()
+    return [{"ts": now, "host": tag, "event_type": "process_start", "severity": "low", "raw": {"i": i}} for i in range(n)]
+
+
+def test_writer_batches_jobs_from_all_tenants_in_one_transaction():
+    gate, entered = threading.Event(), threading.Event()
+    batches = []
+
+    def write_batch(db, jobs):
+        entered.set()
+        gate.wait(5)
+        batches.append([(j.tenant_id, len(j.items)) for j in jobs])
+
+    w = EventInsertWriter(write_batch, wait_ms=0, max_events=1000)
+    assert w.submit("a", "AG", _items(3, "x"))
+    # primeiro lote preso no handler; os seguintes acumulam na fila
+    assert entered.wait(5)
+    for tid in ("a", "b", "c"):
+        assert w.submit(tid, "AG", _items(2, "x"))
+    assert w.pending_events() == 9 and w.pending_events("b") == 2
+    gate.set()
+    assert w.drain()
+    w.stop()
+    assert batches == [[("a", 3)], [("a", 2), ("b", 2), ("c", 2)]]
+    s = w.stats()
+    assert s["transactions"] == 2 and s["written_events"] == 9 and s["max_batch_jobs"] == 3 and s["pending_events"] == 0
+
+
+def test_write_batch_persists_and_skips_bad_job(monkeypatch):
+    tids = [f"w-{uuid.uuid4().hex[:6]}" for _ in range(2)]
+    with SessionLocal() as db:
+        for tid in tids:
+            db.add(Tenant(id=tid, name=tid, plan='starter', ingest_token=f"tok-{tid}", status='active'))
+        db.commit()
+    scheduled = []
+    monkeypatch.setattr(main, "_schedule_post_process", lambda tid, rows: scheduled.append((tid, len(rows))))
+    w = EventInsertWriter(main._write_batch, wait_ms=50, enabled=True)
+    w.submit(tids[0], "AG-W", _items(5, "h1"))
+    w.submit(tids[1], "AG-W", [{"ts": "not-a-date"}], batch_id="bad")
+    w.submit(tids[1], "AG-W", _items(4, "h2"))
+    assert w.drain()
+    w.stop()
+    # regras ficam fora da thread de escrita, uma vez por tenant
+    assert sorted(scheduled) == sorted([(tids[0], 5), (tids[1], 4)])
+    with SessionLocal() as db:
+        counts = {tid: db.scalar(select(func.count()).select_from(Event).where(Event.tenant_id == tid)) for tid in tids}
+    assert counts == {tids[0]: 5, tids[1]: 4}
+    s = w.stats()
+    assert s["failed_transactions"] == 0 and s["failed_jobs"] == 1 and s["failed_events"] == 1
+    assert s["written_jobs"] == 2 and s["written_events"] == 9
+
+
+def test_tuned_engine_keeps_savepoints_inside_one_transaction(tmp_path):
+    # pysqlite sem BEGIN explícito: cada RELEASE SAVEPOINT confirmaria o job sozinho
+    eng = create_engine(f"sqlite:///{tmp_path}/t.db")
+    tune_sqlite_engine(eng)
+    Base.metadata.create_all(eng)
+    other = sqlite3.connect(tmp_path / "t.db")
+    with Session(eng) as db:
+        for i in range(2):
+            with db.begin_nested():
+                db.add(Tenant(id=f"sp{i}", name="x", plan="starter", ingest_token=f"sp{i}", status="active"))
+        assert other.execute("SELECT count(*) FROM tenants").fetchone()[0] == 0
+        db.commit()
+    assert other.execute("SELECT count(*) FROM tenants").fetchone()[0] == 2
+    other.close()
+    eng.dispose()
+
+
+def test_sqlite_pragmas(tmp_path):
+    conn = sqlite3.connect(tmp_path / "p.db")
+    sqlite_pragmas(conn, read_only=True)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA query_only").fetchone()[0] == 1
+    conn.close()